@@ -1,16 +1,20 @@
 import os
+import json
 import logging
 import secrets
 import datetime
 from datetime import datetime, timedelta
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify, flash, make_response
-from werkzeug.utils import secure_filename
+from flask import Flask, render_template, request, redirect, url_for, session, jsonify, flash, make_response, send_from_directory, abort, Response, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.orm import DeclarativeBase
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.middleware.proxy_fix import ProxyFix
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 from i18n import i18n
+from pagination import keyset_page, keyset_page_by, sort_order, clamp_page_size
+from conditional import conditional_get
+from response_cache import response_cache, LISTINGS_TAG, product_tag
+from assets import asset_pipeline
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -25,6 +29,15 @@ app = Flask(__name__)
 # Initialize i18n
 i18n.init_app(app)
 
+# Initialize conditional GET validators
+conditional_get.init_app(app)
+
+# Initialize shared response cache for anonymous pages
+response_cache.init_app(app)
+
+# Fingerprint and precompress static assets
+asset_pipeline.init_app(app)
+
 # Environment configurations
 app.secret_key = os.environ.get("SECRET_KEY", "flohmarkt_secret_key_production_2025")
 app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
@@ -44,6 +57,9 @@ ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('MAX_CONTENT_LENGTH', 16 * 1024 * 1024))  # 16MB default
 
+# Listing pagination
+app.config['PRODUCTS_PER_PAGE'] = int(os.environ.get('PRODUCTS_PER_PAGE', 24))
+
 # Create uploads directory
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
@@ -62,10 +78,42 @@ login_manager.login_message_category = 'error'
 
 # Import models after db initialization
 from models import User, Category, Product, PriceNegotiation, Message
+import migrations
+import queries
+import search
+import facets
+import counters
+import moderation
+import exports
+import importer
+from images import image_pipeline, image_src, image_srcset
+from uploads import upload_store
+from upload_gc import upload_collector
+from sitemaps import sitemap_store
+from outbox import outbox_dispatcher, enqueue_email
+from notifications import inbox_notifier
+from stats import admin_stats
+from compression import response_compression
+from user_cache import user_cache
+
+migrations.init_app(app)
+search.init_app(app)
+counters.init_app(app)
+exports.init_app(app)
+importer.init_app(app, on_imported=lambda ids: products_changed(*ids, created=True))
+upload_store.init_app(app)
+image_pipeline.init_app(app, on_processed=lambda product_id: products_changed(product_id))
+upload_collector.init_app(app)
+sitemap_store.init_app(app)
+outbox_dispatcher.init_app(app)
+inbox_notifier.init_app(app)
+admin_stats.init_app(app)
+response_compression.init_app(app)
+user_cache.init_app(app, on_changed=lambda ids: users_changed(*ids))
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return user_cache.load(user_id)
 
 def init_db():
     """Initialize database with tables and sample data"""
@@ -74,6 +122,10 @@ def init_db():
             db.create_all()
             logger.info("Database tables created successfully")
             
+            # Apply versioned schema migrations (disable with AUTO_MIGRATE=0)
+            if os.environ.get('AUTO_MIGRATE', '1') != '0':
+                migrations.upgrade()
+            
             # Create categories if they don't exist
             categories = [
                 'سيارات مستعملة', 'الهواتف المحمولة', 'الإلكترونيات', 
@@ -134,9 +186,51 @@ def admin_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def products_changed(*product_ids, created=False):
+    """Invalidate cached pages and facets after product rows change"""
+    # New products have no cached detail pages yet, so only listings are invalidated
+    page_tags = () if created else (product_tag(pid) for pid in product_ids)
+    response_cache.invalidate(LISTINGS_TAG, *page_tags)
+    facets.facets_cache.clear()
+    sitemap_store.mark_changed(*product_ids)
+
+def users_changed(*user_ids):
+    """Invalidate cached pages showing seller names or phone numbers after user rows change"""
+    # Runs after commit, when the request's session cannot issue SQL
+    with db.engine.connect() as conn:
+        product_ids = conn.execute(
+            db.select(Product.id).where(Product.user_id.in_(user_ids))
+        ).scalars().all()
+    response_cache.invalidate(LISTINGS_TAG, *(product_tag(pid) for pid in product_ids))
+
+def approved_products_query(category_name=None):
+    """Base query for storefront listings, optionally narrowed to a category name"""
+    query = Product.query.filter_by(status='approved')
+    if category_name:
+        category = Category.query.filter_by(name=category_name).first()
+        if category:
+            query = query.filter_by(category_id=category.id)
+    return query
+
+def product_card_data(product):
+    """Serialize a product for listing cards and the JSON listing API"""
+    return {
+        'id': product.id,
+        'name': product.name,
+        'description': product.description,
+        'price': product.price,
+        'image_url': product.image_url,
+        'thumbnail_url': image_src(product, 'thumb'),
+        'image_srcset': image_srcset(product),
+        'category_name': product.category.name if product.category else '',
+        'url': url_for('product_details', product_id=product.id),
+        'created_at': product.created_at.isoformat() if product.created_at else None
+    }
+
 # ===== Routes =====
 
 @app.route('/')
+@response_cache.cached(lambda **kw: [LISTINGS_TAG])
 def index():
     categories = Category.query.all()
     return render_template('index.html', categories=categories)
@@ -186,22 +280,83 @@ def api_categories():
         return jsonify({'error': 'Unauthorized'}), 401
     
     try:
-        categories = Category.query.all()
         categories_data = []
-        for cat in categories:
+        for cat, product_count in queries.categories_with_product_counts():
             categories_data.append({
                 'id': cat.id,
                 'name': cat.name,
-                'product_count': len(cat.products)
+                'product_count': product_count
             })
         return jsonify(categories_data)
     except Exception as e:
         logger.error(f"Error fetching categories: {e}")
         return jsonify({'error': 'فشل في تحميل الفئات'}), 500
 
+ADMIN_PAGE_SIZE = 50
+ADMIN_STREAM_BATCH_SIZE = 1000
+PRODUCT_STATUSES = ('pending', 'approved', 'rejected')
+
+def parse_date_arg(name, end_of_day=False, source=None):
+    """Parse a YYYY-MM-DD query argument; `end_of_day` makes it an exclusive upper bound"""
+    value = (request.args if source is None else source).get(name)
+    if not value:
+        return None
+    parsed = datetime.strptime(value, '%Y-%m-%d')
+    return parsed + timedelta(days=1) if end_of_day else parsed
+
+def parse_sort_arg(sorts, default='-created_at'):
+    """Map `sort=field` / `sort=-field` onto an allowed column; raises ValueError otherwise"""
+    value = request.args.get('sort') or default
+    column = sorts.get(value.lstrip('-'))
+    if column is None:
+        raise ValueError(f"Unsupported sort: {value}")
+    return column, value.startswith('-')
+
+def ndjson_response(rows, serialize):
+    """Stream one JSON object per line without materializing the result set"""
+    def generate():
+        try:
+            for row in rows:
+                yield json.dumps(serialize(row), ensure_ascii=False) + '\n'
+        except Exception as e:
+            logger.error(f"NDJSON stream failed: {e}")
+            raise
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+def admin_product_data(product):
+    return {
+        'id': product.id,
+        'name': product.name,
+        'description': product.description,
+        'price': product.price,
+        'category_id': product.category_id,
+        'category': product.category.name if product.category else 'غير محدد',
+        'seller_id': product.user_id,
+        'seller': product.user.fullname if product.user else 'غير محدد',
+        'seller_email': product.user.email if product.user else 'غير محدد',
+        'status': product.status,
+        'image_url': product.image_url,
+        'created_at': product.created_at.strftime('%Y-%m-%d %H:%M') if product.created_at else ''
+    }
+
+def admin_user_data(row):
+    user, product_count = row
+    return {
+        'id': user.id,
+        'fullname': user.fullname,
+        'email': user.email,
+        'phone': user.phone,
+        'role': user.role,
+        'product_count': product_count,
+        'created_at': user.created_at.strftime('%Y-%m-%d %H:%M') if user.created_at else ''
+    }
+
 @app.route('/api/admin/products')
 def api_admin_products():
-    """API endpoint to get all products for admin"""
+    """
+    Admin product list, paginated by cursor or streamed as NDJSON (`format=ndjson`)
+    Filters: status, category_id, seller_id, from/to (YYYY-MM-DD); sort: [-]created_at|price|name|id
+    """
     if not current_user.is_authenticated:
         return jsonify({'error': 'Unauthorized'}), 401
     
@@ -209,31 +364,44 @@ def api_admin_products():
         return jsonify({'error': 'Admin access required'}), 403
     
     try:
-        # Show all products for admin (no approval filtering needed)
-        products = Product.query.order_by(Product.created_at.desc()).all()
-        
-        products_data = []
-        for product in products:
-            products_data.append({
-                'id': product.id,
-                'name': product.name,
-                'description': product.description,
-                'price': product.price,
-                'category': product.category.name if product.category else 'غير محدد',
-                'seller': product.user.fullname if product.user else 'غير محدد',
-                'seller_email': product.user.email if product.user else 'غير محدد',
-                'status': product.status,
-                'image_url': product.image_url,
-                'created_at': product.created_at.strftime('%Y-%m-%d %H:%M') if product.created_at else ''
-            })
-        return jsonify(products_data)
+        status = request.args.get('status') or None
+        if status and status not in PRODUCT_STATUSES:
+            raise ValueError(f"Unsupported status: {status}")
+        query = queries.admin_products_query(
+            status=status,
+            category_id=request.args.get('category_id', type=int),
+            seller_id=request.args.get('seller_id', type=int),
+            created_from=parse_date_arg('from'),
+            created_to=parse_date_arg('to', end_of_day=True)
+        )
+        sort_column, descending = parse_sort_arg(queries.ADMIN_PRODUCT_SORTS)
+    except ValueError as e:
+        return jsonify({'error': 'معايير البحث غير صحيحة', 'detail': str(e)}), 400
+    
+    try:
+        if request.args.get('format') == 'ndjson':
+            rows = query.order_by(*sort_order(sort_column, Product.id, descending)).yield_per(ADMIN_STREAM_BATCH_SIZE)
+            return ndjson_response(rows, admin_product_data)
+        
+        products, next_cursor = keyset_page_by(
+            query, sort_column, Product.id, descending,
+            cursor=request.args.get('cursor'),
+            limit=clamp_page_size(request.args.get('limit'), ADMIN_PAGE_SIZE)
+        )
+        return jsonify({
+            'items': [admin_product_data(product) for product in products],
+            'next_cursor': next_cursor
+        })
     except Exception as e:
         logger.error(f"Error fetching admin products: {e}")
         return jsonify({'error': 'فشل في تحميل المنتجات'}), 500
 
 @app.route('/api/admin/users')
 def api_admin_users():
-    """API endpoint to get all users for admin"""
+    """
+    Admin user list with product counts, paginated by cursor or streamed as NDJSON
+    Filters: role, from/to (YYYY-MM-DD); sort: [-]created_at|fullname|email|id
+    """
     if not current_user.is_authenticated:
         return jsonify({'error': 'Unauthorized'}), 401
     
@@ -241,23 +409,89 @@ def api_admin_users():
         return jsonify({'error': 'Admin access required'}), 403
     
     try:
-        users = User.query.all()
-        users_data = []
-        for user in users:
-            users_data.append({
-                'id': user.id,
-                'fullname': user.fullname,
-                'email': user.email,
-                'phone': user.phone,
-                'role': user.role,
-                'product_count': len(user.products),
-                'created_at': user.created_at.strftime('%Y-%m-%d %H:%M') if user.created_at else ''
-            })
-        return jsonify(users_data)
+        query = queries.admin_users_query(
+            role=request.args.get('role') or None,
+            created_from=parse_date_arg('from'),
+            created_to=parse_date_arg('to', end_of_day=True)
+        )
+        sort_column, descending = parse_sort_arg(queries.ADMIN_USER_SORTS)
+    except ValueError as e:
+        return jsonify({'error': 'معايير البحث غير صحيحة', 'detail': str(e)}), 400
+    
+    try:
+        if request.args.get('format') == 'ndjson':
+            rows = query.order_by(*sort_order(sort_column, User.id, descending)).yield_per(ADMIN_STREAM_BATCH_SIZE)
+            return ndjson_response(rows, admin_user_data)
+        
+        users, next_cursor = keyset_page_by(
+            query, sort_column, User.id, descending,
+            cursor=request.args.get('cursor'),
+            limit=clamp_page_size(request.args.get('limit'), ADMIN_PAGE_SIZE),
+            entity=lambda row: row[0]
+        )
+        return jsonify({
+            'items': [admin_user_data(row) for row in users],
+            'next_cursor': next_cursor
+        })
     except Exception as e:
         logger.error(f"Error fetching admin users: {e}")
         return jsonify({'error': 'فشل في تحميل المستخدمين'}), 500
 
+@app.route('/api/admin/export/<dataset>')
+def api_admin_export(dataset):
+    """
+    Stream a dataset (products, users, messages, negotiations) as CSV or NDJSON
+    Query args: format=csv|ndjson, since=<ISO watermark>, gzip=1
+    """
+    if not current_user.is_authenticated:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Admin access required'}), 403
+    
+    fmt = request.args.get('format', 'csv')
+    compress = request.args.get('gzip') in ('1', 'true')
+    if dataset not in exports.DATASETS or fmt not in exports.FORMATS:
+        return jsonify({'error': 'نوع التصدير غير مدعوم'}), 400
+    try:
+        since = exports.parse_since(request.args.get('since'))
+    except ValueError:
+        return jsonify({'error': 'تاريخ البداية غير صحيح'}), 400
+    
+    logger.info(f"Export of {dataset} ({fmt}) started by admin {current_user.email}")
+    body = exports.encode_chunks(exports.iter_export(dataset, fmt, since), compress)
+    filename = exports.export_filename(dataset, fmt, compress)
+    mimetype = 'application/gzip' if compress else ('text/csv' if fmt == 'csv' else 'application/x-ndjson')
+    response = Response(stream_with_context(body), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+@app.route('/api/admin/cache_stats')
+def api_admin_cache_stats():
+    """API endpoint exposing cache hit rates for this worker"""
+    if not current_user.is_authenticated:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Admin access required'}), 403
+    
+    return jsonify({
+        'response_cache': response_cache.stats(),
+        'facets_cache': facets.facets_cache.stats(),
+        'user_cache': user_cache.stats()
+    })
+
+@app.route('/api/admin/compression_stats')
+def api_admin_compression_stats():
+    """API endpoint exposing per-route response compression savings for this worker"""
+    if not current_user.is_authenticated:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Admin access required'}), 403
+    
+    return jsonify(response_compression.stats())
+
 @app.route('/api/admin/product/<int:product_id>/approve', methods=['POST'])
 def api_approve_product(product_id):
     """API endpoint to approve a product"""
@@ -271,6 +505,7 @@ def api_approve_product(product_id):
         product = Product.query.get_or_404(product_id)
         product.status = 'approved'
         db.session.commit()
+        products_changed(product_id)
         logger.info(f"Product {product_id} approved by admin {current_user.email}")
         return jsonify({'success': True, 'message': 'تم قبول المنتج بنجاح'})
     except Exception as e:
@@ -291,6 +526,7 @@ def api_reject_product(product_id):
         product = Product.query.get_or_404(product_id)
         product.status = 'rejected'
         db.session.commit()
+        products_changed(product_id)
         logger.info(f"Product {product_id} rejected by admin {current_user.email}")
         return jsonify({'success': True, 'message': 'تم رفض المنتج'})
     except Exception as e:
@@ -298,6 +534,71 @@ def api_reject_product(product_id):
         logger.error(f"Error rejecting product {product_id}: {e}")
         return jsonify({'error': 'فشل في رفض المنتج'}), 500
 
+def bulk_filter_ids(filters, after_id=0):
+    """Product ids matching admin filters, in id order; returns (ids, next_after_id)"""
+    status = filters.get('status') or None
+    if status and status not in PRODUCT_STATUSES:
+        raise ValueError(f"Unsupported status: {status}")
+    query = queries.filter_products(
+        db.session.query(Product.id).filter(Product.id > after_id),
+        status=status,
+        category_id=int(filters['category_id']) if filters.get('category_id') else None,
+        seller_id=int(filters['seller_id']) if filters.get('seller_id') else None,
+        created_from=parse_date_arg('from', source=filters),
+        created_to=parse_date_arg('to', end_of_day=True, source=filters)
+    )
+    limit = moderation.MAX_PRODUCTS_PER_REQUEST
+    ids = [product_id for (product_id,) in query.order_by(Product.id).limit(limit + 1)]
+    if len(ids) > limit:
+        return ids[:limit], ids[limit - 1]
+    return ids, None
+
+@app.route('/api/admin/products/bulk', methods=['POST'])
+def api_bulk_moderate_products():
+    """
+    Approve, reject or delete many products in one request
+    Body: {"action": "approve|reject|delete", "ids": [...]} or {"action": ..., "filter": {...}};
+    filter mode handles a batch per call and returns `cursor` to pass back as `after_id`
+    """
+    if not current_user.is_authenticated:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Admin access required'}), 403
+    
+    data = request.get_json(silent=True) or {}
+    action = data.get('action')
+    try:
+        if action not in moderation.ACTIONS:
+            raise ValueError(f"Unsupported action: {action}")
+        if isinstance(data.get('ids'), list):
+            product_ids = [int(product_id) for product_id in data['ids']]
+            if len(product_ids) > moderation.MAX_PRODUCTS_PER_REQUEST:
+                raise ValueError(f"At most {moderation.MAX_PRODUCTS_PER_REQUEST} ids per request")
+            cursor = None
+        elif isinstance(data.get('filter'), dict):
+            product_ids, cursor = bulk_filter_ids(data['filter'], after_id=int(data.get('after_id') or 0))
+        else:
+            raise ValueError('Either ids or filter is required')
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': 'طلب غير صحيح', 'detail': str(e)}), 400
+    
+    results, changed = moderation.bulk_moderate(action, product_ids)
+    if changed:
+        products_changed(*changed)
+    
+    summary = {}
+    for result in results.values():
+        summary[result] = summary.get(result, 0) + 1
+    logger.info(f"Bulk {action} by admin {current_user.email}: {summary}")
+    
+    return jsonify({
+        'success': 'error' not in summary,
+        'results': {str(product_id): result for product_id, result in results.items()},
+        'summary': summary,
+        'cursor': cursor
+    })
+
 @app.route('/register', methods=['GET', 'POST'])
 def register():
     if request.method == 'POST':
@@ -465,47 +766,138 @@ def reset_password(token):
 @login_required
 def logout():
     user_name = current_user.fullname
+    user_id = current_user.id
     logout_user()
+    user_cache.invalidate(user_id)
     flash(f'وداعاً {user_name}، تم تسجيل الخروج بنجاح', 'success')
     return redirect(url_for('index'))
 
 @app.route('/products')
+@response_cache.cached(lambda **kw: [LISTINGS_TAG])
 def products():
     category_name = request.args.get('category')
-    products = Product.query.filter_by(status='approved')
+    products, next_cursor = keyset_page(
+        approved_products_query(category_name), Product,
+        request.args.get('cursor'), app.config['PRODUCTS_PER_PAGE']
+    )
+    categories = facets.get_facets()['categories']
     
+    # Answer revalidation requests before rendering anything
+    validators = conditional_get.validators(
+        max((p.updated_at for p in products if p.updated_at), default=None),
+        [(p.id, p.updated_at) for p in products],
+        next_cursor,
+        [(c['name'], c['count']) for c in categories]
+    )
+    not_modified = conditional_get.not_modified(validators)
+    if not_modified:
+        return not_modified
+    
+    response = make_response(render_template('products.html', products=products, categories=categories,
+                                             selected_category=category_name, next_cursor=next_cursor))
+    return conditional_get.apply(response, validators)
+
+@app.route('/api/products')
+def api_products():
+    """JSON twin of /products for infinite scroll, paged by an opaque cursor"""
+    try:
+        limit = clamp_page_size(request.args.get('limit'), app.config['PRODUCTS_PER_PAGE'])
+        query = queries.products_with_relations(approved_products_query(request.args.get('category')))
+        products, next_cursor = keyset_page(query, Product, request.args.get('cursor'), limit)
+        return jsonify({
+            'success': True,
+            'products': [product_card_data(product) for product in products],
+            'next_cursor': next_cursor
+        })
+    except Exception as e:
+        logger.error(f"Error fetching products page: {e}")
+        return jsonify({'success': False, 'message': 'فشل في تحميل المنتجات'}), 500
+
+@app.route('/api/facets')
+def api_facets():
+    """Category counts and price histogram for the current listing filters"""
+    category_id = None
+    category_name = request.args.get('category')
     if category_name:
         category = Category.query.filter_by(name=category_name).first()
         if category:
-            products = products.filter_by(category_id=category.id)
+            category_id = category.id
     
-    products = products.order_by(Product.created_at.desc()).all()
-    categories = Category.query.all()
+    try:
+        return jsonify(dict(
+            facets.get_facets(
+                category_id,
+                request.args.get('min_price', type=float),
+                request.args.get('max_price', type=float)
+            ),
+            success=True
+        ))
+    except Exception as e:
+        logger.error(f"Error computing facets: {e}")
+        return jsonify({'success': False, 'message': 'فشل في تحميل عوامل التصفية'}), 500
+
+@app.route('/api/search')
+def api_search():
+    """Ranked full-text search over approved products"""
+    query_string = request.args.get('q', '').strip()
+    page = request.args.get('page', 1, type=int)
+    limit = clamp_page_size(request.args.get('limit'), app.config['PRODUCTS_PER_PAGE'])
+    
+    category_id = None
+    category_name = request.args.get('category')
+    if category_name:
+        category = Category.query.filter_by(name=category_name).first()
+        if category:
+            category_id = category.id
     
-    return render_template('products.html', products=products, categories=categories, selected_category=category_name)
+    try:
+        results, has_more = search.search_products(query_string, category_id, page, limit)
+        return jsonify({
+            'success': True,
+            'query': query_string,
+            'page': page,
+            'has_more': has_more,
+            'products': [product_card_data(product) for product in results]
+        })
+    except Exception as e:
+        logger.error(f"Search error for '{query_string}': {e}")
+        return jsonify({'success': False, 'message': 'فشل البحث'}), 500
 
 @app.route('/product/<int:product_id>')
+@response_cache.cached(lambda product_id: [product_tag(product_id)])
 def product_details(product_id):
-    # Get product with seller information
-    product = db.session.query(Product, User.phone.label('seller_phone')).join(
-        User, Product.user_id == User.id
-    ).filter(Product.id == product_id, Product.status == 'approved').first_or_404()
+    # Get product with category and seller information in one query
+    product = queries.products_with_relations().filter(
+        Product.id == product_id, Product.status == 'approved'
+    ).first_or_404()
     
     # Convert to dict format for template compatibility
     product_dict = {
-        'id': product.Product.id,
-        'name': product.Product.name,
-        'description': product.Product.description,
-        'price': product.Product.price,
-        'image_url': product.Product.image_url,
-        'category_name': product.Product.category.name if product.Product.category else '',
-        'fullname': product.Product.user.fullname,
-        'user_id': product.Product.user_id,
-        'seller_phone': product.seller_phone,
-        'created_at': product.Product.created_at
+        'id': product.id,
+        'name': product.name,
+        'description': product.description,
+        'price': product.price,
+        'image_url': product.image_url,
+        'image_variants': product.image_variants,
+        'category_name': product.category.name if product.category else '',
+        'fullname': product.user.fullname,
+        'user_id': product.user_id,
+        'seller_phone': product.user.phone,
+        'created_at': product.created_at
     }
     
-    return render_template('product_details.html', product=product_dict)
+    # Answer revalidation requests before rendering anything
+    validators = conditional_get.validators(
+        product.updated_at,
+        product.id, product.updated_at, product_dict['category_name'],
+        product_dict['fullname'], product_dict['seller_phone']
+    )
+    not_modified = conditional_get.not_modified(validators)
+    if not_modified:
+        return not_modified
+    
+    response = make_response(render_template('product_details.html', product=product_dict))
+    return conditional_get.apply(response, validators)
 
 @app.route('/add_product', methods=['GET', 'POST'])
 @login_required
@@ -526,12 +918,7 @@ def add_product():
             if 'image' in request.files:
                 file = request.files['image']
                 if file and file.filename and allowed_file(file.filename):
-                    filename = secure_filename(file.filename)
-                    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_')
-                    filename = timestamp + filename
-                    file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                    file.save(file_path)
-                    image_url = f"/static/uploads/{filename}"
+                    image_url = upload_store.save(file)
             
             # Create product
             product = Product()
@@ -546,7 +933,10 @@ def add_product():
             flash('تم إضافة المنتج بنجاح وتم نشره فوراً في المتجر', 'success')
             
             db.session.add(product)
+            upload_store.retain(image_url)
             db.session.commit()
+            products_changed(product.id)
+            image_pipeline.submit(product.id, image_url)
             return redirect(url_for('my_products'))
             
         except Exception as e:
@@ -557,11 +947,47 @@ def add_product():
     categories = Category.query.all()
     return render_template('add_product.html', categories=categories)
 
+@app.route('/api/products/import', methods=['POST'])
+@login_required
+def api_import_products():
+    """
+    Bulk-import products from CSV or JSON Lines, uploaded as `file` or sent as the raw body
+    Sellers import their own products; admins may import on behalf of a seller with `seller_id`
+    """
+    seller_id = current_user.id
+    if request.args.get('seller_id') and current_user.role != 'admin':
+        return jsonify({'success': False, 'message': 'Admin access required'}), 403
+    if request.args.get('seller_id'):
+        seller = db.session.get(User, request.args.get('seller_id', type=int) or 0)
+        if seller is None:
+            return jsonify({'success': False, 'message': 'البائع غير موجود'}), 400
+        seller_id = seller.id
+    
+    upload = request.files.get('file')
+    if upload is not None:
+        stream, filename, content_type = upload.stream, upload.filename, upload.mimetype
+    else:
+        stream, filename, content_type = request.stream, None, request.mimetype
+    fmt = request.args.get('format') or importer.detect_format(filename, content_type)
+    if fmt not in importer.FORMATS:
+        return jsonify({'success': False, 'message': 'صيغة الملف غير مدعومة'}), 400
+    
+    result = importer.import_products(stream, fmt, seller_id)
+    if result.inserted_ids:
+        products_changed(*result.inserted_ids, created=True)
+    summary = result.as_dict()
+    logger.info(f"Imported {summary['inserted']} product(s) for seller {seller_id}, "
+                f"{summary['failed']} failed, {summary['rows_per_second']} rows/s")
+    return jsonify({'success': not summary['aborted'], **summary})
+
 @app.route('/my_products')
 @login_required
 def my_products():
-    products = Product.query.filter_by(user_id=current_user.id).order_by(Product.created_at.desc()).all()
-    return render_template('my_products.html', products=products)
+    products, next_cursor = keyset_page(
+        Product.query.filter_by(user_id=current_user.id), Product,
+        request.args.get('cursor'), app.config['PRODUCTS_PER_PAGE']
+    )
+    return render_template('my_products.html', products=products, next_cursor=next_cursor)
 
 @app.route('/seller_inbox')
 @login_required
@@ -579,7 +1005,7 @@ def seller_inbox():
             Product.user_id == current_user.id
         ).order_by(Message.created_at.desc())
     
-    pagination = messages_query.paginate(
+    pagination = queries.messages_with_product(messages_query).paginate(
         page=page, 
         per_page=per_page, 
         error_out=False
@@ -606,8 +1032,12 @@ def delete_product(product_id):
         return redirect(url_for('my_products'))
     
     try:
+        image_url = product.image_url
+        upload_store.release(image_url)
         db.session.delete(product)
         db.session.commit()
+        products_changed(product_id)
+        upload_store.remove_unreferenced([image_url])
         flash('تم حذف المنتج بنجاح', 'success')
         logger.info(f"Product {product_id} deleted by user {current_user.email}")
     except Exception as e:
@@ -639,15 +1069,19 @@ def edit_product(product_id):
             product.category_id = int(request.form.get('category_id', 0))
             
             # Handle image upload if provided
+            new_image_url = old_image_url = None
             if 'image' in request.files:
                 file = request.files['image']
                 if file and file.filename and allowed_file(file.filename):
-                    filename = secure_filename(file.filename)
-                    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_')
-                    filename = timestamp + filename
-                    file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                    file.save(file_path)
-                    product.image_url = f"/static/uploads/{filename}"
+                    image_url = upload_store.save(file)
+                    # Re-uploading the same file resolves to the same URL and changes nothing
+                    if image_url != product.image_url:
+                        old_image_url = product.image_url
+                        upload_store.retain(image_url)
+                        upload_store.release(old_image_url)
+                        product.image_url = new_image_url = image_url
+                        # Old variants belong to the previous image; cards use the original until reprocessed
+                        product.image_variants = None
             
             # Admin can change status
             if current_user.role == 'admin':
@@ -656,6 +1090,9 @@ def edit_product(product_id):
                     product.status = status
             
             db.session.commit()
+            products_changed(product_id)
+            upload_store.remove_unreferenced([old_image_url])
+            image_pipeline.submit(product_id, new_image_url)
             flash('تم تحديث المنتج بنجاح', 'success')
             logger.info(f"Product {product_id} updated by user {current_user.email}")
             
@@ -675,13 +1112,18 @@ def edit_product(product_id):
 
 
 @app.route('/jobs')
+@response_cache.cached(lambda **kw: [LISTINGS_TAG])
 def jobs():
     category = Category.query.filter_by(name='فرص عمل').first()
     jobs = []
+    next_cursor = None
     if category:
-        jobs = Product.query.filter_by(category_id=category.id, status='approved').order_by(Product.created_at.desc()).all()
+        jobs, next_cursor = keyset_page(
+            Product.query.filter_by(category_id=category.id, status='approved'), Product,
+            request.args.get('cursor'), app.config['PRODUCTS_PER_PAGE']
+        )
     
-    return render_template('jobs.html', jobs=jobs)
+    return render_template('jobs.html', jobs=jobs, next_cursor=next_cursor)
 
 # ===== Admin Routes =====
 
@@ -689,30 +1131,13 @@ def jobs():
 @app.route('/admin_panel')
 @admin_required
 def admin_panel():
-    # Statistics
-    total_users = User.query.count()
-    total_products = Product.query.count()
-    pending_products = Product.query.filter_by(status='pending').count()
-    approved_products = Product.query.filter_by(status='approved').count()
-    total_messages = Message.query.count()
-    unread_messages = Message.query.filter_by(is_read=False).count()
+    # Statistics from the snapshot table, recomputed in one query only when stale
+    stats = admin_stats.get()
     
-    # Recent products for approval
-    pending_products_list = Product.query.filter_by(status='pending').order_by(Product.created_at.desc()).limit(10).all()
+    # Recent products for the overview table
+    recent_products = queries.products_with_relations().order_by(Product.created_at.desc()).limit(10).all()
     
-    # Recent messages for review
-    recent_messages = Message.query.order_by(Message.created_at.desc()).limit(10).all()
-    
-    stats = {
-        'total_users': total_users,
-        'total_products': total_products,
-        'pending_products': pending_products,
-        'approved_products': approved_products,
-        'total_messages': total_messages,
-        'unread_messages': unread_messages
-    }
-    
-    return render_template('admin_panel.html', stats=stats, pending_products=pending_products_list, recent_messages=recent_messages)
+    return render_template('admin_panel.html', stats=stats, recent_products=recent_products)
 
 @app.route('/admin/approve_product/<int:product_id>', methods=['POST'])
 @admin_required
@@ -721,6 +1146,7 @@ def approve_product(product_id):
         product = Product.query.get_or_404(product_id)
         product.status = 'approved'
         db.session.commit()
+        products_changed(product_id)
         
         flash(f'تمت الموافقة على المنتج: {product.name}', 'success')
         
@@ -738,6 +1164,7 @@ def reject_product(product_id):
         product = Product.query.get_or_404(product_id)
         product.status = 'rejected'
         db.session.commit()
+        products_changed(product_id)
         
         flash(f'تم رفض المنتج: {product.name}', 'success')
         
@@ -754,18 +1181,15 @@ def delete_product_admin(product_id):
     try:
         product = Product.query.get_or_404(product_id)
         
-        # Delete image file if exists
-        if product.image_url and product.image_url.startswith('/static/uploads/'):
-            try:
-                image_path = product.image_url[1:]  # Remove leading slash
-                if os.path.exists(image_path):
-                    os.remove(image_path)
-            except Exception as e:
-                logger.warning(f"Failed to delete image file: {str(e)}")
+        # Other products may share the file, so it is only removed once unreferenced
+        image_url = product.image_url
+        upload_store.release(image_url)
         
         product_name = product.name
         db.session.delete(product)
         db.session.commit()
+        products_changed(product_id)
+        upload_store.remove_unreferenced([image_url])
         
         flash(f'تم حذف المنتج: {product_name}', 'success')
         
@@ -866,16 +1290,9 @@ def contact_seller():
         message.message_text = message_text
         message.is_read = False
         
-        db.session.add(message)
-        db.session.commit()
-        
-        # Log the message
-        logger.info(f"New message from {buyer_email} to seller {seller.email} for product {product.name}")
-        
-        # Send real email notification to seller
-        try:
-            email_subject = f"رسالة جديدة بخصوص منتجك: {product.name}"
-            email_content = f"""
+        # Queue the seller notification in the same transaction as the message
+        email_subject = f"رسالة جديدة بخصوص منتجك: {product.name}"
+        email_content = f"""
 مرحباً {seller.fullname},
 
 لديك رسالة جديدة بخصوص منتجك: {product.name}
@@ -889,22 +1306,17 @@ def contact_seller():
 تحياتي،
 فريق فلوماركت
             """
-            
-            success = send_email_notification(seller.email, email_subject, email_content)
-            if success:
-                logger.info(f"✅ EMAIL DELIVERY CONFIRMED - Message sent to seller: {seller.email}")
-                # Update message record to mark as email sent
-                message.email_sent = True
-                message.email_sent_at = datetime.utcnow()
-                db.session.commit()
-            else:
-                logger.error(f"❌ EMAIL DELIVERY FAILED - Could not send to: {seller.email}")
-                message.email_sent = False
-                db.session.commit()
-            
-        except Exception as email_error:
-            logger.warning(f"Failed to send email notification: {str(email_error)}")
-            # Don't fail the whole process if email fails
+        message.email_sent = False
+        enqueue_email(seller.email, email_subject, email_content, message=message)
+        
+        db.session.add(message)
+        counters.adjust_unread(product.user_id, 1)
+        db.session.commit()
+        outbox_dispatcher.notify()
+        inbox_notifier.bump(product.user_id)
+        
+        # Log the message
+        logger.info(f"New message from {buyer_email} to seller {seller.email} for product {product.name}")
         
         return jsonify({
             'success': True,
@@ -985,7 +1397,7 @@ def seller_reply():
         reply_record.is_reply = True  # Mark as seller reply
         reply_record.parent_message_id = message_id
         
-        # Send email reply
+        # Queue the email reply
         email_content = f"""
 مرحباً {original_message.buyer_name},
 
@@ -1002,30 +1414,22 @@ def seller_reply():
 فلوماركت
         """
         
-        # Try to send email, but don't fail if email service is down
-        email_success = False
-        try:
-            email_success = send_email_notification(to_email, subject, email_content)
-            logger.info(f"Email send attempt result: {email_success}")
-        except Exception as email_error:
-            logger.warning(f"Email sending failed, but continuing with reply: {str(email_error)}")
-        
-        # Save the reply record regardless of email status
+        # Save the reply and its outbox email together; delivery happens in the background
         try:
             db.session.add(reply_record)
+            enqueue_email(to_email, subject, email_content, message=reply_record)
             # Mark original message as read
-            original_message.is_read = True
+            counters.set_read_state(original_message, product.user_id, True)
             db.session.commit()
+            outbox_dispatcher.notify()
+            inbox_notifier.bump(product.user_id)
             logger.info(f"✅ REPLY SAVED - From seller {current_user.email} to buyer {to_email}")
             
-            response_message = '✅ تم إرسال الرد بنجاح!'
-            if not email_success:
-                response_message += ' (تم حفظ الرد، ولكن قد يكون هناك تأخير في إرسال البريد الإلكتروني)'
-            
             return jsonify({
                 'success': True, 
-                'message': response_message,
-                'email_sent': email_success
+                'message': '✅ تم إرسال الرد بنجاح!',
+                'email_queued': True,
+                'reply_id': reply_record.id
             })
             
         except Exception as save_error:
@@ -1060,8 +1464,9 @@ def mark_message_read():
         if current_user.role != 'admin' and product.user_id != current_user.id:
             return jsonify({'success': False, 'message': 'ليس لديك صلاحية لتعديل هذه الرسالة'})
         
-        message.is_read = mark_as_read
+        counters.set_read_state(message, product.user_id, mark_as_read)
         db.session.commit()
+        inbox_notifier.bump(product.user_id)
         
         status_text = 'مقروءة' if mark_as_read else 'غير مقروءة'
         return jsonify({'success': True, 'message': f'تم تحديث حالة الرسالة إلى {status_text}'})
@@ -1076,22 +1481,47 @@ def mark_message_read():
 def unread_messages_count():
     """Get count of unread messages for current user"""
     try:
-        if current_user.role == 'admin':
-            # Admin can see all unread messages
-            count = Message.query.filter_by(is_read=False).count()
-        else:
-            # Regular users see unread messages for their products
-            count = Message.query.join(Product).filter(
-                Product.user_id == current_user.id,
-                Message.is_read == False
-            ).count()
-        
+        # Admin sees all unread messages, sellers those for their products
+        count = queries.unread_message_count(current_user.id, current_user.role == 'admin')
         return jsonify({'success': True, 'count': count})
         
     except Exception as e:
         logger.error(f"Unread messages count error: {str(e)}")
         return jsonify({'success': False, 'count': 0})
 
+@app.route('/api/inbox/stream')
+@login_required
+def inbox_stream():
+    """Server-Sent Events stream of unread counts and new inbox messages"""
+    if not inbox_notifier.acquire():
+        # Every stream slot of this worker is taken; the page polls until it retries
+        retry = inbox_notifier.busy_retry_seconds
+        return Response(f"retry: {retry * 1000}\n\n", status=503, mimetype='text/event-stream', headers={
+            'Cache-Control': 'no-cache',
+            'Retry-After': str(retry)
+        })
+    try:
+        last_event_id = request.headers.get('Last-Event-ID')
+        events = inbox_notifier.stream(current_user.id, current_user.role == 'admin', last_event_id)
+        response = Response(stream_with_context(events), mimetype='text/event-stream', headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        })
+    except BaseException:
+        inbox_notifier.release()
+        raise
+    response.call_on_close(inbox_notifier.release)
+    return response
+
+def thread_reply_data(reply):
+    return {
+        'id': reply.id,
+        'message': reply.message_text,
+        'sender_type': 'seller' if reply.is_reply else 'buyer',
+        'sender_name': reply.buyer_name,
+        'created_at': reply.created_at.strftime('%Y-%m-%d %H:%M')
+    }
+
 @app.route('/api/message_thread/<int:message_id>')
 @login_required
 def message_thread(message_id):
@@ -1108,19 +1538,9 @@ def message_thread(message_id):
         # Get all replies for this message
         replies = Message.query.filter_by(parent_message_id=message_id).order_by(Message.created_at.asc()).all()
         
-        replies_data = []
-        for reply in replies:
-            replies_data.append({
-                'id': reply.id,
-                'message': reply.message_text,
-                'sender_type': 'seller' if reply.is_reply else 'buyer',
-                'sender_name': reply.buyer_name,
-                'created_at': reply.created_at.strftime('%Y-%m-%d %H:%M')
-            })
-        
         return jsonify({
             'success': True,
-            'replies': replies_data,
+            'replies': [thread_reply_data(reply) for reply in replies],
             'original_message': {
                 'id': original_message.id,
                 'message': original_message.message_text,
@@ -1133,62 +1553,47 @@ def message_thread(message_id):
         logger.error(f"Message thread error: {str(e)}")
         return jsonify({'success': False, 'message': 'حدث خطأ أثناء جلب المحادثة'})
 
-def send_email_notification(to_email, subject, content):
-    """Send real email notification using SendGrid"""
+MAX_THREADS_PER_REQUEST = 50
+MAX_THREAD_REPLIES_PER_REQUEST = 200
+
+@app.route('/api/message_threads')
+@login_required
+def message_threads():
+    """
+    New replies for several inbox threads in one query
+    `ids` lists parent message ids; `since` is the highest reply id the client already has
+    """
     try:
-        import os
-        from sendgrid import SendGridAPIClient
-        from sendgrid.helpers.mail import Mail
-        
-        # Check if SendGrid API key is available
-        sendgrid_key = os.environ.get('SENDGRID_API_KEY')
-        if not sendgrid_key:
-            logger.warning("SendGrid API key not found - email sending disabled")
-            logger.info(f"Email content for {to_email}: {content}")
-            return False
-        
-        # Create email message with proper formatting
-        html_content = f"""
-        <div style="font-family: Arial, sans-serif; direction: rtl; text-align: right;">
-            <h2 style="color: #2c5aa0;">رسالة جديدة من فلوماركت</h2>
-            {content.replace(chr(10), '<br>')}
-            <hr style="margin: 20px 0;">
-            <p style="color: #666; font-size: 14px;">
-                هذه رسالة تلقائية من موقع فلوماركت. يرجى عدم الرد على هذا البريد الإلكتروني.
-            </p>
-        </div>
-        """
-        
-        message = Mail(
-            from_email='noreply@flowmarket.com',
-            to_emails=to_email,
-            subject=subject,
-            html_content=html_content
-        )
-        
-        # Send email with detailed logging
-        sg = SendGridAPIClient(sendgrid_key)
-        response = sg.send(message)
+        ids = [int(value) for value in request.args.get('ids', '').split(',') if value.strip()]
+        since = int(request.args.get('since', 0))
+    except ValueError:
+        return jsonify({'success': False, 'message': 'معرفات المحادثات غير صحيحة'}), 400
+    
+    ids = ids[:MAX_THREADS_PER_REQUEST]
+    if not ids:
+        return jsonify({'success': True, 'threads': {}, 'cursor': since, 'has_more': False})
+    
+    try:
+        # Threads the user does not own simply return no replies
+        replies = queries.thread_replies(current_user.id, current_user.role == 'admin', ids,
+                                         after_id=since, limit=MAX_THREAD_REPLIES_PER_REQUEST + 1)
+        has_more = len(replies) > MAX_THREAD_REPLIES_PER_REQUEST
+        replies = replies[:MAX_THREAD_REPLIES_PER_REQUEST]
         
-        # Log detailed response information
-        logger.info(f"SendGrid Response Status: {response.status_code}")
-        logger.info(f"SendGrid Response Headers: {dict(response.headers)}")
+        threads = {}
+        for reply in replies:
+            threads.setdefault(str(reply.parent_message_id), []).append(thread_reply_data(reply))
         
-        if response.status_code == 202:
-            logger.info(f"✅ Message Sent Successfully to: {to_email}")
-            logger.info(f"Email Subject: {subject}")
-            return True
-        else:
-            logger.error(f"❌ Failed to Send - SendGrid error: {response.status_code}")
-            logger.error(f"Response body: {response.body}")
-            logger.error(f"Response headers: {dict(response.headers)}")
-            return False
+        return jsonify({
+            'success': True,
+            'threads': threads,
+            'cursor': replies[-1].id if replies else since,
+            'has_more': has_more
+        })
         
     except Exception as e:
-        logger.error(f"Email sending error: {str(e)}")
-        # Always log the email content for debugging
-        logger.info(f"Email content for {to_email}:{content}")
-        return False
+        logger.error(f"Message threads error: {str(e)}")
+        return jsonify({'success': False, 'message': 'حدث خطأ أثناء جلب المحادثات'})
 
 @app.route('/api/respond_negotiation', methods=['POST'])
 @login_required
@@ -1243,10 +1648,8 @@ def get_product_negotiations(product_id):
             return jsonify({'success': False, 'message': 'غير مخول لك عرض هذه البيانات'})
         
         # Get negotiations
-        negotiations = PriceNegotiation.query.filter_by(product_id=product_id).order_by(PriceNegotiation.created_at.desc()).all()
-        
         negotiations_data = []
-        for neg in negotiations:
+        for neg in queries.product_negotiations(product_id):
             negotiations_data.append({
                 'id': neg.id,
                 'buyer_name': neg.buyer.fullname,
@@ -1277,7 +1680,7 @@ def admin_users():
 @admin_required
 def admin_products():
     status_filter = request.args.get('status', 'all')
-    products = Product.query
+    products = queries.products_with_relations()
     
     if status_filter != 'all':
         products = products.filter_by(status=status_filter)
@@ -1360,72 +1763,17 @@ Crawl-delay: 1"""
 
 @app.route('/sitemap.xml')
 def sitemap():
-    from xml.etree.ElementTree import Element, SubElement, tostring
-    from urllib.parse import quote
-    
-    # Create root element
-    urlset = Element('urlset')
-    urlset.set('xmlns', 'http://www.sitemaps.org/schemas/sitemap/0.9')
-    
-    # Get base URL
-    base_url = request.url_root.rstrip('/')
-    
-    # Homepage
-    url = SubElement(urlset, 'url')
-    SubElement(url, 'loc').text = base_url + '/'
-    SubElement(url, 'lastmod').text = datetime.now().strftime('%Y-%m-%d')
-    SubElement(url, 'changefreq').text = 'daily'
-    SubElement(url, 'priority').text = '1.0'
-    
-    # Products page
-    url = SubElement(urlset, 'url')
-    SubElement(url, 'loc').text = base_url + '/products'
-    SubElement(url, 'lastmod').text = datetime.now().strftime('%Y-%m-%d')
-    SubElement(url, 'changefreq').text = 'daily'
-    SubElement(url, 'priority').text = '0.9'
-    
-    # Jobs page
-    url = SubElement(urlset, 'url')
-    SubElement(url, 'loc').text = base_url + '/jobs'
-    SubElement(url, 'lastmod').text = datetime.now().strftime('%Y-%m-%d')
-    SubElement(url, 'changefreq').text = 'daily'
-    SubElement(url, 'priority').text = '0.8'
-    
-    # Cars page
-    url = SubElement(urlset, 'url')
-    SubElement(url, 'loc').text = base_url + '/cars'
-    SubElement(url, 'lastmod').text = datetime.now().strftime('%Y-%m-%d')
-    SubElement(url, 'changefreq').text = 'daily'
-    SubElement(url, 'priority').text = '0.8'
-    
-    # Category pages
-    categories = ['سيارات مستعملة', 'هواتف ذكية', 'إلكترونيات', 'سماعات لاسلكية', 
-                  'كاميرات احترافية', 'أثاث منزلي', 'أزياء وإكسسوارات', 'فرص عمل']
-    
-    for category in categories:
-        url = SubElement(urlset, 'url')
-        SubElement(url, 'loc').text = base_url + '/products?category=' + quote(category)
-        SubElement(url, 'lastmod').text = datetime.now().strftime('%Y-%m-%d')
-        SubElement(url, 'changefreq').text = 'weekly'
-        SubElement(url, 'priority').text = '0.7'
-    
-    # Product detail pages
-    products = Product.query.filter_by(status='approved').all()
-    for product in products:
-        url = SubElement(urlset, 'url')
-        SubElement(url, 'loc').text = base_url + f'/product/{product.id}'
-        # Use created_at since updated_at doesn't exist in Product model
-        if hasattr(product, 'created_at') and product.created_at:
-            SubElement(url, 'lastmod').text = product.created_at.strftime('%Y-%m-%d')
-        else:
-            SubElement(url, 'lastmod').text = datetime.now().strftime('%Y-%m-%d')
-        SubElement(url, 'changefreq').text = 'weekly'
-        SubElement(url, 'priority').text = '0.6'
-    
-    # Convert to string and return as XML
-    xml_str = tostring(urlset, encoding='utf-8', method='xml')
-    response = app.response_class(xml_str, mimetype='application/xml')
-    return response
+    """Sitemap index; shards are precomputed on disk and refreshed in the background"""
+    if not sitemap_store.ensure_index():
+        return app.response_class('Sitemap is being generated', status=503, headers={'Retry-After': '30'})
+    return sitemap_store.send('sitemap.xml')
+
+@app.route('/sitemaps/<filename>')
+def sitemap_shard(filename):
+    """Serve one precomputed sitemap shard"""
+    if not (filename.startswith('sitemap-') and filename.endswith('.xml')):
+        abort(404)
+    return sitemap_store.send(filename)
 
 # ===== Language Switch Route =====
 
@@ -0,0 +1,173 @@
+"""
+Fingerprinted static assets for Flohmarkt
+Copies CSS, JS and images to content-hashed names with gzip and brotli siblings
+and serves them with immutable caching through the static_url() template helper
+"""
+
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import tempfile
+
+import click
+from flask import abort, request, send_from_directory, url_for
+
+logger = logging.getLogger(__name__)
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip siblings are always written
+    brotli = None
+
+BUILD_DIR = 'dist'
+MANIFEST_NAME = 'manifest.json'
+# Directories under static/ that are never fingerprinted
+SKIP_DIRS = {BUILD_DIR, 'uploads'}
+COMPRESSIBLE = ('.css', '.js', '.svg', '.json', '.txt', '.ico')
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# Preferred first; each is served only when the client accepts it and the sibling exists
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def _write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.asset-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _accepts(encoding):
+    """Whether the request's Accept-Encoding allows `encoding` with a non-zero q value"""
+    for part in request.headers.get('Accept-Encoding', '').split(','):
+        token, _, params = part.partition(';')
+        if token.strip().lower() not in (encoding, '*'):
+            continue
+        quality = params.strip()
+        try:
+            return not quality.startswith('q=') or float(quality[2:]) > 0
+        except ValueError:
+            return False
+    return False
+
+
+class AssetPipeline:
+    def __init__(self, app=None):
+        self.static_folder = None
+        self.build_folder = None
+        self.manifest = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Build at startup unless ASSETS_BUILD=0 (e.g. when `flask assets build` runs at deploy)"""
+        self.static_folder = app.static_folder
+        self.build_folder = os.path.join(self.static_folder, BUILD_DIR)
+        if os.environ.get('ASSETS_BUILD', '1') == '1':
+            try:
+                self.build()
+            except OSError as e:
+                logger.warning(f"Asset build failed, serving unversioned files: {e}")
+        self.load_manifest()
+        app.add_template_global(self.static_url, 'static_url')
+        # More specific than Flask's /static/<path:filename>, so it wins for built files
+        app.add_url_rule(f'{app.static_url_path}/{BUILD_DIR}/<path:filename>', 'asset', self.serve)
+        self.register_commands(app)
+
+    # ===== Build =====
+
+    def _sources(self):
+        for root, dirs, files in os.walk(self.static_folder):
+            if root == self.static_folder:
+                dirs[:] = [name for name in dirs if name not in SKIP_DIRS]
+            for name in files:
+                if not name.startswith('.'):
+                    path = os.path.join(root, name)
+                    yield os.path.relpath(path, self.static_folder).replace(os.sep, '/'), path
+
+    def build(self):
+        """Write fingerprinted copies and compressed siblings; returns the manifest"""
+        manifest = {}
+        for logical, path in self._sources():
+            with open(path, 'rb') as f:
+                data = f.read()
+            stem, ext = os.path.splitext(logical)
+            built = f"{stem}.{hashlib.sha256(data).hexdigest()[:12]}{ext}"
+            manifest[logical] = built
+            target = os.path.join(self.build_folder, built)
+            # Names are content hashes, so an existing file is already correct
+            if os.path.exists(target):
+                continue
+            _write_atomic(target, data)
+            if ext.lower() in COMPRESSIBLE:
+                _write_atomic(target + '.gz', gzip.compress(data, 9, mtime=0))
+                if brotli is not None:
+                    _write_atomic(target + '.br', brotli.compress(data, quality=11))
+        _write_atomic(os.path.join(self.build_folder, MANIFEST_NAME),
+                      json.dumps(manifest, indent=1, sort_keys=True).encode('utf-8'))
+        self.manifest = manifest
+        return manifest
+
+    def load_manifest(self):
+        try:
+            with open(os.path.join(self.build_folder, MANIFEST_NAME), encoding='utf-8') as f:
+                self.manifest = json.load(f)
+        except (OSError, ValueError):
+            self.manifest = {}
+        return self.manifest
+
+    # ===== Templates =====
+
+    def static_url(self, filename, _external=False):
+        """URL of the fingerprinted copy, or the plain static URL for files not in the manifest"""
+        built = self.manifest.get(filename)
+        if built is None:
+            return url_for('static', filename=filename, _external=_external)
+        return url_for('asset', filename=built, _external=_external)
+
+    # ===== Serving =====
+
+    def serve(self, filename):
+        """Serve a built file, picking the precompressed sibling the client accepts"""
+        if filename.endswith(('.gz', '.br')) or filename == MANIFEST_NAME:
+            abort(404)
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        encoding = None
+        served = filename
+        for name, suffix in ENCODINGS:
+            if _accepts(name) and os.path.exists(os.path.join(self.build_folder, filename + suffix)):
+                encoding, served = name, filename + suffix
+                break
+        response = send_from_directory(self.build_folder, served, mimetype=mimetype)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        if os.path.splitext(filename)[1].lower() in COMPRESSIBLE:
+            response.vary.add('Accept-Encoding')
+        response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+        return response
+
+    def register_commands(self, app):
+        """Register the `assets` command group on the Flask CLI"""
+
+        @app.cli.group('assets')
+        def assets_cli():
+            """Static asset commands"""
+
+        @assets_cli.command('build')
+        def build_command():
+            """Fingerprint and precompress static files into static/dist"""
+            manifest = self.build()
+            click.echo(f"Built {len(manifest)} asset(s) into {self.build_folder}"
+                       + ('' if brotli is not None else ' (brotli not installed, gzip only)'))
+
+
+# Global instance
+asset_pipeline = AssetPipeline()
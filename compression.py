@@ -0,0 +1,354 @@
+"""
+Response compression middleware for Flohmarkt
+Negotiates zstd, brotli or gzip for HTML, JSON and other text responses,
+compresses buffered and streaming bodies and records per-route savings
+"""
+
+import logging
+import os
+import threading
+import zlib
+
+from flask import request
+
+logger = logging.getLogger(__name__)
+
+try:
+    import brotli
+except ImportError:  # optional; gzip is always available
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # optional
+    zstandard = None
+
+COMPRESSIBLE_TYPES = {
+    'text/html', 'text/plain', 'text/css', 'text/csv', 'text/xml', 'text/javascript',
+    'application/json', 'application/x-ndjson', 'application/javascript',
+    'application/xml', 'application/rss+xml', 'image/svg+xml',
+}
+# Server preference when the client weighs several encodings equally
+PREFERENCE = ('zstd', 'br', 'gzip')
+ROUTE_KEY = 'flowmarket.route'
+SKIP_STATUSES = {204, 206, 304}
+
+
+# ===== Codecs =====
+
+class _GzipStream:
+    def __init__(self, level):
+        self._obj = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits 31 writes a gzip container
+
+    def compress(self, data):
+        return self._obj.compress(data)
+
+    def flush(self):
+        return self._obj.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._obj.flush()
+
+
+class _BrotliStream:
+    def __init__(self, quality):
+        self._obj = brotli.Compressor(quality=quality)
+
+    def compress(self, data):
+        return self._obj.process(data)
+
+    def flush(self):
+        return self._obj.flush()
+
+    def finish(self):
+        return self._obj.finish()
+
+
+class _ZstdStream:
+    def __init__(self, level):
+        self._obj = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data):
+        return self._obj.compress(data)
+
+    def flush(self):
+        return self._obj.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self):
+        return self._obj.flush()
+
+
+def _accepted_encodings(header):
+    """{encoding: q} from an Accept-Encoding header"""
+    accepted = {}
+    for part in (header or '').split(','):
+        token, _, params = part.partition(';')
+        token = token.strip().lower()
+        if not token:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[token] = quality
+    return accepted
+
+
+def _identity_refused(accepted):
+    """Whether the client ruled out uncompressed bodies with identity;q=0 or *;q=0"""
+    quality = accepted.get('identity', accepted.get('*'))
+    return quality is not None and quality <= 0
+
+
+# ===== Middleware =====
+
+class CompressionMiddleware:
+    """WSGI wrapper; responses that already carry Content-Encoding pass through untouched"""
+
+    def __init__(self, wsgi_app, compression):
+        self.wsgi_app = wsgi_app
+        self.compression = compression
+
+    def __call__(self, environ, start_response):
+        head = environ.get('REQUEST_METHOD') == 'HEAD'
+        accepted = _accepted_encodings(environ.get('HTTP_ACCEPT_ENCODING'))
+        encoding = None if head else self.compression.negotiate(accepted)
+
+        captured = {}
+
+        def capture(status, headers, exc_info=None):
+            captured['args'] = (status, headers, exc_info)
+            return lambda data: captured.setdefault('written', []).append(data)
+
+        app_iter = self.wsgi_app(environ, capture)
+        if 'args' not in captured:
+            # Apps may defer start_response until the first chunk
+            chunks = iter(app_iter)
+            app_iter = _prepend(next(chunks, b''), chunks, app_iter)
+        status, headers, exc_info = captured['args']
+        if captured.get('written'):
+            app_iter = _prepend(b''.join(captured['written']), app_iter, app_iter)
+
+        varies = self.compression.compressible_type(headers)
+        if varies:
+            # Identity and compressed bodies share a URL; shared caches must key on Accept-Encoding
+            headers = _add_vary(headers)
+        # Clients that refuse identity get compressed bodies even when that does not save bytes
+        identity_ok = head or not _identity_refused(accepted)
+        if encoding is None:
+            if not identity_ok and varies and self.compression.compressible(status, headers, 0) is not False:
+                return self._not_acceptable(app_iter, start_response)
+            start_response(status, headers, exc_info)
+            return app_iter
+
+        length = self.compression.compressible(status, headers, None if identity_ok else 0)
+        if length is False:
+            start_response(status, headers, exc_info)
+            return app_iter
+        route = environ.get(ROUTE_KEY, '<unmatched>')
+        if length is None:
+            return self._stream(app_iter, encoding, status, headers, exc_info, start_response, route)
+        return self._buffered(app_iter, encoding, status, headers, exc_info, start_response, route, identity_ok)
+
+    def _not_acceptable(self, app_iter, start_response):
+        """The client refused an uncompressed body and accepts none of our codings"""
+        if hasattr(app_iter, 'close'):
+            app_iter.close()
+        body = f"Acceptable content codings: {', '.join(self.compression.available)}".encode('utf-8')
+        start_response('406 Not Acceptable', [('Content-Type', 'text/plain; charset=utf-8'),
+                                              ('Content-Length', str(len(body))), ('Vary', 'Accept-Encoding')])
+        return [body]
+
+    def _buffered(self, app_iter, encoding, status, headers, exc_info, start_response, route, identity_ok=True):
+        try:
+            body = b''.join(app_iter)
+        finally:
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
+        stream = self.compression.codec(encoding)
+        compressed = stream.compress(body) + stream.finish()
+        if identity_ok and len(compressed) >= len(body):
+            self.compression.record(route, None, len(body), len(body))
+            start_response(status, _set_header(headers, 'Content-Length', str(len(body))), exc_info)
+            return [body]
+        self.compression.record(route, encoding, len(body), len(compressed))
+        headers = _encoded_headers(headers, encoding)
+        start_response(status, headers + [('Content-Length', str(len(compressed)))], exc_info)
+        return [compressed]
+
+    def _stream(self, app_iter, encoding, status, headers, exc_info, start_response, route):
+        start_response(status, _encoded_headers(headers, encoding), exc_info)
+        compression = self.compression
+
+        def generate():
+            stream = compression.codec(encoding)
+            size_in = size_out = 0
+            try:
+                for chunk in app_iter:
+                    if not chunk:
+                        continue
+                    size_in += len(chunk)
+                    # Flush per chunk so NDJSON and CSV exports keep streaming to the client
+                    data = stream.compress(chunk) + stream.flush()
+                    size_out += len(data)
+                    yield data
+                data = stream.finish()
+                size_out += len(data)
+                yield data
+            finally:
+                compression.record(route, encoding, size_in, size_out)
+                if hasattr(app_iter, 'close'):
+                    app_iter.close()
+
+        return generate()
+
+
+def _prepend(first, chunks, app_iter):
+    if first:
+        yield first
+    try:
+        yield from chunks
+    finally:
+        if hasattr(app_iter, 'close'):
+            app_iter.close()
+
+
+def _header(headers, name):
+    name = name.lower()
+    for key, value in headers:
+        if key.lower() == name:
+            return value
+    return None
+
+
+def _set_header(headers, name, value):
+    return [(key, val) for key, val in headers if key.lower() != name.lower()] + [(name, value)]
+
+
+def _add_vary(headers):
+    vary = _header(headers, 'Vary')
+    if vary and ('accept-encoding' in vary.lower() or vary.strip() == '*'):
+        return headers
+    return _set_header(headers, 'Vary', f'{vary}, Accept-Encoding' if vary else 'Accept-Encoding')
+
+
+def _encoded_headers(headers, encoding):
+    result = []
+    for key, value in headers:
+        lower = key.lower()
+        if lower == 'content-length':
+            continue
+        if lower == 'etag' and not value.startswith('W/'):
+            # The compressed bytes differ from the identity representation
+            value = 'W/' + value
+        result.append((key, value))
+    result.append(('Content-Encoding', encoding))
+    return _add_vary(result)
+
+
+class ResponseCompression:
+    def __init__(self, app=None):
+        self.enabled = True
+        self.min_size = 1024
+        self.levels = {'gzip': 6, 'br': 4, 'zstd': 3}
+        self.available = ('gzip',)
+        self._stats = {}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Wrap app.wsgi_app; COMPRESSION=0 disables, COMPRESSION_MIN_SIZE and *_LEVEL tune it"""
+        self.enabled = os.environ.get('COMPRESSION', '1') == '1'
+        self.min_size = int(os.environ.get('COMPRESSION_MIN_SIZE', 1024))
+        self.levels = {
+            'gzip': int(os.environ.get('COMPRESSION_GZIP_LEVEL', 6)),
+            'br': int(os.environ.get('COMPRESSION_BROTLI_QUALITY', 4)),
+            'zstd': int(os.environ.get('COMPRESSION_ZSTD_LEVEL', 3)),
+        }
+        self.available = tuple(name for name, module in (('zstd', zstandard), ('br', brotli), ('gzip', zlib))
+                               if module is not None)
+        if not self.enabled:
+            return
+
+        @app.before_request
+        def _remember_route():
+            # The middleware runs outside Flask, so the matched rule is left in the environ
+            if request.url_rule is not None:
+                request.environ[ROUTE_KEY] = request.url_rule.rule
+
+        app.wsgi_app = CompressionMiddleware(app.wsgi_app, self)
+
+    def negotiate(self, accepted):
+        """Best encoding in an {encoding: q} map the client accepts, honouring q values, else None"""
+        if not accepted:
+            return None
+        wildcard = accepted.get('*', 0.0)
+        best, best_q = None, 0.0
+        for name in PREFERENCE:
+            if name not in self.available:
+                continue
+            quality = accepted.get(name, wildcard)
+            if quality > best_q:
+                best, best_q = name, quality
+        return best
+
+    def codec(self, encoding):
+        if encoding == 'zstd':
+            return _ZstdStream(self.levels['zstd'])
+        if encoding == 'br':
+            return _BrotliStream(self.levels['br'])
+        return _GzipStream(self.levels['gzip'])
+
+    def compressible_type(self, headers):
+        content_type = (_header(headers, 'Content-Type') or '').split(';')[0].strip().lower()
+        return content_type in COMPRESSIBLE_TYPES
+
+    def compressible(self, status, headers, min_size=None):
+        """False to pass through, None for streaming bodies, else the Content-Length"""
+        if int(status.split(' ', 1)[0]) in SKIP_STATUSES or _header(headers, 'Content-Encoding'):
+            return False
+        if not self.compressible_type(headers):
+            return False
+        if 'no-transform' in (_header(headers, 'Cache-Control') or ''):
+            return False
+        length = _header(headers, 'Content-Length')
+        if length is None:
+            return None
+        length = int(length)
+        return False if length < (self.min_size if min_size is None else min_size) else length
+
+    # ===== Metrics =====
+
+    def record(self, route, encoding, size_in, size_out):
+        with self._lock:
+            entry = self._stats.setdefault(route, {'responses': 0, 'compressed': 0, 'bytes_in': 0,
+                                                   'bytes_out': 0, 'encodings': {}})
+            entry['responses'] += 1
+            entry['bytes_in'] += size_in
+            entry['bytes_out'] += size_out
+            if encoding:
+                entry['compressed'] += 1
+                entry['encodings'][encoding] = entry['encodings'].get(encoding, 0) + 1
+
+    def stats(self):
+        """Per-route byte savings for this worker, largest savings first"""
+        with self._lock:
+            routes = {route: dict(entry, encodings=dict(entry['encodings'])) for route, entry in self._stats.items()}
+        for entry in routes.values():
+            entry['bytes_saved'] = entry['bytes_in'] - entry['bytes_out']
+            entry['ratio'] = round(entry['bytes_in'] / entry['bytes_out'], 2) if entry['bytes_out'] else None
+        return {
+            'enabled': self.enabled,
+            'encodings': list(self.available),
+            'min_size': self.min_size,
+            'levels': self.levels,
+            'routes': dict(sorted(routes.items(), key=lambda item: -item[1]['bytes_saved'])),
+        }
+
+
+# Global instance
+response_compression = ResponseCompression()
@@ -0,0 +1,95 @@
+"""
+Conditional GET support (ETag / Last-Modified) for Flohmarkt pages
+Lets views answer 304 Not Modified before rendering any template
+"""
+
+import hashlib
+import os
+
+from flask import request, session, make_response
+from flask_login import current_user
+
+from i18n import i18n
+
+
+def _template_version(app):
+    """
+    Fingerprint of the template files so a deploy invalidates old ETags
+    Hashes relative paths and contents, so every node of a release agrees
+    """
+    digest = hashlib.sha1()
+    template_dir = os.path.join(app.root_path, app.template_folder)
+    for root, dirs, files in os.walk(template_dir):
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            digest.update(os.path.relpath(path, template_dir).encode('utf-8'))
+            digest.update(b'\0')
+            with open(path, 'rb') as f:
+                digest.update(hashlib.sha1(f.read()).digest())
+    return digest.hexdigest()[:12]
+
+
+class Validators:
+    """ETag and Last-Modified for one rendering of a page"""
+
+    def __init__(self, etag, last_modified):
+        self.etag = etag
+        self.last_modified = last_modified
+
+
+class ConditionalGet:
+    def __init__(self, app=None):
+        self.version = ''
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """APP_VERSION or RENDER_GIT_COMMIT name the release; otherwise the templates are fingerprinted"""
+        self.version = (os.environ.get('APP_VERSION') or os.environ.get('RENDER_GIT_COMMIT')
+                        or _template_version(app))
+
+    def validators(self, last_modified, *parts):
+        """
+        Build validators for a response
+        `parts` identify the rendered data (ids, timestamps, counts); the viewer,
+        language and template version are mixed in because they change the HTML
+        """
+        viewer = current_user.get_id() if current_user.is_authenticated else 'anonymous'
+        digest = hashlib.sha256()
+        for part in (self.version, request.full_path, viewer, i18n.get_current_language()) + parts:
+            digest.update(repr(part).encode('utf-8'))
+            digest.update(b'\0')
+        if last_modified is not None:
+            last_modified = last_modified.replace(microsecond=0)
+        return Validators(digest.hexdigest()[:32], last_modified)
+
+    def not_modified(self, validators):
+        """Return a 304 response if the request's validators still match, else None"""
+        if request.method not in ('GET', 'HEAD') or session.get('_flashes'):
+            return None
+
+        matched = False
+        if request.if_none_match:
+            matched = request.if_none_match.contains_weak(validators.etag)
+        elif (request.if_modified_since and validators.last_modified is not None
+              and not current_user.is_authenticated):
+            # Dates alone cannot tell logged-in variants apart, so only trust them for anonymous pages
+            matched = validators.last_modified <= request.if_modified_since.replace(tzinfo=None)
+
+        if not matched:
+            return None
+        return self.apply(make_response('', 304), validators)
+
+    def apply(self, response, validators):
+        """Attach validators and revalidation headers to a response"""
+        response.set_etag(validators.etag)
+        if validators.last_modified is not None:
+            response.last_modified = validators.last_modified
+        response.headers['Cache-Control'] = 'private, no-cache' if current_user.is_authenticated else 'no-cache'
+        response.vary.add('Cookie')
+        return response
+
+
+# Global instance
+conditional_get = ConditionalGet()
@@ -0,0 +1,137 @@
+"""
+Denormalized unread message counters for Flohmarkt
+One row per seller plus a global row turns inbox badges into primary-key
+reads; message writes adjust them inside the caller's transaction
+"""
+
+import logging
+from datetime import datetime
+
+import click
+from sqlalchemy import func, or_, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.attributes import set_committed_value
+
+from app import db
+from migrations import migration
+from models import Message, Product, UnreadCounter
+
+logger = logging.getLogger(__name__)
+
+GLOBAL_OWNER_ID = 0
+
+
+def unread_count(owner_id):
+    """Unread messages on a seller's products, or on all products for GLOBAL_OWNER_ID"""
+    count = db.session.query(UnreadCounter.count).filter_by(owner_id=owner_id).scalar()
+    return max(count or 0, 0)
+
+
+def _increment(owner_id, delta):
+    updated = UnreadCounter.query.filter_by(owner_id=owner_id).update(
+        {'count': UnreadCounter.count + delta}, synchronize_session=False
+    )
+    if updated:
+        return
+    # A missing row means no unread messages yet; another request may create it first
+    try:
+        with db.session.begin_nested():
+            db.session.add(UnreadCounter(owner_id=owner_id, count=max(delta, 0)))
+    except IntegrityError:
+        UnreadCounter.query.filter_by(owner_id=owner_id).update(
+            {'count': UnreadCounter.count + delta}, synchronize_session=False
+        )
+
+
+def adjust_unread(owner_id, delta):
+    """Add `delta` to a seller's counter and the global one; the caller commits"""
+    if delta:
+        _increment(owner_id, delta)
+        _increment(GLOBAL_OWNER_ID, delta)
+
+
+def set_read_state(message, owner_id, is_read):
+    """
+    Flip a message's read flag and adjust the counters only if the stored value changed
+    The conditional UPDATE keeps concurrent requests from counting the same flip twice
+    """
+    is_read = bool(is_read)
+    # Only is_read = False counts as unread, matching the reconciliation query
+    if is_read:
+        condition = Message.is_read == False  # noqa: E712
+    else:
+        condition = or_(Message.is_read == True, Message.is_read.is_(None))  # noqa: E712
+    changed = Message.query.filter(Message.id == message.id, condition).update(
+        {'is_read': is_read}, synchronize_session=False
+    )
+    set_committed_value(message, 'is_read', is_read)
+    if changed:
+        adjust_unread(owner_id, -1 if is_read else 1)
+    return bool(changed)
+
+
+# ===== Reconciliation =====
+
+def _actual_counts(conn):
+    """Exact unread counts per product owner, computed with one grouped query"""
+    rows = conn.execute(
+        select(Product.user_id, func.count(Message.id))
+        .join(Product, Message.product_id == Product.id)
+        .where(Message.is_read == False)  # noqa: E712
+        .group_by(Product.user_id)
+    )
+    counts = {owner_id: count for owner_id, count in rows}
+    counts[GLOBAL_OWNER_ID] = sum(counts.values())
+    return counts
+
+
+def reconcile(conn, dry_run=False):
+    """
+    Rewrite counters that drifted from the messages table
+    Returns [(owner_id, stored, actual)] for every corrected row
+    """
+    actual = _actual_counts(conn)
+    table = UnreadCounter.__table__
+    stored = {owner_id: count for owner_id, count in conn.execute(select(table.c.owner_id, table.c.count))}
+
+    corrections = []
+    now = datetime.utcnow()
+    for owner_id in sorted(set(actual) | set(stored)):
+        expected = actual.get(owner_id, 0)
+        if stored.get(owner_id) == expected:
+            continue
+        corrections.append((owner_id, stored.get(owner_id), expected))
+        if dry_run:
+            continue
+        if owner_id in stored:
+            conn.execute(table.update().where(table.c.owner_id == owner_id)
+                         .values(count=expected, updated_at=now))
+        else:
+            conn.execute(table.insert().values(owner_id=owner_id, count=expected, updated_at=now))
+    return corrections
+
+
+@migration(4, 'Denormalized unread message counters')
+def _unread_counters(conn):
+    UnreadCounter.__table__.create(conn, checkfirst=True)
+    reconcile(conn)
+
+
+def init_app(app):
+    """Register the `counters` command group on the Flask CLI"""
+
+    @app.cli.group('counters')
+    def counters_cli():
+        """Unread message counter commands"""
+
+    @counters_cli.command('reconcile')
+    @click.option('--dry-run', is_flag=True, help='Report drift without fixing it')
+    def reconcile_command(dry_run):
+        """Recompute unread counters from the messages table"""
+        with db.engine.begin() as conn:
+            corrections = reconcile(conn, dry_run=dry_run)
+        for owner_id, stored, actual in corrections:
+            label = 'all sellers' if owner_id == GLOBAL_OWNER_ID else f'seller {owner_id}'
+            click.echo(f"{label:<16} stored {stored if stored is not None else '-':>6}  actual {actual:>6}")
+        verb = 'Found' if dry_run else 'Fixed'
+        click.echo(f"{verb} {len(corrections)} drifted counter(s)")
@@ -0,0 +1,154 @@
+"""
+Streaming data exports for Flohmarkt
+Writes products, users, messages and negotiations as CSV or NDJSON from a
+server-side cursor in fixed-size chunks, optionally gzipped, with watermarks
+"""
+
+import csv
+import io
+import json
+import sys
+import zlib
+from datetime import datetime
+
+import click
+from sqlalchemy import func, select
+
+from app import db
+from models import Message, PriceNegotiation, Product, User
+
+CHUNK_SIZE = 1000
+FORMATS = ('csv', 'ndjson')
+
+
+def _datasets():
+    """name -> (columns, watermark expression); secrets such as password hashes are never exported"""
+    return {
+        'products': (
+            [Product.id, Product.name, Product.description, Product.price, Product.status,
+             Product.category_id, Product.user_id, Product.image_url, Product.created_at, Product.updated_at],
+            func.coalesce(Product.updated_at, Product.created_at),
+        ),
+        'users': (
+            [User.id, User.fullname, User.email, User.phone, User.role, User.created_at],
+            User.created_at,
+        ),
+        'messages': (
+            [Message.id, Message.product_id, Message.seller_id, Message.buyer_name, Message.buyer_email,
+             Message.message_text, Message.is_read, Message.is_reply, Message.parent_message_id,
+             Message.email_sent, Message.created_at],
+            Message.created_at,
+        ),
+        'negotiations': (
+            [PriceNegotiation.id, PriceNegotiation.product_id, PriceNegotiation.buyer_id,
+             PriceNegotiation.offered_price, PriceNegotiation.message, PriceNegotiation.status,
+             PriceNegotiation.counter_offer, PriceNegotiation.counter_message,
+             PriceNegotiation.created_at, PriceNegotiation.updated_at],
+            func.coalesce(PriceNegotiation.updated_at, PriceNegotiation.created_at),
+        ),
+    }
+
+
+DATASETS = tuple(_datasets())
+
+
+def _plain(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def _partitions(name, since=None, state=None):
+    """Yield row batches in watermark order; `state['watermark']` tracks the newest row"""
+    columns, watermark = _datasets()[name]
+    stmt = select(*columns, watermark.label('_watermark'))
+    if since is not None:
+        stmt = stmt.where(watermark > since)
+    stmt = stmt.order_by(watermark, columns[0]).execution_options(yield_per=CHUNK_SIZE)
+
+    for partition in db.session.execute(stmt).partitions():
+        if state is not None and partition[-1][-1] is not None:
+            state['watermark'] = partition[-1][-1]
+        yield [row[:-1] for row in partition]
+
+
+def iter_export(name, fmt='csv', since=None, state=None):
+    """Yield the export as text chunks, one per CHUNK_SIZE rows"""
+    if name not in DATASETS:
+        raise ValueError(f"Unknown dataset: {name}")
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format: {fmt}")
+
+    header = [column.key for column in _datasets()[name][0]]
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(header)
+
+    for rows in _partitions(name, since, state):
+        if fmt == 'csv':
+            writer.writerows([['' if value is None else _plain(value) for value in row] for row in rows])
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        else:
+            yield ''.join(
+                json.dumps(dict(zip(header, map(_plain, row))), ensure_ascii=False) + '\n' for row in rows
+            )
+
+    if fmt == 'csv' and buffer.tell():
+        # No rows were exported; still emit the header line
+        yield buffer.getvalue()
+
+
+def encode_chunks(chunks, compress=False):
+    """Encode text chunks to UTF-8, gzipping on the fly when requested"""
+    if not compress:
+        for chunk in chunks:
+            yield chunk.encode('utf-8')
+        return
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31 writes a gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def parse_since(value):
+    """Parse an ISO date or datetime watermark; raises ValueError when malformed"""
+    return datetime.fromisoformat(value) if value else None
+
+
+def export_filename(name, fmt, compress=False):
+    stamp = datetime.utcnow().strftime('%Y%m%d-%H%M%S')
+    return f"{name}-{stamp}.{fmt}" + ('.gz' if compress else '')
+
+
+def init_app(app):
+    """Register the `export` command on the Flask CLI"""
+
+    @app.cli.command('export')
+    @click.argument('dataset', type=click.Choice(DATASETS))
+    @click.option('--format', 'fmt', type=click.Choice(FORMATS), default='csv', show_default=True)
+    @click.option('--since', help='Only rows changed after this ISO timestamp')
+    @click.option('--gzip', 'compress', is_flag=True, help='Gzip the output')
+    @click.option('--output', '-o', type=click.Path(dir_okay=False), help='Write to a file instead of stdout')
+    def export_command(dataset, fmt, since, compress, output):
+        """Stream a dataset as CSV or NDJSON; prints the next --since watermark to stderr"""
+        try:
+            since_value = parse_since(since)
+        except ValueError:
+            raise click.BadParameter('expected an ISO date or datetime', param_hint='--since')
+
+        state = {'watermark': None}
+        target = open(output, 'wb') if output else sys.stdout.buffer
+        try:
+            for data in encode_chunks(iter_export(dataset, fmt, since_value, state), compress):
+                target.write(data)
+        finally:
+            if output:
+                target.close()
+            else:
+                target.flush()
+
+        watermark = state['watermark'] or since_value
+        click.echo(f"watermark: {_plain(watermark) if watermark else '-'}", err=True)
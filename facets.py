@@ -0,0 +1,81 @@
+"""
+Faceted category and price counts for Flohmarkt listings
+Computes both facets from one grouped query and caches them briefly per filter
+"""
+
+import os
+
+from sqlalchemy import and_, case, func, literal
+
+from app import db
+from cache import TTLCache
+from models import Category, Product
+
+# Upper bounds (EGP) of each price bucket; the last bucket is open-ended
+PRICE_BUCKET_EDGES = [500, 1000, 5000, 10000, 50000, 100000, 500000, 1000000]
+
+facets_cache = TTLCache(ttl=int(os.environ.get('FACETS_CACHE_TTL', 30)), maxsize=512)
+
+
+def _bucket_expression():
+    whens = [(Product.id.is_(None), literal(None))]
+    whens += [(Product.price < edge, literal(index)) for index, edge in enumerate(PRICE_BUCKET_EDGES)]
+    return case(*whens, else_=literal(len(PRICE_BUCKET_EDGES)))
+
+
+def _bucket_label(index):
+    low = PRICE_BUCKET_EDGES[index - 1] if index > 0 else 0
+    high = PRICE_BUCKET_EDGES[index] if index < len(PRICE_BUCKET_EDGES) else None
+    return {'bucket': index, 'min': low, 'max': high}
+
+
+def _price_condition(min_price, max_price):
+    conditions = []
+    if min_price is not None:
+        conditions.append(Product.price >= min_price)
+    if max_price is not None:
+        conditions.append(Product.price <= max_price)
+    return and_(Product.id.isnot(None), *conditions)
+
+
+def compute_facets(category_id=None, min_price=None, max_price=None):
+    """
+    Per-category counts and a price histogram for approved products
+
+    One grouped LEFT JOIN over (category, price bucket) yields every cell's
+    total and its count within the price filter. Category counts honour the
+    price filter and price buckets honour the category filter, so each facet
+    shows what selecting it would return.
+    """
+    bucket = _bucket_expression().label('bucket')
+    in_price_range = case((_price_condition(min_price, max_price), 1), else_=0)
+
+    rows = (
+        db.session.query(
+            Category.id, Category.name, bucket,
+            func.count(Product.id).label('total'),
+            func.sum(in_price_range).label('in_range')
+        )
+        .outerjoin(Product, and_(Product.category_id == Category.id, Product.status == 'approved'))
+        .group_by(Category.id, Category.name, bucket)
+        .all()
+    )
+
+    categories = {}
+    buckets = [0] * (len(PRICE_BUCKET_EDGES) + 1)
+    for cat_id, cat_name, bucket_index, total, in_range in rows:
+        entry = categories.setdefault(cat_id, {'id': cat_id, 'name': cat_name, 'count': 0})
+        entry['count'] += int(in_range or 0)
+        if bucket_index is not None and (category_id is None or cat_id == category_id):
+            buckets[bucket_index] += total
+
+    return {
+        'categories': sorted(categories.values(), key=lambda entry: entry['id']),
+        'price_buckets': [dict(_bucket_label(index), count=count) for index, count in enumerate(buckets)]
+    }
+
+
+def get_facets(category_id=None, min_price=None, max_price=None):
+    """Cached compute_facets keyed by the filter set"""
+    key = (category_id, min_price, max_price)
+    return facets_cache.get_or_set(key, lambda: compute_facets(category_id, min_price, max_price))
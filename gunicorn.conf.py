@@ -8,6 +8,7 @@ backlog = 2048
 # Worker processes
 workers = 2
 worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 16))  # at most SSE_MAX_STREAMS of them serve inbox streams
 worker_connections = 1000
 timeout = 30
 keepalive = 2
@@ -10,7 +10,7 @@ backlog = 2048
 workers = multiprocessing.cpu_count() * 2 + 1
 worker_class = "gthread"
 worker_connections = 1000
-threads = 4
+threads = int(os.environ.get('GUNICORN_THREADS', 16))  # SSE inbox streams each hold a thread
 max_requests = 1000
 max_requests_jitter = 100
 preload_app = True
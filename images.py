@@ -0,0 +1,222 @@
+"""
+Image processing pipeline for Flohmarkt uploads
+Generates resized, metadata-free WebP variants in a background worker pool
+and exposes src/srcset helpers so listings serve small images
+"""
+
+import io
+import json
+import logging
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+from sqlalchemy import text
+
+from app import db
+from migrations import has_column, migration
+from models import Product
+from storage import UPLOADS_PREFIX, VARIANT_DIR
+from uploads import upload_store
+
+logger = logging.getLogger(__name__)
+
+# Variant name -> maximum width in pixels; images are never upscaled
+VARIANT_WIDTHS = {'thumb': 320, 'medium': 800, 'full': 1600}
+QUALITY = 80
+
+try:
+    from PIL import Image, ImageOps, features
+except ImportError:  # Pillow is optional; without it originals are served as-is
+    Image = None
+
+
+def _field(product, name):
+    # Templates receive both Product rows and the dicts built for them
+    if isinstance(product, dict):
+        return product.get(name)
+    return getattr(product, name, None)
+
+
+def load_variants(product):
+    """Parsed {name: {'url', 'width'}} for a product, empty until processing finishes"""
+    raw = _field(product, 'image_variants')
+    if not raw:
+        return {}
+    try:
+        return json.loads(raw)
+    except ValueError:
+        return {}
+
+
+def image_src(product, variant='medium'):
+    """URL of the requested variant, falling back to smaller ones and then the original"""
+    variants = load_variants(product)
+    names = list(VARIANT_WIDTHS)
+    for name in reversed(names[:names.index(variant) + 1]):
+        if name in variants:
+            return variants[name]['url']
+    return _field(product, 'image_url') or ''
+
+
+def image_srcset(product):
+    """`srcset` value listing every variant with its width descriptor"""
+    variants = load_variants(product)
+    entries = sorted({(v['width'], v['url']) for v in variants.values()})
+    return ', '.join(f"{url} {width}w" for width, url in entries)
+
+
+class ImagePipeline:
+    def __init__(self, app=None, on_processed=None):
+        self.app = None
+        self.workers = 2
+        self.on_processed = on_processed
+        self.image_format = 'WEBP'
+        self._executor = None
+        self._executor_pid = None
+        if app is not None:
+            self.init_app(app, on_processed)
+
+    def init_app(self, app, on_processed=None):
+        """`on_processed(product_id)` runs after variants are stored, e.g. to invalidate caches"""
+        self.app = app
+        self.workers = int(os.environ.get('IMAGE_WORKERS', 2))
+        self.on_processed = on_processed or self.on_processed
+        if Image is None:
+            logger.warning("Pillow not installed - image variants disabled")
+        elif not features.check('webp'):
+            self.image_format = 'JPEG'
+        app.add_template_global(image_src)
+        app.add_template_global(image_srcset)
+        self.register_commands(app)
+
+    @property
+    def enabled(self):
+        return Image is not None
+
+    # ===== Processing =====
+
+    def _extension(self):
+        return 'webp' if self.image_format == 'WEBP' else 'jpg'
+
+    def _save_options(self):
+        if self.image_format == 'WEBP':
+            return {'quality': QUALITY, 'method': 4}
+        return {'quality': QUALITY, 'optimize': True, 'progressive': True}
+
+    def generate_variants(self, image_url):
+        """Write every variant for an upload to storage; returns {name: {'url', 'width'}}"""
+        storage = upload_store.storage
+        key = image_url[len(UPLOADS_PREFIX):]
+        stem = os.path.splitext(os.path.basename(key))[0]
+
+        source = storage.open(key)
+        try:
+            if not getattr(source, 'seekable', lambda: False)():
+                # Remote bodies stream; Pillow needs to seek
+                source = io.BytesIO(source.read())
+            variants = {}
+            with Image.open(source) as original:
+                # Apply the EXIF rotation, then drop all metadata by re-encoding pixels only
+                image = ImageOps.exif_transpose(original)
+                has_alpha = image.mode in ('RGBA', 'LA') or 'transparency' in image.info
+                image = image.convert('RGBA' if has_alpha and self.image_format == 'WEBP' else 'RGB')
+                for name, max_width in VARIANT_WIDTHS.items():
+                    width = min(max_width, image.width)
+                    variant_name = f"{stem}-{width}.{self._extension()}"
+                    # Small images collapse several variants onto one width; write it once
+                    if not any(v['width'] == width for v in variants.values()):
+                        height = max(1, round(image.height * width / image.width))
+                        resized = image if width == image.width else image.resize((width, height), Image.LANCZOS)
+                        # Unique temporary name: identical uploads may be processed concurrently
+                        fd, tmp_path = tempfile.mkstemp(dir=storage.temp_dir, prefix='.variant-')
+                        try:
+                            with os.fdopen(fd, 'wb') as out:
+                                resized.save(out, self.image_format, **self._save_options())
+                            upload_store.put(f"{VARIANT_DIR}/{variant_name}", tmp_path)
+                        finally:
+                            if os.path.exists(tmp_path):
+                                os.remove(tmp_path)
+                    variants[name] = {'url': f"{UPLOADS_PREFIX}{VARIANT_DIR}/{variant_name}", 'width': width}
+        finally:
+            source.close()
+        return variants
+
+    def process(self, product_id, image_url, regenerate=False):
+        """Generate variants and store them if the product still uses this image"""
+        with self.app.app_context():
+            # Deduplicated uploads share a URL, so another product may already have its variants
+            variants = None if regenerate else db.session.execute(
+                text("SELECT image_variants FROM products "
+                     "WHERE image_url = :url AND image_variants IS NOT NULL LIMIT 1"),
+                {'url': image_url}
+            ).scalar()
+            if variants is None:
+                try:
+                    variants = json.dumps(self.generate_variants(image_url))
+                except Exception as e:
+                    logger.error(f"Image processing failed for product {product_id} ({image_url}): {e}")
+                    db.session.remove()
+                    return False
+            result = db.session.execute(
+                text("UPDATE products SET image_variants = :variants WHERE id = :id AND image_url = :url"),
+                {'variants': variants, 'id': product_id, 'url': image_url}
+            )
+            db.session.commit()
+            updated = result.rowcount > 0
+            if updated and self.on_processed:
+                self.on_processed(product_id)
+            db.session.remove()
+        return updated
+
+    def _get_executor(self):
+        # Pools do not survive gunicorn's fork, so each worker creates its own
+        if self._executor is None or self._executor_pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='image')
+            self._executor_pid = os.getpid()
+        return self._executor
+
+    def submit(self, product_id, image_url):
+        """Queue variant generation for a freshly uploaded image; returns immediately"""
+        if not self.enabled or not image_url or not image_url.startswith(UPLOADS_PREFIX):
+            return None
+        return self._get_executor().submit(self.process, product_id, image_url)
+
+    # ===== CLI =====
+
+    def register_commands(self, app):
+        """Register the `images` command group on the Flask CLI"""
+
+        @app.cli.group('images')
+        def images_cli():
+            """Image variant commands"""
+
+        @images_cli.command('process')
+        @click.option('--all', 'process_all', is_flag=True, help='Regenerate variants for every product')
+        def process_command(process_all):
+            """Generate variants for uploaded images that do not have them yet"""
+            if not self.enabled:
+                raise click.ClickException('Pillow is not installed')
+            query = db.session.query(Product.id, Product.image_url).filter(
+                Product.image_url.like(UPLOADS_PREFIX + '%')
+            )
+            if not process_all:
+                query = query.filter(Product.image_variants.is_(None))
+            done = failed = 0
+            for product_id, image_url in query.order_by(Product.id).all():
+                if self.process(product_id, image_url, regenerate=process_all):
+                    done += 1
+                else:
+                    failed += 1
+            click.echo(f"Processed {done} image(s), {failed} failed")
+
+
+@migration(5, 'Responsive image variants for product uploads')
+def _image_variants_column(conn):
+    if not has_column(conn, 'products', 'image_variants'):
+        conn.execute(text("ALTER TABLE products ADD COLUMN image_variants TEXT"))
+
+
+# Global instance
+image_pipeline = ImagePipeline()
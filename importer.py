@@ -0,0 +1,271 @@
+"""
+Bulk product import for Flohmarkt
+Parses CSV or JSON Lines as a stream, validates each row, and inserts valid
+rows in batched executemany statements, reporting per-row errors
+"""
+
+import codecs
+import csv
+import json
+import logging
+import math
+import time
+from datetime import datetime
+from urllib.parse import urlsplit
+
+import click
+from sqlalchemy import insert
+from sqlalchemy.exc import SQLAlchemyError
+
+from app import db
+from cache import TTLCache
+from models import Category, Product, User
+from normalization import normalize_text, product_search_key
+from storage import UPLOADS_PREFIX
+from uploads import parse_content_url, upload_store
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 1000
+FORMATS = ('csv', 'jsonl')
+
+# name/id lookups shared by every import in this worker
+category_cache = TTLCache(ttl=300, maxsize=1)
+
+
+class RowError(ValueError):
+    pass
+
+
+def _load_categories():
+    by_name, ids = {}, set()
+    for category_id, name in db.session.query(Category.id, Category.name):
+        by_name[normalize_text(name)] = category_id
+        ids.add(category_id)
+    return by_name, ids
+
+
+class CategoryLookup:
+    """Resolves category names or ids from the shared cache, reloading once on a miss"""
+
+    def __init__(self):
+        self.by_name, self.ids = category_cache.get_or_set('categories', _load_categories)
+        self._reloaded = False
+
+    def _reload(self):
+        if self._reloaded:
+            return False
+        self._reloaded = True
+        category_cache.delete('categories')
+        self.by_name, self.ids = category_cache.get_or_set('categories', _load_categories)
+        return True
+
+    def resolve(self, row):
+        raw_id = row.get('category_id')
+        if raw_id not in (None, ''):
+            try:
+                category_id = int(raw_id)
+            except (TypeError, ValueError):
+                raise RowError('category_id must be an integer')
+            if category_id in self.ids or (self._reload() and category_id in self.ids):
+                return category_id
+            raise RowError(f'unknown category_id {category_id}')
+
+        name = str(row.get('category') or '').strip()
+        if not name:
+            raise RowError('category or category_id is required')
+        key = normalize_text(name)
+        if key in self.by_name or (self._reload() and key in self.by_name):
+            return self.by_name[key]
+        raise RowError(f'unknown category "{name}"')
+
+
+def parse_rows(stream, fmt):
+    """Yield (row_number, dict) from a binary stream without reading it all into memory"""
+    text = codecs.getreader('utf-8-sig')(stream)
+    if fmt == 'csv':
+        for number, row in enumerate(csv.DictReader(text), start=1):
+            yield number, row
+    elif fmt == 'jsonl':
+        for number, line in enumerate(text, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                yield number, RowError(f'invalid JSON: {e}')
+                continue
+            yield number, row if isinstance(row, dict) else RowError('each line must be a JSON object')
+    else:
+        raise ValueError(f"Unsupported format: {fmt}")
+
+
+def validate_image_url(image_url, known_uploads):
+    """
+    Accept absolute http(s) URLs or content-addressed uploads already in storage
+    Anything else could later be handed to upload cleanup as a path to delete
+    """
+    parts = urlsplit(image_url)
+    if parts.scheme in ('http', 'https') and parts.netloc:
+        return image_url
+    if parse_content_url(image_url):
+        if image_url not in known_uploads:
+            if not upload_store.storage.exists(image_url[len(UPLOADS_PREFIX):]):
+                raise RowError('image_url does not refer to an uploaded file')
+            known_uploads.add(image_url)
+        return image_url
+    raise RowError('image_url must be an http(s) URL or an uploaded image')
+
+
+def validate_row(row, categories, seller_id, now, known_uploads=None):
+    """Return the column values for one product row or raise RowError"""
+    name = str(row.get('name') or '').strip()
+    if not name:
+        raise RowError('name is required')
+    if len(name) > 200:
+        raise RowError('name is longer than 200 characters')
+
+    try:
+        price = float(row.get('price'))
+    except (TypeError, ValueError):
+        raise RowError('price must be a number')
+    if not math.isfinite(price) or price <= 0:
+        raise RowError('price must be greater than zero')
+
+    description = str(row.get('description') or '').strip()
+    image_url = str(row.get('image_url') or '').strip() or None
+    if image_url and len(image_url) > 500:
+        raise RowError('image_url is longer than 500 characters')
+    if image_url:
+        image_url = validate_image_url(image_url, set() if known_uploads is None else known_uploads)
+
+    return {
+        'name': name,
+        'description': description,
+        'price': price,
+        'image_url': image_url,
+        'category_id': categories.resolve(row),
+        'user_id': seller_id,
+        # Imported listings are published immediately, like add_product
+        'status': 'approved',
+        # Core inserts skip the ORM hook that normally fills search_key
+        'search_key': product_search_key(name, description),
+        'created_at': now,
+        'updated_at': now,
+    }
+
+
+class ImportResult:
+    def __init__(self):
+        self.inserted_ids = []
+        self.failed = 0
+        self.errors = []
+        self.aborted = False
+        self.started = time.monotonic()
+
+    def error(self, row_number, message):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'row': row_number, 'error': message})
+
+    def as_dict(self):
+        elapsed = time.monotonic() - self.started
+        return {
+            'inserted': len(self.inserted_ids),
+            'failed': self.failed,
+            'errors': self.errors,
+            'errors_truncated': self.failed > len(self.errors),
+            'aborted': self.aborted,
+            'elapsed_seconds': round(elapsed, 3),
+            'rows_per_second': round((len(self.inserted_ids) + self.failed) / elapsed) if elapsed else None,
+        }
+
+
+def _flush(batch, result):
+    """Insert a batch with one executemany; fall back to row-by-row to isolate failures"""
+    if not batch:
+        return
+    statement = insert(Product).returning(Product.id)
+    try:
+        result.inserted_ids.extend(db.session.scalars(statement, [values for _, values in batch]))
+        upload_store.retain(*[values['image_url'] for _, values in batch])
+        db.session.commit()
+        return
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        logger.warning(f"Import batch of {len(batch)} failed, retrying row by row: {e}")
+
+    for row_number, values in batch:
+        try:
+            result.inserted_ids.append(db.session.scalar(statement, values))
+            upload_store.retain(values['image_url'])
+            db.session.commit()
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            result.error(row_number, f'database error: {e.__class__.__name__}')
+
+
+def import_products(stream, fmt, seller_id, batch_size=BATCH_SIZE):
+    """Import every row of `stream` for `seller_id`; returns an ImportResult"""
+    categories = CategoryLookup()
+    known_uploads = set()
+    result = ImportResult()
+    now = datetime.utcnow()
+    batch = []
+    row_number = 0
+    try:
+        for row_number, row in parse_rows(stream, fmt):
+            try:
+                if isinstance(row, RowError):
+                    raise row
+                batch.append((row_number, validate_row(row, categories, seller_id, now, known_uploads)))
+            except RowError as e:
+                result.error(row_number, str(e))
+                continue
+            if len(batch) >= batch_size:
+                _flush(batch, result)
+                batch = []
+    except (UnicodeDecodeError, csv.Error) as e:
+        # The rest of the stream cannot be parsed; keep what was read so far
+        result.error(row_number + 1, f'unreadable input: {e}')
+        result.aborted = True
+    _flush(batch, result)
+    return result
+
+
+def detect_format(filename=None, content_type=None):
+    """Pick csv or jsonl from a file name or content type; defaults to csv"""
+    filename = (filename or '').lower()
+    content_type = (content_type or '').lower()
+    if filename.endswith(('.jsonl', '.ndjson')) or 'ndjson' in content_type or 'jsonl' in content_type:
+        return 'jsonl'
+    return 'csv'
+
+
+def init_app(app, on_imported=None):
+    """Register the `import` command; `on_imported(ids)` runs after a successful import"""
+
+    @app.cli.command('import')
+    @click.argument('path', type=click.Path(exists=True, dir_okay=False))
+    @click.option('--seller', required=True, help='Email or id of the user who will own the products')
+    @click.option('--format', 'fmt', type=click.Choice(FORMATS), help='Defaults to the file extension')
+    @click.option('--batch-size', default=BATCH_SIZE, show_default=True)
+    def import_command(path, seller, fmt, batch_size):
+        """Bulk-import products from a CSV or JSON Lines file"""
+        user = User.query.filter_by(email=seller.lower()).first()
+        if user is None and seller.isdigit():
+            user = db.session.get(User, int(seller))
+        if user is None:
+            raise click.BadParameter(f'no user {seller}', param_hint='--seller')
+
+        with open(path, 'rb') as stream:
+            result = import_products(stream, fmt or detect_format(path), user.id, batch_size)
+        if on_imported and result.inserted_ids:
+            on_imported(result.inserted_ids)
+
+        summary = result.as_dict()
+        for error in summary['errors']:
+            click.echo(f"row {error['row']}: {error['error']}", err=True)
+        click.echo(f"Imported {summary['inserted']} product(s), {summary['failed']} failed "
+                   f"in {summary['elapsed_seconds']}s ({summary['rows_per_second']} rows/s)")
@@ -0,0 +1,187 @@
+"""
+Versioned schema migrations for Flohmarkt
+Applies ordered, idempotent schema steps at startup or via `flask --app app db upgrade`
+"""
+
+import logging
+from datetime import datetime
+
+import click
+from sqlalchemy import inspect, text
+
+from app import db
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS = []
+
+
+def migration(version, description):
+    """Register a migration step; steps run in ascending version order"""
+    def decorator(func):
+        MIGRATIONS.append((version, description, func))
+        MIGRATIONS.sort(key=lambda step: step[0])
+        return func
+    return decorator
+
+
+def _ensure_version_table(conn):
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        "version INTEGER PRIMARY KEY, "
+        "description VARCHAR(200) NOT NULL, "
+        "applied_at TIMESTAMP NOT NULL)"
+    ))
+
+
+def applied_versions(conn):
+    """Return the set of migration versions already recorded in the database"""
+    _ensure_version_table(conn)
+    return {row[0] for row in conn.execute(text("SELECT version FROM schema_migrations"))}
+
+
+def _create_model_indexes(conn, table_name):
+    """Create every index declared on a model's table that is not present yet"""
+    table = db.metadata.tables[table_name]
+    for index in table.indexes:
+        index.create(conn, checkfirst=True)
+
+
+def has_column(conn, table_name, column_name):
+    """Check whether a column exists, for steps that add columns to live tables"""
+    return any(col['name'] == column_name for col in inspect(conn).get_columns(table_name))
+
+
+@migration(1, 'Composite indexes for listing, inbox and negotiation hot paths')
+def _listing_indexes(conn):
+    for table_name in ('products', 'messages', 'price_negotiations'):
+        _create_model_indexes(conn, table_name)
+
+
+@migration(8, 'Backfill and require created_at on users and products')
+def _required_created_at(conn):
+    # Keyset pagination sorts on created_at; NULLs would fall out of the cursor comparison
+    epoch = datetime(1970, 1, 1)
+    conn.execute(text("UPDATE users SET created_at = :epoch WHERE created_at IS NULL"), {'epoch': epoch})
+    conn.execute(text("UPDATE products SET created_at = COALESCE(updated_at, :epoch) WHERE created_at IS NULL"),
+                 {'epoch': epoch})
+    if conn.dialect.name == 'postgresql':
+        # SQLite cannot alter a column in place; the model default keeps new rows non-null there
+        conn.execute(text("ALTER TABLE users ALTER COLUMN created_at SET NOT NULL"))
+        conn.execute(text("ALTER TABLE products ALTER COLUMN created_at SET NOT NULL"))
+
+
+def upgrade():
+    """Apply all pending migrations, each in its own transaction"""
+    with db.engine.connect() as conn:
+        done = applied_versions(conn)
+        conn.commit()
+
+    applied = []
+    for version, description, func in MIGRATIONS:
+        if version in done:
+            continue
+        with db.engine.begin() as conn:
+            func(conn)
+            conn.execute(
+                text("INSERT INTO schema_migrations (version, description, applied_at) "
+                     "VALUES (:version, :description, :applied_at)"),
+                {'version': version, 'description': description, 'applied_at': datetime.utcnow()}
+            )
+        logger.info(f"Applied migration {version}: {description}")
+        applied.append(version)
+    return applied
+
+
+# ===== EXPLAIN checks =====
+
+def _hot_queries():
+    """Representative hot-path queries paired with the index each should use"""
+    from models import Product, Message, PriceNegotiation
+
+    return [
+        ('storefront by category',
+         Product.query.filter_by(status='approved', category_id=1)
+         .order_by(Product.created_at.desc(), Product.id.desc()).limit(25),
+         'ix_products_status_category_created'),
+        ('storefront all categories',
+         Product.query.filter_by(status='approved')
+         .order_by(Product.created_at.desc(), Product.id.desc()).limit(25),
+         'ix_products_status_created'),
+        ('seller products',
+         Product.query.filter_by(user_id=1)
+         .order_by(Product.created_at.desc(), Product.id.desc()).limit(25),
+         'ix_products_user_created'),
+        ('seller unread messages',
+         Message.query.filter_by(seller_id=1, is_read=False),
+         'ix_messages_seller_read'),
+        ('message thread replies',
+         Message.query.filter_by(parent_message_id=1).order_by(Message.created_at.asc()),
+         'ix_messages_parent'),
+        ('pending negotiation lookup',
+         PriceNegotiation.query.filter_by(product_id=1, buyer_id=1, status='pending'),
+         'ix_negotiations_product_buyer_status'),
+    ]
+
+
+def explain_hot_queries():
+    """
+    Run EXPLAIN for each hot query and report whether the expected index is used
+    Returns a list of dicts with name, index, uses_index and plan
+    """
+    dialect = db.engine.dialect
+    prefix = 'EXPLAIN QUERY PLAN ' if dialect.name == 'sqlite' else 'EXPLAIN '
+
+    results = []
+    for name, query, index_name in _hot_queries():
+        sql = str(query.statement.compile(dialect=dialect, compile_kwargs={'literal_binds': True}))
+        rows = db.session.execute(text(prefix + sql)).fetchall()
+        plan = '\n'.join(' '.join(str(col) for col in row) for row in rows)
+        results.append({
+            'name': name,
+            'index': index_name,
+            'uses_index': index_name in plan,
+            'plan': plan
+        })
+    return results
+
+
+# ===== CLI =====
+
+def init_app(app):
+    """Register the `db` command group on the Flask CLI"""
+
+    @app.cli.group('db')
+    def db_cli():
+        """Schema migration commands"""
+
+    @db_cli.command('upgrade')
+    def upgrade_command():
+        """Apply pending schema migrations"""
+        applied = upgrade()
+        click.echo(f"Applied {len(applied)} migration(s)" if applied else "Schema is up to date")
+
+    @db_cli.command('status')
+    def status_command():
+        """Show applied and pending migrations"""
+        with db.engine.connect() as conn:
+            done = applied_versions(conn)
+            conn.commit()
+        for version, description, _ in MIGRATIONS:
+            state = 'applied' if version in done else 'pending'
+            click.echo(f"{version:>4}  {state:<8} {description}")
+
+    @db_cli.command('explain')
+    @click.option('--verbose', is_flag=True, help='Print the full query plans')
+    def explain_command(verbose):
+        """Check that hot queries use their composite indexes"""
+        failures = 0
+        for result in explain_hot_queries():
+            status = 'OK  ' if result['uses_index'] else 'MISS'
+            failures += not result['uses_index']
+            click.echo(f"[{status}] {result['name']} -> {result['index']}")
+            if verbose or not result['uses_index']:
+                click.echo('       ' + result['plan'].replace('\n', '\n       '))
+        if failures:
+            # Small PostgreSQL tables legitimately prefer sequential scans
+            raise click.ClickException(f"{failures} hot query(ies) not using the expected index")
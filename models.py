@@ -20,7 +20,9 @@ class User(UserMixin, db.Model):
     phone = db.Column(db.String(20), nullable=True)
     password = db.Column(db.String(255), nullable=False)
     role = db.Column(db.String(20), default='user')  # 'user' or 'admin'
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    # Part of the login session id; bumped when the password changes to end other sessions
+    session_version = db.Column(db.Integer, nullable=False, default=0)
     
     # Password reset fields
     reset_token = db.Column(db.String(100), nullable=True, unique=True)
@@ -29,16 +31,26 @@ class User(UserMixin, db.Model):
     # Relationship
     products = db.relationship('Product', backref='user', lazy=True)
 
+    def get_id(self):
+        return f"{self.id}:{self.session_version or 0}"
+
 class Product(db.Model):
     __tablename__ = 'products'
+    __table_args__ = (
+        db.Index('ix_products_status_category_created', 'status', 'category_id', 'created_at'),
+        db.Index('ix_products_status_created', 'status', 'created_at'),
+        db.Index('ix_products_user_created', 'user_id', 'created_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(200), nullable=False)
     description = db.Column(db.Text)
     price = db.Column(db.Float, nullable=False)
     image_url = db.Column(db.String(500))
+    image_variants = db.Column(db.Text)  # JSON {name: {url, width}}, written by images.py
+    search_key = db.Column(db.Text)  # Normalized name + description, kept by search.py
     status = db.Column(db.String(20), default='pending')  # 'pending', 'approved', 'rejected'
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # Foreign Keys
@@ -53,6 +65,9 @@ class Product(db.Model):
 
 class PriceNegotiation(db.Model):
     __tablename__ = 'price_negotiations'
+    __table_args__ = (
+        db.Index('ix_negotiations_product_buyer_status', 'product_id', 'buyer_id', 'status'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     offered_price = db.Column(db.Float, nullable=False)
@@ -75,6 +90,11 @@ class PriceNegotiation(db.Model):
 
 class Message(db.Model):
     __tablename__ = 'messages'
+    __table_args__ = (
+        db.Index('ix_messages_seller_read', 'seller_id', 'is_read'),
+        db.Index('ix_messages_parent', 'parent_message_id'),
+        db.Index('ix_messages_product', 'product_id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
@@ -97,4 +117,71 @@ class Message(db.Model):
     replies = db.relationship('Message', backref=db.backref('parent', remote_side=[id]))
     
     def __repr__(self):
-        return f'<Message from {self.buyer_email} to {self.seller.email}>'
\ No newline at end of file
+        return f'<Message from {self.buyer_email} to {self.seller.email}>'
+
+class EmailOutbox(db.Model):
+    __tablename__ = 'email_outbox'
+    __table_args__ = (
+        db.Index('ix_email_outbox_status_next_attempt', 'status', 'next_attempt_at'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    to_email = db.Column(db.String(120), nullable=False)
+    subject = db.Column(db.String(300), nullable=False)
+    content = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), default='pending')  # 'pending', 'sending', 'sent', 'failed'
+    attempts = db.Column(db.Integer, default=0)
+    last_error = db.Column(db.Text)
+    claim_token = db.Column(db.String(32))
+    claimed_at = db.Column(db.DateTime)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+    
+    # Message whose email_sent flag is updated on delivery
+    message_id = db.Column(db.Integer, db.ForeignKey('messages.id'), nullable=True)
+    message = db.relationship('Message')
+    
+    def __repr__(self):
+        return f'<EmailOutbox {self.id} to {self.to_email} ({self.status})>'
+
+class UnreadCounter(db.Model):
+    __tablename__ = 'unread_counters'
+    
+    # Product owner's user id; owner 0 holds the total across all sellers
+    owner_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<UnreadCounter {self.owner_id}: {self.count}>'
+
+class UploadBlob(db.Model):
+    __tablename__ = 'upload_blobs'
+    
+    # SHA-256 of the file contents; the file lives at static/uploads/<digest[:2]>/<digest>.<extension>
+    digest = db.Column(db.String(64), primary_key=True)
+    extension = db.Column(db.String(10), nullable=False)
+    size = db.Column(db.BigInteger, nullable=False, default=0)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)  # products whose image_url points here
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<UploadBlob {self.digest[:12]} refs={self.ref_count}>'
+
+class AdminStatsSnapshot(db.Model):
+    __tablename__ = 'admin_stats_snapshot'
+    
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)  # single row, id 1
+    total_users = db.Column(db.Integer, nullable=False, default=0)
+    admin_users = db.Column(db.Integer, nullable=False, default=0)
+    total_products = db.Column(db.Integer, nullable=False, default=0)
+    pending_products = db.Column(db.Integer, nullable=False, default=0)
+    approved_products = db.Column(db.Integer, nullable=False, default=0)
+    new_products = db.Column(db.Integer, nullable=False, default=0)  # created in the last 7 days
+    total_messages = db.Column(db.Integer, nullable=False, default=0)
+    unread_messages = db.Column(db.Integer, nullable=False, default=0)
+    refreshed_at = db.Column(db.DateTime)
+    
+    def __repr__(self):
+        return f'<AdminStatsSnapshot {self.refreshed_at}>'
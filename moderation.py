@@ -0,0 +1,102 @@
+"""
+Bulk product moderation for Flohmarkt
+Approves, rejects or deletes many products with one UPDATE/DELETE per chunk
+and releases deleted products' uploads, removing files nothing else uses
+"""
+
+import logging
+from datetime import datetime
+
+from app import db
+from models import Message, PriceNegotiation, Product
+from uploads import upload_store
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 500
+MAX_PRODUCTS_PER_REQUEST = 5000
+STATUS_ACTIONS = {'approve': 'approved', 'reject': 'rejected'}
+ACTIONS = tuple(STATUS_ACTIONS) + ('delete',)
+
+
+def _chunks(items, size=CHUNK_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _set_status(chunk, rows, status, results, changed):
+    targets = [product_id for product_id, current, _ in rows if current != status]
+    for product_id, current, _ in rows:
+        if current == status:
+            results[product_id] = 'unchanged'
+    if not targets:
+        return
+    Product.query.filter(Product.id.in_(targets), Product.status != status).update(
+        {'status': status, 'updated_at': datetime.utcnow()}, synchronize_session=False
+    )
+    for product_id in targets:
+        results[product_id] = status
+    changed.extend(targets)
+
+
+def _delete(chunk, rows, results, changed, images):
+    # Messages reference products without a cascade, so those products are kept
+    with_messages = {product_id for (product_id,) in
+                     db.session.query(Message.product_id).filter(Message.product_id.in_(chunk)).distinct()}
+    targets, released = [], []
+    for product_id, _, image_url in rows:
+        if product_id in with_messages:
+            results[product_id] = 'has_messages'
+        else:
+            targets.append(product_id)
+            if image_url:
+                released.append(image_url)
+    if not targets:
+        return
+    upload_store.release(*released)
+    images.update(released)
+    PriceNegotiation.query.filter(PriceNegotiation.product_id.in_(targets)).delete(synchronize_session=False)
+    Product.query.filter(Product.id.in_(targets)).delete(synchronize_session=False)
+    for product_id in targets:
+        results[product_id] = 'deleted'
+    changed.extend(targets)
+
+
+def bulk_moderate(action, product_ids):
+    """
+    Apply `action` to products, committing once per chunk
+    Returns ({id: result}, changed_ids); results are the new status, 'deleted',
+    'unchanged', 'not_found', 'has_messages' or 'error'
+    """
+    if action not in ACTIONS:
+        raise ValueError(f"Unsupported action: {action}")
+
+    product_ids = list(dict.fromkeys(product_ids))
+    results, changed, images = {}, [], set()
+    for chunk in _chunks(product_ids):
+        chunk_images = set()
+        try:
+            rows = (db.session.query(Product.id, Product.status, Product.image_url)
+                    .filter(Product.id.in_(chunk)).all())
+            found = {row[0] for row in rows}
+            for product_id in chunk:
+                if product_id not in found:
+                    results[product_id] = 'not_found'
+
+            if action == 'delete':
+                _delete(chunk, rows, results, changed, chunk_images)
+            else:
+                _set_status(chunk, rows, STATUS_ACTIONS[action], results, changed)
+            db.session.commit()
+            images |= chunk_images
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Bulk {action} failed for {len(chunk)} product(s): {e}")
+            chunk_ids = set(chunk)
+            changed = [product_id for product_id in changed if product_id not in chunk_ids]
+            for product_id in chunk:
+                results[product_id] = 'error'
+
+    if images:
+        upload_store.remove_unreferenced(images)
+    return results, changed
@@ -0,0 +1,43 @@
+"""
+Arabic-aware text normalization for Flohmarkt search
+Folds spelling variants so listings match regardless of how a word was typed
+"""
+
+import re
+import unicodedata
+
+# Harakat, Quranic annotation marks and superscript alef
+DIACRITICS = re.compile('[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed]')
+TATWEEL = '\u0640'
+WHITESPACE = re.compile(r'\s+')
+
+CHARACTER_MAP = str.maketrans({
+    'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا',
+    'ة': 'ه',
+    'ى': 'ي',
+    'ؤ': 'و',
+    'ئ': 'ي',
+    '٠': '0', '١': '1', '٢': '2', '٣': '3', '٤': '4',
+    '٥': '5', '٦': '6', '٧': '7', '٨': '8', '٩': '9',
+    '۰': '0', '۱': '1', '۲': '2', '۳': '3', '۴': '4',
+    '۵': '5', '۶': '6', '۷': '7', '۸': '8', '۹': '9',
+})
+
+
+def normalize_text(value):
+    """
+    Normalize text for matching
+    Folds alef/hamza forms, taa marbuta, alef maqsura and Eastern digits,
+    strips tatweel and diacritics, casefolds Latin and collapses whitespace
+    """
+    if not value:
+        return ''
+    value = unicodedata.normalize('NFKC', value)
+    value = DIACRITICS.sub('', value).replace(TATWEEL, '')
+    value = value.translate(CHARACTER_MAP).casefold()
+    return WHITESPACE.sub(' ', value).strip()
+
+
+def product_search_key(name, description):
+    """Precomputed search key stored on Product.search_key"""
+    return normalize_text(f"{name or ''} {description or ''}")
@@ -0,0 +1,145 @@
+"""
+Push notifications for the seller inbox over Server-Sent Events
+Message writes bump a per-seller change version in a shared store; streams are
+short long-polls that only read that version and answer as soon as it changes
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+
+import queries
+from app import db
+from response_cache import create_backend, default_backend_name
+
+logger = logging.getLogger(__name__)
+
+ADMIN_CHANNEL = 'inbox:admin'
+
+
+def seller_channel(user_id):
+    return f'inbox:{user_id}'
+
+
+def _event(name, data, last_id, version):
+    # The id carries the channel version too, so a reconnect can tell whether anything changed
+    return f"id: {last_id}:{version}\nevent: {name}\ndata: {json.dumps(data)}\n\n"
+
+
+def parse_event_id(value):
+    """(last message id, channel version) from a Last-Event-ID header; (None, None) when unusable"""
+    last_id, _, version = (value or '').partition(':')
+    try:
+        return int(last_id), version or None
+    except ValueError:
+        return None, None
+
+
+def _message_data(message):
+    return {
+        'id': message.id,
+        'parent_message_id': message.parent_message_id,
+        'is_reply': bool(message.is_reply)
+    }
+
+
+class InboxNotifier:
+    def __init__(self, app=None):
+        self.backend = None
+        self.poll_interval = 2.0
+        self.max_stream_seconds = 10
+        self.retry_ms = 3000
+        self.busy_retry_seconds = 30
+        self.max_streams = 4
+        self._slots = threading.BoundedSemaphore(self.max_streams)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.poll_interval = float(os.environ.get('SSE_POLL_INTERVAL', 2))
+        # Each stream holds a sync worker thread, so it ends after the first change or
+        # a few seconds of silence; EventSource reconnects after the retry delay
+        self.max_stream_seconds = int(os.environ.get('SSE_MAX_STREAM_SECONDS', 10))
+        self.retry_ms = int(os.environ.get('SSE_RETRY_MS', 3000))
+        self.busy_retry_seconds = int(os.environ.get('SSE_BUSY_RETRY_SECONDS', 30))
+        # Keeps most of a worker's threads free for ordinary requests
+        self.max_streams = int(os.environ.get('SSE_MAX_STREAMS', 4))
+        self._slots = threading.BoundedSemaphore(self.max_streams)
+        try:
+            self.backend = create_backend(default_backend_name(), namespace='inbox')
+        except Exception as e:
+            logger.error(f"Inbox notifications disabled: {e}")
+            self.backend = None
+
+    def acquire(self):
+        """Claim a stream slot in this worker without waiting; False when all are busy"""
+        return self._slots.acquire(blocking=False)
+
+    def release(self):
+        self._slots.release()
+
+    def bump(self, seller_id):
+        """Record that a seller's inbox changed; admins watch every inbox"""
+        if self.backend is None:
+            return
+        try:
+            self.backend.bump(seller_channel(seller_id))
+            self.backend.bump(ADMIN_CHANNEL)
+        except Exception as e:
+            logger.warning(f"Inbox version bump failed for seller {seller_id}: {e}")
+
+    def version(self, channel):
+        return self.backend.get_versions([channel])[0] if self.backend else None
+
+    def _changes(self, user_id, is_admin, last_id, version):
+        """Frames for messages after `last_id` plus the unread count, and the newest message id"""
+        frames = []
+        if last_id is None:
+            # First connection: only the badge, nothing before it counts as new
+            last_id = queries.latest_message_id()
+        else:
+            for message in queries.messages_since(user_id, is_admin, last_id):
+                last_id = message.id
+                frames.append(_event('message', _message_data(message), last_id, version))
+        count = queries.unread_message_count(user_id, is_admin)
+        frames.append(_event('unread', {'count': count}, last_id, version))
+        # Release the pooled connection while the stream idles
+        db.session.remove()
+        return frames, last_id
+
+    def stream(self, user_id, is_admin, last_event_id=None):
+        """
+        Yield SSE frames: `message` for each new message or reply and `unread` with
+        the badge count. Event ids are "<message id>:<channel version>"; a reconnecting
+        EventSource sends the last one back, and while the version has not moved the
+        stream only waits on it, without touching the database.
+        """
+        channel = ADMIN_CHANNEL if is_admin else seller_channel(user_id)
+        started = time.monotonic()
+
+        seen_version = self.version(channel)
+        last_id, last_version = parse_event_id(last_event_id)
+        yield f"retry: {self.retry_ms}\n\n"
+
+        if last_id is None or seen_version is None or last_version != str(seen_version):
+            resuming = last_id is not None
+            frames, last_id = self._changes(user_id, is_admin, last_id, seen_version)
+            yield from frames
+            if resuming and len(frames) > 1:
+                # Messages arrived between two streams; the client reconnects for the next change
+                return
+
+        while time.monotonic() - started < self.max_stream_seconds:
+            time.sleep(self.poll_interval)
+            current = self.version(channel)
+            if current == seen_version:
+                continue
+            frames, last_id = self._changes(user_id, is_admin, last_id, current)
+            yield from frames
+            return
+
+
+# Global instance
+inbox_notifier = InboxNotifier()
@@ -0,0 +1,270 @@
+"""
+Transactional email outbox for Flohmarkt
+Requests only insert outbox rows; a background dispatcher sends them in
+batches with retry/backoff and records delivery on the related messages
+"""
+
+import logging
+import os
+import threading
+import uuid
+from datetime import datetime, timedelta
+
+import click
+from sqlalchemy import and_, or_
+
+from app import db
+from models import EmailOutbox, Message
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 5
+BASE_BACKOFF_SECONDS = 30
+MAX_BACKOFF_SECONDS = 3600
+CLAIM_TIMEOUT = timedelta(minutes=10)
+MAX_SUBJECT_LENGTH = EmailOutbox.subject.type.length
+
+
+def enqueue_email(to_email, subject, content, message=None):
+    """Add an email to the outbox in the caller's transaction; the caller commits"""
+    entry = EmailOutbox()
+    entry.to_email = to_email
+    # Subjects quote product names; an overlong one must not fail the caller's transaction
+    if len(subject) > MAX_SUBJECT_LENGTH:
+        subject = subject[:MAX_SUBJECT_LENGTH - 1] + '…'
+    entry.subject = subject
+    entry.content = content
+    entry.message = message
+    entry.status = 'pending'
+    entry.attempts = 0
+    entry.next_attempt_at = datetime.utcnow()
+    db.session.add(entry)
+    return entry
+
+
+def backoff_delay(attempts):
+    """Exponential backoff after the given number of failed attempts"""
+    return timedelta(seconds=min(BASE_BACKOFF_SECONDS * 2 ** (attempts - 1), MAX_BACKOFF_SECONDS))
+
+
+# ===== Transports =====
+
+class SendGridTransport:
+    """Sends through SendGrid, reusing one API client for every email"""
+
+    def __init__(self, api_key, from_email='noreply@flowmarket.com'):
+        from sendgrid import SendGridAPIClient
+
+        self.client = SendGridAPIClient(api_key)
+        self.from_email = from_email
+
+    def send(self, to_email, subject, content):
+        from sendgrid.helpers.mail import Mail
+
+        html_content = f"""
+        <div style="font-family: Arial, sans-serif; direction: rtl; text-align: right;">
+            <h2 style="color: #2c5aa0;">رسالة جديدة من فلوماركت</h2>
+            {content.replace(chr(10), '<br>')}
+            <hr style="margin: 20px 0;">
+            <p style="color: #666; font-size: 14px;">
+                هذه رسالة تلقائية من موقع فلوماركت. يرجى عدم الرد على هذا البريد الإلكتروني.
+            </p>
+        </div>
+        """
+        message = Mail(
+            from_email=self.from_email,
+            to_emails=to_email,
+            subject=subject,
+            html_content=html_content
+        )
+        response = self.client.send(message)
+        if response.status_code != 202:
+            raise RuntimeError(f"SendGrid error {response.status_code}: {response.body}")
+
+
+class LogTransport:
+    """Used when no mail provider is configured; logs and reports failure"""
+
+    def send(self, to_email, subject, content):
+        logger.info(f"Email content for {to_email}: {content}")
+        raise RuntimeError('SendGrid API key not found - email sending disabled')
+
+
+class StubTransport:
+    """Records emails in memory instead of sending them, for tests and local runs"""
+
+    def __init__(self):
+        self.sent = []
+
+    def send(self, to_email, subject, content):
+        self.sent.append({'to_email': to_email, 'subject': subject, 'content': content})
+
+
+def create_transport():
+    name = os.environ.get('EMAIL_TRANSPORT')
+    if name == 'stub':
+        return StubTransport()
+    api_key = os.environ.get('SENDGRID_API_KEY')
+    if api_key and name in (None, 'sendgrid'):
+        return SendGridTransport(api_key)
+    logger.warning("SendGrid API key not found - email sending disabled")
+    return LogTransport()
+
+
+# ===== Dispatcher =====
+
+class OutboxDispatcher:
+    def __init__(self, app=None):
+        self.app = None
+        self.transport = None
+        self.interval = 5
+        self.batch_size = 50
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._thread_pid = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.interval = float(os.environ.get('OUTBOX_POLL_INTERVAL', 5))
+        self.batch_size = int(os.environ.get('OUTBOX_BATCH_SIZE', 50))
+        # Set OUTBOX_WORKER=0 when a separate `flask outbox run` process does the sending
+        if os.environ.get('OUTBOX_WORKER', '1') != '0':
+            app.before_request(self._ensure_worker)
+        self.register_commands(app)
+
+    def get_transport(self):
+        if self.transport is None:
+            self.transport = create_transport()
+        return self.transport
+
+    def notify(self):
+        """Wake this process's dispatcher after committing new outbox rows"""
+        self._wakeup.set()
+
+    def _claim_batch(self):
+        """
+        Atomically claim up to batch_size due rows with a unique token
+        Rows left in 'sending' by a crashed dispatcher are reclaimed after CLAIM_TIMEOUT
+        """
+        now = datetime.utcnow()
+        due = or_(
+            and_(EmailOutbox.status == 'pending', EmailOutbox.next_attempt_at <= now),
+            and_(EmailOutbox.status == 'sending', EmailOutbox.claimed_at < now - CLAIM_TIMEOUT)
+        )
+        candidate_ids = [row.id for row in db.session.query(EmailOutbox.id)
+                         .filter(due).order_by(EmailOutbox.id).limit(self.batch_size)]
+        if not candidate_ids:
+            return []
+
+        token = uuid.uuid4().hex
+        EmailOutbox.query.filter(EmailOutbox.id.in_(candidate_ids), due).update(
+            {'status': 'sending', 'claim_token': token, 'claimed_at': now},
+            synchronize_session=False
+        )
+        db.session.commit()
+        return EmailOutbox.query.filter_by(claim_token=token, status='sending').all()
+
+    def dispatch_batch(self):
+        """Send one batch; returns (sent, failed) counts"""
+        entries = self._claim_batch()
+        if not entries:
+            return 0, 0
+
+        transport = self.get_transport()
+        now = datetime.utcnow()
+        sent_ids, message_ids, failed = [], [], 0
+        for entry in entries:
+            try:
+                transport.send(entry.to_email, entry.subject, entry.content)
+                sent_ids.append(entry.id)
+                if entry.message_id:
+                    message_ids.append(entry.message_id)
+            except Exception as e:
+                failed += 1
+                entry.attempts = (entry.attempts or 0) + 1
+                entry.last_error = str(e)[:1000]
+                if entry.attempts >= MAX_ATTEMPTS:
+                    entry.status = 'failed'
+                    logger.error(f"❌ EMAIL DELIVERY FAILED - Giving up on {entry.to_email}: {e}")
+                else:
+                    entry.status = 'pending'
+                    entry.next_attempt_at = now + backoff_delay(entry.attempts)
+                    logger.warning(f"Email to {entry.to_email} failed (attempt {entry.attempts}): {e}")
+
+        if sent_ids:
+            EmailOutbox.query.filter(EmailOutbox.id.in_(sent_ids)).update(
+                {'status': 'sent', 'sent_at': now, 'attempts': EmailOutbox.attempts + 1},
+                synchronize_session=False
+            )
+        if message_ids:
+            Message.query.filter(Message.id.in_(message_ids)).update(
+                {'email_sent': True, 'email_sent_at': now}, synchronize_session=False
+            )
+        db.session.commit()
+        if sent_ids:
+            logger.info(f"✅ EMAIL DELIVERY CONFIRMED - {len(sent_ids)} outbox email(s) sent")
+        return len(sent_ids), failed
+
+    def drain(self):
+        """Dispatch batches until nothing is due; returns (sent, failed) totals"""
+        total_sent = total_failed = 0
+        while True:
+            sent, failed = self.dispatch_batch()
+            total_sent += sent
+            total_failed += failed
+            if sent + failed < self.batch_size:
+                return total_sent, total_failed
+
+    # ===== Background worker =====
+
+    def _ensure_worker(self):
+        if self._thread is not None and self._thread_pid == os.getpid():
+            return
+        self._thread_pid = os.getpid()
+        self._thread = threading.Thread(target=self.run_forever, name='email-outbox', daemon=True)
+        self._thread.start()
+
+    def run_forever(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                with self.app.app_context():
+                    self.drain()
+                    db.session.remove()
+            except Exception as e:
+                logger.error(f"Email outbox dispatch failed: {e}")
+
+    # ===== CLI =====
+
+    def register_commands(self, app):
+        """Register the `outbox` command group on the Flask CLI"""
+
+        @app.cli.group('outbox')
+        def outbox_cli():
+            """Email outbox commands"""
+
+        @outbox_cli.command('dispatch')
+        def dispatch_command():
+            """Send every email that is currently due"""
+            sent, failed = self.drain()
+            click.echo(f"Sent {sent} email(s), {failed} failed")
+
+        @outbox_cli.command('run')
+        def run_command():
+            """Run a standalone dispatcher loop"""
+            click.echo(f"Dispatching email outbox every {self.interval}s")
+            self.run_forever()
+
+        @outbox_cli.command('status')
+        def status_command():
+            """Show outbox counts by status"""
+            rows = db.session.query(EmailOutbox.status, db.func.count(EmailOutbox.id)).group_by(EmailOutbox.status)
+            for status, count in rows:
+                click.echo(f"{status:<8} {count}")
+
+
+# Global instance
+outbox_dispatcher = OutboxDispatcher()
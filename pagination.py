@@ -0,0 +1,129 @@
+"""
+Keyset (cursor) pagination helpers for Flohmarkt
+Pages listings over (created_at, id) so page cost stays flat regardless of depth
+"""
+
+import base64
+import binascii
+import json
+from datetime import datetime
+from sqlalchemy import and_, or_
+
+DEFAULT_PAGE_SIZE = 24
+MAX_PAGE_SIZE = 100
+
+
+def encode_cursor(created_at, item_id):
+    """Encode a (created_at, id) pair into an opaque URL-safe cursor"""
+    raw = f"{created_at.isoformat()}|{item_id}".encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor produced by encode_cursor
+    Returns (created_at, id) or None if the cursor is missing or malformed
+    """
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8')
+        created_at, item_id = raw.rsplit('|', 1)
+        return datetime.fromisoformat(created_at), int(item_id)
+    except (ValueError, UnicodeError, binascii.Error):
+        return None
+
+
+def clamp_page_size(value, default=DEFAULT_PAGE_SIZE):
+    """Parse a requested page size and keep it within sane bounds"""
+    try:
+        size = int(value)
+    except (TypeError, ValueError):
+        return default
+    return max(1, min(size, MAX_PAGE_SIZE))
+
+
+def keyset_page(query, model, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """
+    Fetch one page of `query` ordered newest first by (created_at, id)
+
+    The query must not carry its own ORDER BY. One extra row is fetched to
+    detect whether another page exists, so no COUNT or OFFSET is ever issued.
+    Returns (items, next_cursor); next_cursor is None on the last page.
+    """
+    position = decode_cursor(cursor)
+    if position is not None:
+        created_at, item_id = position
+        query = query.filter(or_(
+            model.created_at < created_at,
+            and_(model.created_at == created_at, model.id < item_id)
+        ))
+
+    rows = query.order_by(model.created_at.desc(), model.id.desc()).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(last.created_at, last.id)
+
+    return rows, next_cursor
+
+
+def encode_sort_cursor(value, item_id):
+    """Encode a (sort value, id) pair for keyset_page_by; datetimes keep their type"""
+    if isinstance(value, datetime):
+        payload = ['dt', value.isoformat(), item_id]
+    else:
+        payload = ['v', value, item_id]
+    raw = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_sort_cursor(cursor):
+    """Decode a cursor produced by encode_sort_cursor; None if missing or malformed"""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        kind, value, item_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+        if kind == 'dt':
+            value = datetime.fromisoformat(value)
+        return value, int(item_id)
+    except (ValueError, TypeError, UnicodeError, binascii.Error):
+        return None
+
+
+def sort_order(sort_column, id_column, descending=True):
+    """ORDER BY clauses matching keyset_page_by, for callers that stream every row"""
+    if descending:
+        return sort_column.desc(), id_column.desc()
+    return sort_column.asc(), id_column.asc()
+
+
+def keyset_page_by(query, sort_column, id_column, descending=True, cursor=None,
+                   limit=DEFAULT_PAGE_SIZE, entity=None):
+    """
+    Like keyset_page, but ordered by any non-null column with the id as tie-breaker
+
+    `entity` picks the model instance out of each row for queries that return
+    tuples, e.g. (user, product_count). Returns (rows, next_cursor).
+    """
+    position = decode_sort_cursor(cursor)
+    if position is not None:
+        value, item_id = position
+        if descending:
+            query = query.filter(or_(sort_column < value, and_(sort_column == value, id_column < item_id)))
+        else:
+            query = query.filter(or_(sort_column > value, and_(sort_column == value, id_column > item_id)))
+
+    rows = query.order_by(*sort_order(sort_column, id_column, descending)).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = entity(rows[-1]) if entity else rows[-1]
+        next_cursor = encode_sort_cursor(getattr(last, sort_column.key), getattr(last, id_column.key))
+
+    return rows, next_cursor
@@ -0,0 +1,186 @@
+"""
+Shared read queries for Flohmarkt views
+Builds listing and admin views with eager loading or grouped counts so each
+endpoint issues a constant number of queries regardless of row count
+"""
+
+from contextlib import contextmanager
+
+from sqlalchemy import event, func
+from sqlalchemy.orm import aliased, joinedload
+
+import counters
+from app import db
+from models import User, Category, Product, PriceNegotiation, Message
+
+
+def products_with_relations(query=None):
+    """Product query with category and seller loaded in the same SELECT"""
+    query = query if query is not None else Product.query
+    return query.options(joinedload(Product.category), joinedload(Product.user))
+
+
+def messages_with_product(query=None):
+    """Message query with the related product loaded in the same SELECT"""
+    query = query if query is not None else Message.query
+    return query.options(joinedload(Message.product))
+
+
+def categories_with_product_counts():
+    """Return [(category, product_count)] using one grouped LEFT JOIN"""
+    return (
+        db.session.query(Category, func.count(Product.id))
+        .outerjoin(Product, Product.category_id == Category.id)
+        .group_by(Category.id)
+        .order_by(Category.id)
+        .all()
+    )
+
+
+ADMIN_PRODUCT_SORTS = {
+    'created_at': Product.created_at,
+    'price': Product.price,
+    'name': Product.name,
+    'id': Product.id,
+}
+
+ADMIN_USER_SORTS = {
+    'created_at': User.created_at,
+    'fullname': User.fullname,
+    'email': User.email,
+    'id': User.id,
+}
+
+
+def _created_between(query, column, created_from=None, created_to=None):
+    if created_from is not None:
+        query = query.filter(column >= created_from)
+    if created_to is not None:
+        query = query.filter(column < created_to)
+    return query
+
+
+def admin_products_query(status=None, category_id=None, seller_id=None, created_from=None, created_to=None):
+    """Filtered admin product query with category and seller eagerly loaded; no ORDER BY"""
+    return filter_products(products_with_relations(), status, category_id, seller_id, created_from, created_to)
+
+
+def filter_products(query, status=None, category_id=None, seller_id=None, created_from=None, created_to=None):
+    """Apply the admin product filters to any query over Product"""
+    if status:
+        query = query.filter(Product.status == status)
+    if category_id:
+        query = query.filter(Product.category_id == category_id)
+    if seller_id:
+        query = query.filter(Product.user_id == seller_id)
+    return _created_between(query, Product.created_at, created_from, created_to)
+
+
+def admin_users_query(role=None, created_from=None, created_to=None):
+    """Filtered (user, product_count) query as one grouped LEFT JOIN; no ORDER BY"""
+    query = (
+        db.session.query(User, func.count(Product.id))
+        .outerjoin(Product, Product.user_id == User.id)
+        .group_by(User.id)
+    )
+    if role:
+        query = query.filter(User.role == role)
+    return _created_between(query, User.created_at, created_from, created_to)
+
+
+def product_negotiations(product_id):
+    """Negotiations for a product, newest first, with buyers eagerly loaded"""
+    return (
+        PriceNegotiation.query
+        .options(joinedload(PriceNegotiation.buyer))
+        .filter_by(product_id=product_id)
+        .order_by(PriceNegotiation.created_at.desc())
+        .all()
+    )
+
+
+def visible_messages(user_id, is_admin):
+    """Messages a user may see in the inbox: all for admins, own products' for sellers"""
+    if is_admin:
+        return Message.query
+    return Message.query.join(Product, Message.product_id == Product.id).filter(Product.user_id == user_id)
+
+
+def unread_message_count(user_id, is_admin):
+    """Number of unread inbox messages for a seller, or for everyone when admin"""
+    return counters.unread_count(counters.GLOBAL_OWNER_ID if is_admin else user_id)
+
+
+def latest_message_id():
+    return db.session.query(func.max(Message.id)).scalar() or 0
+
+
+def messages_since(user_id, is_admin, after_id, limit=100):
+    """Inbox messages and replies created after `after_id`, oldest first"""
+    return (
+        visible_messages(user_id, is_admin)
+        .filter(Message.id > after_id)
+        .order_by(Message.id)
+        .limit(limit)
+        .all()
+    )
+
+
+def thread_replies(user_id, is_admin, parent_ids, after_id=0, limit=200):
+    """
+    Replies in the given threads with ids above `after_id`, oldest first
+    Ownership is checked through the parent message's product in the same SELECT
+    """
+    parent = aliased(Message)
+    query = (
+        Message.query
+        .join(parent, Message.parent_message_id == parent.id)
+        .filter(parent.id.in_(parent_ids), Message.id > after_id)
+    )
+    if not is_admin:
+        query = query.join(Product, parent.product_id == Product.id).filter(Product.user_id == user_id)
+    return query.order_by(Message.id).limit(limit).all()
+
+
+# ===== Query counting =====
+
+class QueryCounter:
+    """Collects SQL statements executed on an engine while active"""
+
+    def __init__(self):
+        self.statements = []
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+
+@contextmanager
+def count_queries(engine=None):
+    """
+    Count SQL statements executed inside the block
+
+        with count_queries() as counter:
+            client.get('/api/admin/products')
+        print(counter.count)
+    """
+    engine = engine or db.engine
+    counter = QueryCounter()
+    event.listen(engine, 'before_cursor_execute', counter._record)
+    try:
+        yield counter
+    finally:
+        event.remove(engine, 'before_cursor_execute', counter._record)
+
+
+@contextmanager
+def assert_max_queries(limit, engine=None):
+    """Fail with AssertionError if the block executes more than `limit` statements"""
+    with count_queries(engine) as counter:
+        yield counter
+    if counter.count > limit:
+        executed = '\n'.join(counter.statements)
+        raise AssertionError(f"Expected at most {limit} queries, got {counter.count}:\n{executed}")
@@ -0,0 +1,348 @@
+"""
+Shared response cache for anonymous storefront pages
+Entries are shared by all gunicorn workers through a pluggable backend and
+invalidated by bumping tag versions when products change
+"""
+
+import base64
+import hashlib
+import json
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+from functools import wraps
+
+from flask import current_app, make_response, request, session
+from flask_login import current_user
+
+from i18n import i18n
+
+logger = logging.getLogger(__name__)
+
+LISTINGS_TAG = 'listings'
+
+
+def product_tag(product_id):
+    return f'product:{product_id}'
+
+
+def _dumps(expires, value):
+    # JSON rather than pickle: reading an entry must never be able to run code
+    return json.dumps([expires, value], separators=(',', ':')).encode('utf-8')
+
+
+def _loads(data):
+    expires, value = json.loads(data)
+    return expires, value
+
+
+def secure_directory(path):
+    """
+    Create `path` readable by this user only, or refuse one another user controls
+    Entries are served as pages, so a writable cache directory would let others inject content
+    """
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    info = os.lstat(path)
+    if os.path.islink(path) or info.st_uid != os.getuid():
+        raise PermissionError(f"Cache directory {path} is not owned by this user")
+    if info.st_mode & 0o077:
+        os.chmod(path, 0o700)
+
+
+# ===== Backends =====
+
+class MemoryBackend:
+    """Process-local backend, for development and tests"""
+
+    def __init__(self):
+        self._entries = {}
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.time():
+                self._entries.pop(key, None)
+                return None
+            return entry[1]
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.time() + ttl, value)
+
+    def get_versions(self, tags):
+        with self._lock:
+            return [self._versions.get(tag, 0) for tag in tags]
+
+    def bump(self, tag):
+        with self._lock:
+            self._versions[tag] = self._versions.get(tag, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._versions.clear()
+
+
+class FileSystemBackend:
+    """
+    Backend shared by every worker on a node
+    Point it at /dev/shm to keep entries in shared memory
+    """
+
+    PRUNE_PROBABILITY = 0.005
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.entries_dir = os.path.join(directory, 'entries')
+        self.tags_dir = os.path.join(directory, 'tags')
+        for path in (directory, self.entries_dir, self.tags_dir):
+            secure_directory(path)
+
+    def _write_atomic(self, path, data):
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def get(self, key):
+        path = os.path.join(self.entries_dir, key)
+        try:
+            with open(path, 'rb') as f:
+                expires, value = _loads(f.read())
+        except (OSError, ValueError):
+            return None
+        if expires < time.time():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        return value
+
+    def set(self, key, value, ttl):
+        self._write_atomic(os.path.join(self.entries_dir, key),
+                           _dumps(time.time() + ttl, value))
+        if random.random() < self.PRUNE_PROBABILITY:
+            self.prune()
+
+    def _tag_path(self, tag):
+        return os.path.join(self.tags_dir, hashlib.sha1(tag.encode('utf-8')).hexdigest())
+
+    def get_versions(self, tags):
+        versions = []
+        for tag in tags:
+            try:
+                with open(self._tag_path(tag), 'rb') as f:
+                    versions.append(f.read().decode('ascii'))
+            except OSError:
+                versions.append('0')
+        return versions
+
+    def bump(self, tag):
+        # A fresh unique value avoids read-modify-write races between workers
+        self._write_atomic(self._tag_path(tag), str(time.time_ns()).encode('ascii'))
+
+    def prune(self):
+        """Remove expired entries, scanning the directory lazily"""
+        now = time.time()
+        with os.scandir(self.entries_dir) as entries:
+            for entry in entries:
+                try:
+                    with open(entry.path, 'rb') as f:
+                        expires, _ = _loads(f.read())
+                    if expires < now:
+                        os.remove(entry.path)
+                except (OSError, ValueError):
+                    continue
+
+    def clear(self):
+        for directory in (self.entries_dir, self.tags_dir):
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    try:
+                        os.remove(entry.path)
+                    except OSError:
+                        pass
+
+
+class RedisBackend:
+    """Backend for Redis-compatible servers, shared across nodes"""
+
+    def __init__(self, url, prefix='flowmarket:cache:'):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        data = self.client.get(self.prefix + key)
+        if data is None:
+            return None
+        try:
+            return _loads(data)[1]
+        except ValueError:
+            # Written by an older release
+            return None
+
+    def set(self, key, value, ttl):
+        self.client.set(self.prefix + key, _dumps(time.time() + ttl, value), ex=int(ttl))
+
+    def get_versions(self, tags):
+        if not tags:
+            return []
+        values = self.client.mget([self.prefix + 'tag:' + tag for tag in tags])
+        return [value.decode('ascii') if value else '0' for value in values]
+
+    def bump(self, tag):
+        self.client.incr(self.prefix + 'tag:' + tag)
+
+    def clear(self):
+        for key in self.client.scan_iter(self.prefix + '*'):
+            self.client.delete(key)
+
+
+def default_backend_name():
+    """RESPONSE_CACHE_BACKEND, else redis when REDIS_URL is usable, else filesystem"""
+    name = os.environ.get('RESPONSE_CACHE_BACKEND')
+    if name is None:
+        name = 'filesystem'
+        if os.environ.get('REDIS_URL'):
+            try:
+                import redis  # noqa: F401
+                name = 'redis'
+            except ImportError:
+                logger.warning("REDIS_URL is set but the redis client is not installed")
+    return name
+
+
+def create_backend(name, namespace='cache'):
+    """Build a backend; `namespace` keeps independent users of one store apart"""
+    if name == 'redis':
+        return RedisBackend(os.environ['REDIS_URL'], prefix=f'flowmarket:{namespace}:')
+    if name == 'filesystem':
+        default_dir = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+        root = os.environ.get('RESPONSE_CACHE_DIR', os.path.join(default_dir, 'flowmarket-cache'))
+        secure_directory(root)
+        return FileSystemBackend(root if namespace == 'cache' else os.path.join(root, namespace))
+    if name == 'memory':
+        return MemoryBackend()
+    return None
+
+
+# ===== Cache =====
+
+class ResponseCache:
+    def __init__(self, app=None):
+        self.backend = None
+        self.ttl = 300
+        self.hits = 0
+        self.misses = 0
+        self.bypasses = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Select a backend from RESPONSE_CACHE_BACKEND (redis, filesystem, memory, none)
+        Defaults to redis when REDIS_URL is set and the client is installed, else filesystem
+        """
+        self.ttl = int(os.environ.get('RESPONSE_CACHE_TTL', 300))
+        name = default_backend_name()
+        try:
+            self.backend = create_backend(name)
+        except PermissionError:
+            # Someone else owns the cache directory; serving from it is not safe
+            raise
+        except Exception as e:
+            logger.error(f"Response cache disabled, backend '{name}' failed: {e}")
+            self.backend = None
+
+    def _cacheable_request(self):
+        return (self.backend is not None
+                and request.method == 'GET'
+                and not current_user.is_authenticated
+                and not session.get('_flashes'))
+
+    def _key(self, tags):
+        versions = self.backend.get_versions(tags)
+        parts = [request.path, sorted(request.args.items(multi=True)),
+                 i18n.get_current_language(), list(zip(tags, versions))]
+        return hashlib.sha256(repr(parts).encode('utf-8')).hexdigest()
+
+    def cached(self, tags=None):
+        """
+        Cache a view's response for anonymous visitors
+        `tags` is a callable receiving the view kwargs and returning the tags the page depends on
+        """
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if not self._cacheable_request():
+                    self.bypasses += 1
+                    return view(*args, **kwargs)
+
+                page_tags = list(tags(**kwargs)) if tags else []
+                try:
+                    key = self._key(page_tags)
+                    stored = self.backend.get(key)
+                except Exception as e:
+                    logger.warning(f"Response cache read failed: {e}")
+                    return view(*args, **kwargs)
+
+                if stored is not None:
+                    self.hits += 1
+                    response = current_app.response_class(base64.b64decode(stored['body']),
+                                                          status=stored['status'], headers=stored['headers'])
+                    response.headers['X-Cache'] = 'HIT'
+                    return response.make_conditional(request)
+
+                self.misses += 1
+                response = make_response(view(*args, **kwargs))
+                if response.status_code == 200 and not response.is_streamed:
+                    try:
+                        headers = [(k, v) for k, v in response.headers.items() if k.lower() != 'set-cookie']
+                        self.backend.set(key, {
+                            'body': base64.b64encode(response.get_data()).decode('ascii'),
+                            'status': response.status_code,
+                            'headers': headers,
+                        }, self.ttl)
+                    except Exception as e:
+                        logger.warning(f"Response cache write failed: {e}")
+                response.headers['X-Cache'] = 'MISS'
+                return response
+            return wrapper
+        return decorator
+
+    def invalidate(self, *tags):
+        """Bump tag versions so every page depending on them is re-rendered"""
+        if self.backend is None:
+            return
+        for tag in tags:
+            try:
+                self.backend.bump(tag)
+            except Exception as e:
+                logger.error(f"Response cache invalidation failed for {tag}: {e}")
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'backend': type(self.backend).__name__ if self.backend else None,
+            'hits': self.hits,
+            'misses': self.misses,
+            'bypasses': self.bypasses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+
+# Global instance
+response_cache = ResponseCache()
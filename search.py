@@ -0,0 +1,237 @@
+"""
+Server-side full-text product search for Flohmarkt
+Indexes the normalized Product.search_key with FTS5 on SQLite and a
+tsvector + GIN index on PostgreSQL
+"""
+
+import re
+
+import click
+from sqlalchemy import event, text
+
+import queries
+from app import db
+from migrations import migration, has_column
+from models import Product
+from normalization import normalize_text, product_search_key
+
+TOKEN_PATTERN = re.compile(r'\w+', re.UNICODE)
+MAX_TERMS = 8
+
+
+def search_terms(query_string):
+    """Normalize user input and split it into plain word tokens, dropping any query syntax"""
+    return TOKEN_PATTERN.findall(normalize_text(query_string))[:MAX_TERMS]
+
+
+# ===== Write-time normalization =====
+
+@event.listens_for(Product, 'before_insert')
+@event.listens_for(Product, 'before_update')
+def _set_search_key(mapper, connection, product):
+    product.search_key = product_search_key(product.name, product.description)
+
+
+def backfill_search_keys(conn, only_missing=True, batch_size=1000):
+    """
+    Recompute Product.search_key in id-ordered batches
+    Returns the number of rows updated
+    """
+    select_sql = (
+        "SELECT id, name, description FROM products WHERE id > :last_id "
+        + ("AND search_key IS NULL " if only_missing else "")
+        + "ORDER BY id LIMIT :batch_size"
+    )
+    updated = 0
+    last_id = 0
+    while True:
+        rows = conn.execute(text(select_sql), {'last_id': last_id, 'batch_size': batch_size}).fetchall()
+        if not rows:
+            return updated
+        conn.execute(
+            text("UPDATE products SET search_key = :search_key WHERE id = :id"),
+            [{'id': row.id, 'search_key': product_search_key(row.name, row.description)} for row in rows]
+        )
+        updated += len(rows)
+        last_id = rows[-1].id
+
+
+# ===== Index maintenance =====
+
+SQLITE_INDEX_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+        name, description,
+        content='products', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS products_fts_insert AFTER INSERT ON products BEGIN
+        INSERT INTO products_fts(rowid, name, description)
+        VALUES (new.id, new.name, new.description);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS products_fts_delete AFTER DELETE ON products BEGIN
+        INSERT INTO products_fts(products_fts, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS products_fts_update AFTER UPDATE OF name, description ON products BEGIN
+        INSERT INTO products_fts(products_fts, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+        INSERT INTO products_fts(rowid, name, description)
+        VALUES (new.id, new.name, new.description);
+    END""",
+]
+
+POSTGRES_VECTOR_EXPRESSION = (
+    "to_tsvector('simple', coalesce(name, '') || ' ' || coalesce(description, ''))"
+)
+
+SQLITE_SEARCH_KEY_DDL = [
+    "DROP TRIGGER IF EXISTS products_fts_insert",
+    "DROP TRIGGER IF EXISTS products_fts_delete",
+    "DROP TRIGGER IF EXISTS products_fts_update",
+    "DROP TABLE IF EXISTS products_fts",
+    """CREATE VIRTUAL TABLE products_fts USING fts5(
+        search_key,
+        content='products', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )""",
+    """CREATE TRIGGER products_fts_insert AFTER INSERT ON products BEGIN
+        INSERT INTO products_fts(rowid, search_key) VALUES (new.id, new.search_key);
+    END""",
+    """CREATE TRIGGER products_fts_delete AFTER DELETE ON products BEGIN
+        INSERT INTO products_fts(products_fts, rowid, search_key)
+        VALUES ('delete', old.id, old.search_key);
+    END""",
+    """CREATE TRIGGER products_fts_update AFTER UPDATE OF search_key ON products BEGIN
+        INSERT INTO products_fts(products_fts, rowid, search_key)
+        VALUES ('delete', old.id, old.search_key);
+        INSERT INTO products_fts(rowid, search_key) VALUES (new.id, new.search_key);
+    END""",
+]
+
+POSTGRES_SEARCH_KEY_EXPRESSION = "to_tsvector('simple', coalesce(search_key, ''))"
+
+
+@migration(2, 'Full-text search index over product name and description')
+def _search_index(conn):
+    if conn.dialect.name == 'sqlite':
+        for statement in SQLITE_INDEX_DDL:
+            conn.execute(text(statement))
+        rebuild_index(conn)
+    elif conn.dialect.name == 'postgresql':
+        # A generated column keeps the vector in sync on every insert and update
+        if not has_column(conn, 'products', 'search_vector'):
+            conn.execute(text(
+                f"ALTER TABLE products ADD COLUMN search_vector tsvector "
+                f"GENERATED ALWAYS AS ({POSTGRES_VECTOR_EXPRESSION}) STORED"
+            ))
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_products_search_vector "
+            "ON products USING GIN (search_vector)"
+        ))
+
+
+@migration(3, 'Normalized search_key column backing the full-text index')
+def _search_key_index(conn):
+    if not has_column(conn, 'products', 'search_key'):
+        conn.execute(text("ALTER TABLE products ADD COLUMN search_key TEXT"))
+    backfill_search_keys(conn, only_missing=False)
+
+    if conn.dialect.name == 'sqlite':
+        for statement in SQLITE_SEARCH_KEY_DDL:
+            conn.execute(text(statement))
+        rebuild_index(conn)
+    elif conn.dialect.name == 'postgresql':
+        # Dropping the generated column also drops its GIN index
+        conn.execute(text("ALTER TABLE products DROP COLUMN IF EXISTS search_vector"))
+        conn.execute(text(
+            f"ALTER TABLE products ADD COLUMN search_vector tsvector "
+            f"GENERATED ALWAYS AS ({POSTGRES_SEARCH_KEY_EXPRESSION}) STORED"
+        ))
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_products_search_vector "
+            "ON products USING GIN (search_vector)"
+        ))
+
+
+def rebuild_index(conn):
+    """Repopulate the SQLite FTS table from products (no-op on PostgreSQL)"""
+    if conn.dialect.name == 'sqlite':
+        conn.execute(text("INSERT INTO products_fts(products_fts) VALUES ('rebuild')"))
+
+
+# ===== Queries =====
+
+def _sqlite_ranked_ids(terms, category_id, limit, offset):
+    # Every term must match; quoting keeps FTS5 operators out of user input
+    match = ' '.join(f'"{term}"*' for term in terms)
+    sql = (
+        "SELECT products.id FROM products_fts "
+        "JOIN products ON products.id = products_fts.rowid "
+        "WHERE products_fts MATCH :match AND products.status = 'approved' "
+        + ("AND products.category_id = :category_id " if category_id else "")
+        + "ORDER BY bm25(products_fts), products.id DESC LIMIT :limit OFFSET :offset"
+    )
+    params = {'match': match, 'category_id': category_id, 'limit': limit, 'offset': offset}
+    return [row[0] for row in db.session.execute(text(sql), params)]
+
+
+def _postgres_ranked_ids(terms, category_id, limit, offset):
+    tsquery = ' & '.join(f'{term}:*' for term in terms)
+    sql = (
+        "SELECT id FROM products, to_tsquery('simple', :tsquery) AS query "
+        "WHERE search_vector @@ query AND status = 'approved' "
+        + ("AND category_id = :category_id " if category_id else "")
+        + "ORDER BY ts_rank(search_vector, query) DESC, id DESC LIMIT :limit OFFSET :offset"
+    )
+    params = {'tsquery': tsquery, 'category_id': category_id, 'limit': limit, 'offset': offset}
+    return [row[0] for row in db.session.execute(text(sql), params)]
+
+
+def search_products(query_string, category_id=None, page=1, limit=24):
+    """
+    Ranked search over approved products
+    Returns (products, has_more); products keep the index ranking order
+    """
+    terms = search_terms(query_string)
+    if not terms:
+        return [], False
+
+    offset = (max(page, 1) - 1) * limit
+    if db.engine.dialect.name == 'postgresql':
+        ids = _postgres_ranked_ids(terms, category_id, limit + 1, offset)
+    else:
+        ids = _sqlite_ranked_ids(terms, category_id, limit + 1, offset)
+
+    has_more = len(ids) > limit
+    ids = ids[:limit]
+    if not ids:
+        return [], False
+
+    by_id = {p.id: p for p in queries.products_with_relations().filter(Product.id.in_(ids))}
+    return [by_id[pid] for pid in ids if pid in by_id], has_more
+
+
+# ===== CLI =====
+
+def init_app(app):
+    """Register the `search` command group on the Flask CLI"""
+
+    @app.cli.group('search')
+    def search_cli():
+        """Full-text search index commands"""
+
+    @search_cli.command('backfill')
+    @click.option('--all', 'recompute_all', is_flag=True, help='Recompute keys for every product')
+    @click.option('--batch-size', default=1000, show_default=True)
+    def backfill_command(recompute_all, batch_size):
+        """Fill Product.search_key for rows written outside the ORM"""
+        with db.engine.begin() as conn:
+            updated = backfill_search_keys(conn, only_missing=not recompute_all, batch_size=batch_size)
+        click.echo(f"Updated search keys for {updated} product(s)")
+
+    @search_cli.command('rebuild')
+    def rebuild_command():
+        """Rebuild the product search index from the products table"""
+        with db.engine.begin() as conn:
+            rebuild_index(conn)
+        click.echo('Search index rebuilt')
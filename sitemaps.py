@@ -0,0 +1,306 @@
+"""
+Sharded sitemap generation for Flohmarkt
+Streams product URLs into shard files on disk behind a sitemap index, and
+regenerates only the shards whose products changed in a background thread
+"""
+
+import fcntl
+import gzip
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from datetime import datetime
+from urllib.parse import quote
+from xml.sax.saxutils import escape
+
+import click
+from flask import request, send_from_directory
+
+from app import db
+from models import Category, Product
+
+logger = logging.getLogger(__name__)
+
+SHARD_SIZE = 50000
+SITEMAP_NS = 'http://www.sitemaps.org/schemas/sitemap/0.9'
+PAGES_SHARD = 'pages'
+
+
+def product_shard(product_id):
+    """Shards are fixed id ranges, so a product always lives in the same file"""
+    return product_id // SHARD_SIZE
+
+
+def _manifest_order(item):
+    key = item[0]
+    return (-1, 0) if key == PAGES_SHARD else (0, int(key))
+
+
+def _url_xml(loc, lastmod, changefreq, priority):
+    return (f"<url><loc>{escape(loc)}</loc><lastmod>{lastmod}</lastmod>"
+            f"<changefreq>{changefreq}</changefreq><priority>{priority}</priority></url>\n")
+
+
+class SitemapStore:
+    def __init__(self, app=None):
+        self.app = None
+        self.directory = None
+        self.base_url = None
+        self.interval = 60
+        self._thread = None
+        self._thread_pid = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.directory = os.environ.get('SITEMAP_DIR', os.path.join(app.instance_path, 'sitemaps'))
+        self.base_url = os.environ.get('SITE_URL', 'https://flowmarket.com').rstrip('/')
+        self.interval = int(os.environ.get('SITEMAP_REFRESH_INTERVAL', 60))
+        os.makedirs(os.path.join(self.directory, 'dirty'), exist_ok=True)
+
+        # Threads do not survive gunicorn's fork, so each worker starts its own lazily
+        app.before_request(self._ensure_worker)
+        self.register_commands(app)
+
+    # ===== Paths =====
+
+    def shard_filename(self, shard):
+        return f'sitemap-{shard}.xml' if shard == PAGES_SHARD else f'sitemap-products-{shard}.xml'
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    @property
+    def index_path(self):
+        return self._path('sitemap.xml')
+
+    @property
+    def manifest_path(self):
+        return self._path('manifest.json')
+
+    # ===== Generation =====
+
+    def _write_stream(self, name, chunks, precompress=True):
+        """
+        Write an iterable of text chunks to `name` atomically
+        A gzip copy is written alongside in the same pass, so shards are never
+        compressed again when served
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        gz_fd, gz_tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.gz.tmp') if precompress else (None, None)
+        try:
+            with ExitStack() as stack:
+                outputs = [stack.enter_context(os.fdopen(fd, 'wb'))]
+                if precompress:
+                    raw = stack.enter_context(os.fdopen(gz_fd, 'wb'))
+                    outputs.append(stack.enter_context(gzip.GzipFile(fileobj=raw, mode='wb', mtime=0)))
+                for chunk in chunks:
+                    data = chunk.encode('utf-8')
+                    for output in outputs:
+                        output.write(data)
+            if precompress:
+                os.replace(gz_tmp_path, self._path(name + '.gz'))
+            os.replace(tmp_path, self._path(name))
+        except BaseException:
+            for path in (tmp_path, gz_tmp_path):
+                if path and os.path.exists(path):
+                    os.remove(path)
+            raise
+
+    def _pages_xml(self, stats):
+        today = datetime.utcnow().date().isoformat()
+        yield f'<?xml version="1.0" encoding="UTF-8"?>\n<urlset xmlns="{SITEMAP_NS}">\n'
+        for path, priority in (('/', '1.0'), ('/products', '0.9'), ('/jobs', '0.8'), ('/cars', '0.8')):
+            yield _url_xml(self.base_url + path, today, 'daily', priority)
+            stats['urls'] += 1
+        for (name,) in db.session.query(Category.name).order_by(Category.id):
+            yield _url_xml(f"{self.base_url}/products?category={quote(name)}", today, 'weekly', '0.7')
+            stats['urls'] += 1
+        yield '</urlset>\n'
+        stats['lastmod'] = today
+
+    def _products_xml(self, shard, stats):
+        """Yield one product shard as XML, reading only (id, updated_at) in batches"""
+        rows = (
+            db.session.query(Product.id, Product.updated_at, Product.created_at)
+            .filter(Product.status == 'approved',
+                    Product.id >= shard * SHARD_SIZE,
+                    Product.id < (shard + 1) * SHARD_SIZE)
+            .order_by(Product.id)
+            .execution_options(yield_per=2000)
+        )
+        yield f'<?xml version="1.0" encoding="UTF-8"?>\n<urlset xmlns="{SITEMAP_NS}">\n'
+        latest = None
+        for product_id, updated_at, created_at in rows:
+            modified = updated_at or created_at or datetime.utcnow()
+            latest = modified if latest is None or modified > latest else latest
+            yield _url_xml(f"{self.base_url}/product/{product_id}",
+                           modified.date().isoformat(), 'weekly', '0.6')
+            stats['urls'] += 1
+        yield '</urlset>\n'
+        stats['lastmod'] = latest.date().isoformat() if latest else None
+
+    def _generate_shard(self, shard, manifest):
+        stats = {'urls': 0, 'lastmod': None}
+        name = self.shard_filename(shard)
+        chunks = self._pages_xml(stats) if shard == PAGES_SHARD else self._products_xml(shard, stats)
+        self._write_stream(name, chunks)
+
+        key = str(shard)
+        if stats['urls'] or shard == PAGES_SHARD:
+            manifest[key] = {'file': name, 'urls': stats['urls'], 'lastmod': stats['lastmod']}
+        else:
+            manifest.pop(key, None)
+            for path in (self._path(name), self._path(name + '.gz')):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def _write_index(self, manifest):
+        def chunks():
+            yield f'<?xml version="1.0" encoding="UTF-8"?>\n<sitemapindex xmlns="{SITEMAP_NS}">\n'
+            for _, entry in sorted(manifest.items(), key=_manifest_order):
+                yield f"<sitemap><loc>{escape(self.base_url + '/sitemaps/' + entry['file'])}</loc>"
+                if entry['lastmod']:
+                    yield f"<lastmod>{entry['lastmod']}</lastmod>"
+                yield "</sitemap>\n"
+            yield '</sitemapindex>\n'
+
+        self._write_stream('sitemap.xml', chunks())
+        self._write_stream('manifest.json', [json.dumps(manifest)], precompress=False)
+
+    def _load_manifest(self):
+        try:
+            with open(self.manifest_path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def rebuild_all(self):
+        """Regenerate every shard and the index"""
+        with self._lock() as acquired:
+            if not acquired:
+                return False
+            self._clear_dirty(self._dirty_markers())
+            max_id = db.session.query(db.func.max(Product.id)).scalar() or 0
+            manifest = {}
+            self._generate_shard(PAGES_SHARD, manifest)
+            for shard in range(product_shard(max_id) + 1):
+                self._generate_shard(shard, manifest)
+            self._write_index(manifest)
+            logger.info(f"Sitemap rebuilt: {len(manifest)} shard(s)")
+            return True
+
+    def refresh_dirty(self):
+        """Regenerate only shards marked dirty since the last run"""
+        with self._lock() as acquired:
+            if not acquired:
+                return 0
+            markers = self._dirty_markers()
+            if not markers:
+                return 0
+            # Clear first so changes made during regeneration mark the shard again
+            self._clear_dirty(markers)
+            manifest = self._load_manifest()
+            for marker in markers:
+                self._generate_shard(int(marker), manifest)
+            self._write_index(manifest)
+            return len(markers)
+
+    # ===== Change tracking =====
+
+    def mark_changed(self, *product_ids):
+        """Flag the shards holding these products for regeneration"""
+        if self.directory is None:
+            return
+        for shard in {product_shard(pid) for pid in product_ids if pid is not None}:
+            try:
+                with open(os.path.join(self.directory, 'dirty', str(shard)), 'a'):
+                    pass
+            except OSError as e:
+                logger.warning(f"Could not mark sitemap shard {shard} dirty: {e}")
+
+    def _dirty_markers(self):
+        with os.scandir(os.path.join(self.directory, 'dirty')) as entries:
+            return [entry.name for entry in entries if entry.name.isdigit()]
+
+    def _clear_dirty(self, markers):
+        for marker in markers:
+            try:
+                os.remove(os.path.join(self.directory, 'dirty', marker))
+            except OSError:
+                pass
+
+    @contextmanager
+    def _lock(self):
+        """Cross-process lock so only one worker regenerates at a time; yields False if busy"""
+        with open(os.path.join(self.directory, '.lock'), 'w') as handle:
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+
+    # ===== Serving and background refresh =====
+
+    def ensure_index(self):
+        """Build everything synchronously if no index exists yet (first deploy)"""
+        if not os.path.exists(self.index_path):
+            self.rebuild_all()
+        return os.path.exists(self.index_path)
+
+    def send(self, name):
+        """Serve a generated file, as its gzip copy when the client accepts gzip"""
+        encoded = request.accept_encodings['gzip'] > 0 and os.path.exists(self._path(name + '.gz'))
+        response = send_from_directory(self.directory, name + '.gz' if encoded else name, mimetype='application/xml')
+        if encoded:
+            response.headers['Content-Encoding'] = 'gzip'
+        response.vary.add('Accept-Encoding')
+        return response
+
+    def _ensure_worker(self):
+        if self.interval <= 0 or (self._thread is not None and self._thread_pid == os.getpid()):
+            return
+        self._thread_pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, name='sitemap-refresh', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                with self.app.app_context():
+                    if not os.path.exists(self.index_path):
+                        self.rebuild_all()
+                    else:
+                        self.refresh_dirty()
+                    db.session.remove()
+            except Exception as e:
+                logger.error(f"Sitemap refresh failed: {e}")
+
+
+    def register_commands(self, app):
+        """Register the `sitemap` command group on the Flask CLI"""
+        @app.cli.group('sitemap')
+        def sitemap_cli():
+            """Sitemap generation commands"""
+
+        @sitemap_cli.command('build')
+        def build_command():
+            """Regenerate every sitemap shard and the index"""
+            if self.rebuild_all():
+                click.echo(f"Sitemap written to {self.directory}")
+            else:
+                raise click.ClickException('Another process is regenerating the sitemap')
+
+
+# Global instance
+sitemap_store = SitemapStore()
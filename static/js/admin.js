@@ -4,11 +4,14 @@ class AdminPanel {
         this.currentSection = 'dashboard';
         this.products = [];
         this.categories = [];
+        this.productsCursor = null;
+        this.usersCursor = null;
         this.init();
     }
 
     init() {
         this.setupNavigation();
+        this.setupListControls();
         this.loadCategories();
         this.showSection('dashboard');
     }
@@ -26,6 +29,49 @@ class AdminPanel {
         });
     }
 
+    setupListControls() {
+        const bind = (formId, buttonId, load) => {
+            const form = document.getElementById(formId);
+            const button = document.getElementById(buttonId);
+            if (form) {
+                form.addEventListener('submit', (e) => {
+                    e.preventDefault();
+                    load(false);
+                });
+            }
+            if (button) {
+                button.addEventListener('click', () => load(true));
+            }
+        };
+        bind('products-filters', 'products-load-more', (append) => this.loadProducts(append));
+        bind('users-filters', 'users-load-more', (append) => this.loadUsers(append));
+
+        document.querySelectorAll('[data-bulk-action]').forEach(button => {
+            button.addEventListener('click', () => this.bulkModerate(button.dataset.bulkAction));
+        });
+        const selectAll = document.getElementById('products-select-all');
+        if (selectAll) {
+            selectAll.addEventListener('change', () => {
+                document.querySelectorAll('.product-select').forEach(checkbox => {
+                    checkbox.checked = selectAll.checked;
+                });
+            });
+        }
+    }
+
+    // Build the query string for a filtered list page from its filter form
+    listQuery(formId, cursor) {
+        const params = new URLSearchParams();
+        const form = document.getElementById(formId);
+        if (form) {
+            new FormData(form).forEach((value, key) => {
+                if (value) params.append(key, value);
+            });
+        }
+        if (cursor) params.set('cursor', cursor);
+        return params.toString();
+    }
+
     setActiveNavLink(activeLink) {
         document.querySelectorAll('.nav-link').forEach(link => {
             link.classList.remove('active');
@@ -60,22 +106,31 @@ class AdminPanel {
         }
     }
 
-    async loadProducts() {
+    async loadProducts(append = false) {
         const loading = document.getElementById('products-loading');
         const tableBody = document.getElementById('products-table-body');
+        const loadMore = document.getElementById('products-load-more');
 
         loading.style.display = 'block';
-        tableBody.innerHTML = '';
+        if (!append) {
+            tableBody.innerHTML = '';
+            this.products = [];
+            this.productsCursor = null;
+        }
 
         try {
-            const response = await fetch('/api/admin/products');
+            const query = this.listQuery('products-filters', append ? this.productsCursor : null);
+            const response = await fetch(`/api/admin/products?${query}`);
             if (!response.ok) throw new Error('فشل في تحميل المنتجات');
 
-            const products = await response.json();
-            this.products = products;
+            const page = await response.json();
+            this.products = this.products.concat(page.items);
+            this.productsCursor = page.next_cursor;
+            loadMore.classList.toggle('hidden', !page.next_cursor);
 
-            tableBody.innerHTML = products.map(product => `
+            tableBody.insertAdjacentHTML('beforeend', page.items.map(product => `
                 <tr>
+                    <td><input type="checkbox" class="product-select" value="${product.id}"></td>
                     <td>${product.id}</td>
                     <td>
                         ${product.image_url ? 
@@ -84,9 +139,9 @@ class AdminPanel {
                         }
                     </td>
                     <td>${product.name}</td>
-                    <td>${product.category_name}</td>
+                    <td>${product.category}</td>
                     <td>${this.formatPrice(product.price)} جنيه</td>
-                    <td>${product.seller_name}</td>
+                    <td>${product.seller}</td>
                     <td>
                         <span class="status-badge status-${product.status}">
                             ${product.status === 'approved' ? 'معتمد' : 
@@ -112,27 +167,36 @@ class AdminPanel {
                         </div>
                     </td>
                 </tr>
-            `).join('');
+            `).join(''));
 
         } catch (error) {
             this.showAlert('حدث خطأ في تحميل المنتجات: ' + error.message, 'error');
-            tableBody.innerHTML = '<tr><td colspan="7" style="text-align: center; color: var(--red);">فشل في تحميل البيانات</td></tr>';
+            if (!append) {
+                tableBody.innerHTML = '<tr><td colspan="9" style="text-align: center; color: var(--red);">فشل في تحميل البيانات</td></tr>';
+            }
         } finally {
             loading.style.display = 'none';
         }
     }
 
-    async loadUsers() {
+    async loadUsers(append = false) {
         const tableBody = document.getElementById('users-table-body');
-        tableBody.innerHTML = '<tr><td colspan="6" class="loading">جاري التحميل...</td></tr>';
+        const loadMore = document.getElementById('users-load-more');
+        if (!append) {
+            tableBody.innerHTML = '<tr><td colspan="6" class="loading">جاري التحميل...</td></tr>';
+            this.usersCursor = null;
+        }
 
         try {
-            const response = await fetch('/api/admin/users');
+            const query = this.listQuery('users-filters', append ? this.usersCursor : null);
+            const response = await fetch(`/api/admin/users?${query}`);
             if (!response.ok) throw new Error('فشل في تحميل المستخدمين');
 
-            const users = await response.json();
+            const page = await response.json();
+            this.usersCursor = page.next_cursor;
+            loadMore.classList.toggle('hidden', !page.next_cursor);
 
-            tableBody.innerHTML = users.map(user => `
+            const rows = page.items.map(user => `
                 <tr>
                     <td>${user.id}</td>
                     <td>${user.fullname}</td>
@@ -146,10 +210,17 @@ class AdminPanel {
                     <td>${this.formatDate(user.created_at)}</td>
                 </tr>
             `).join('');
+            if (append) {
+                tableBody.insertAdjacentHTML('beforeend', rows);
+            } else {
+                tableBody.innerHTML = rows;
+            }
 
         } catch (error) {
             this.showAlert('حدث خطأ في تحميل المستخدمين: ' + error.message, 'error');
-            tableBody.innerHTML = '<tr><td colspan="6" style="text-align: center; color: var(--red);">فشل في تحميل البيانات</td></tr>';
+            if (!append) {
+                tableBody.innerHTML = '<tr><td colspan="6" style="text-align: center; color: var(--red);">فشل في تحميل البيانات</td></tr>';
+            }
         }
     }
 
@@ -171,22 +242,14 @@ class AdminPanel {
         tableBody.innerHTML = '<tr><td colspan="4" class="loading">جاري التحميل...</td></tr>';
 
         try {
+            // Categories already carry their product counts
             await this.loadCategories();
-            
-            // Get product counts for each category
-            const response = await fetch('/api/admin/products');
-            const products = await response.json();
-            
-            const categoryCounts = {};
-            products.forEach(product => {
-                categoryCounts[product.category_name] = (categoryCounts[product.category_name] || 0) + 1;
-            });
 
             tableBody.innerHTML = this.categories.map(category => `
                 <tr>
                     <td>${category.id}</td>
                     <td>${category.name}</td>
-                    <td>${categoryCounts[category.name] || 0}</td>
+                    <td>${category.product_count || 0}</td>
                     <td>
                         <div class="action-buttons">
                             <button class="btn btn-sm btn-edit" onclick="adminPanel.editCategory(${category.id})">
@@ -207,9 +270,16 @@ class AdminPanel {
     }
 
     updateCategorySelect() {
+        const options = this.categories.map(cat => `<option value="${cat.id}">${cat.name}</option>`).join('');
         const select = document.getElementById('product-category');
-        select.innerHTML = '<option value="">اختر الفئة</option>' +
-            this.categories.map(cat => `<option value="${cat.id}">${cat.name}</option>`).join('');
+        select.innerHTML = '<option value="">اختر الفئة</option>' + options;
+
+        const filter = document.getElementById('filter-category');
+        if (filter) {
+            const selected = filter.value;
+            filter.innerHTML = '<option value="">كل الفئات</option>' + options;
+            filter.value = selected;
+        }
     }
 
     editProduct(productId) {
@@ -225,23 +295,68 @@ class AdminPanel {
         
         // Set category
         const categorySelect = document.getElementById('product-category');
-        const category = this.categories.find(c => c.name === product.category_name);
-        if (category) {
-            categorySelect.value = category.id;
+        if (product.category_id) {
+            categorySelect.value = product.category_id;
         }
 
         document.getElementById('product-modal').classList.add('show');
     }
 
+    // Approve, reject or delete products through the bulk moderation endpoint
+    async moderateProducts(action, ids) {
+        const response = await fetch('/api/admin/products/bulk', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify({ action: action, ids: ids })
+        });
+
+        const result = await response.json();
+        if (!response.ok) {
+            throw new Error(result.detail || result.error || 'حدث خطأ في الخادم');
+        }
+        return result;
+    }
+
+    selectedProductIds() {
+        return Array.from(document.querySelectorAll('.product-select:checked'))
+            .map(checkbox => parseInt(checkbox.value));
+    }
+
+    async bulkModerate(action) {
+        const ids = this.selectedProductIds();
+        if (ids.length === 0) {
+            this.showAlert('يرجى اختيار منتج واحد على الأقل', 'error');
+            return;
+        }
+        if (action === 'delete' && !confirm(`هل أنت متأكد من حذف ${ids.length} منتج؟`)) return;
+
+        try {
+            const result = await this.moderateProducts(action, ids);
+            const summary = result.summary;
+            const changed = (summary.approved || 0) + (summary.rejected || 0) + (summary.deleted || 0);
+            let message = `تم تحديث ${changed} من ${ids.length} منتج`;
+            if (summary.has_messages) {
+                message += ` - ${summary.has_messages} منتج لديه رسائل ولم يتم حذفه`;
+            }
+            this.showAlert(message, result.success ? 'success' : 'error');
+            this.loadProducts();
+
+        } catch (error) {
+            this.showAlert('حدث خطأ: ' + error.message, 'error');
+        }
+    }
+
     async deleteProduct(productId) {
         if (!confirm('هل أنت متأكد من حذف هذا المنتج؟')) return;
 
         try {
-            const response = await fetch(`/api/admin/products/${productId}`, {
-                method: 'DELETE'
-            });
-
-            if (!response.ok) throw new Error('فشل في حذف المنتج');
+            const result = await this.moderateProducts('delete', [productId]);
+            if (result.results[productId] === 'has_messages') {
+                throw new Error('لا يمكن حذف منتج لديه رسائل');
+            }
+            if (result.results[productId] !== 'deleted') throw new Error('فشل في حذف المنتج');
 
             this.showAlert('تم حذف المنتج بنجاح', 'success');
             this.loadProducts();
@@ -253,17 +368,10 @@ class AdminPanel {
 
     async approveProduct(productId) {
         try {
-            const response = await fetch(`/api/admin/products/${productId}/approve`, {
-                method: 'POST'
-            });
+            const result = await this.moderateProducts('approve', [productId]);
+            if (!result.success) throw new Error('فشل في الموافقة على المنتج');
 
-            if (!response.ok) {
-                const error = await response.json();
-                throw new Error(error.error || 'فشل في الموافقة على المنتج');
-            }
-
-            const result = await response.json();
-            this.showAlert(result.message || 'تم قبول المنتج بنجاح', 'success');
+            this.showAlert('تم قبول المنتج بنجاح', 'success');
             this.loadProducts();
 
         } catch (error) {
@@ -275,17 +383,10 @@ class AdminPanel {
         if (!confirm('هل أنت متأكد من رفض هذا المنتج؟')) return;
 
         try {
-            const response = await fetch(`/api/admin/products/${productId}/reject`, {
-                method: 'POST'
-            });
-
-            if (!response.ok) {
-                const error = await response.json();
-                throw new Error(error.error || 'فشل في رفض المنتج');
-            }
+            const result = await this.moderateProducts('reject', [productId]);
+            if (!result.success) throw new Error('فشل في رفض المنتج');
 
-            const result = await response.json();
-            this.showAlert(result.message || 'تم رفض المنتج', 'success');
+            this.showAlert('تم رفض المنتج', 'success');
             this.loadProducts();
 
         } catch (error) {
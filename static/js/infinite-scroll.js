@@ -0,0 +1,54 @@
+// Infinite scroll for product listings backed by /api/products cursors
+document.addEventListener('DOMContentLoaded', function() {
+    const loadMore = document.getElementById('load-more');
+    const productsContainer = document.getElementById('products-container');
+
+    if (!loadMore || !productsContainer || !('IntersectionObserver' in window)) {
+        return;
+    }
+
+    let loading = false;
+
+    function loadNextPage() {
+        const cursor = loadMore.dataset.cursor;
+        if (loading || !cursor) {
+            return;
+        }
+        loading = true;
+
+        const params = new URLSearchParams({ cursor: cursor });
+        if (loadMore.dataset.category) {
+            params.set('category', loadMore.dataset.category);
+        }
+
+        fetch(loadMore.dataset.api + '?' + params.toString())
+            .then(response => response.json())
+            .then(data => {
+                if (!data.success) {
+                    return;
+                }
+                data.products.forEach(product => {
+                    productsContainer.appendChild(buildProductCard(product));
+                });
+                if (data.next_cursor) {
+                    loadMore.dataset.cursor = data.next_cursor;
+                    const url = new URL(loadMore.href, window.location.origin);
+                    url.searchParams.set('cursor', data.next_cursor);
+                    loadMore.href = url.toString();
+                } else {
+                    observer.disconnect();
+                    loadMore.parentElement.remove();
+                }
+            })
+            .catch(error => console.error('Error loading products:', error))
+            .finally(() => { loading = false; });
+    }
+
+    const observer = new IntersectionObserver(entries => {
+        if (entries.some(entry => entry.isIntersecting)) {
+            loadNextPage();
+        }
+    }, { rootMargin: '400px' });
+
+    observer.observe(loadMore);
+});
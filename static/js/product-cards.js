@@ -0,0 +1,52 @@
+// Shared product card markup for listings rendered from the JSON APIs
+function buildProductCard(product) {
+    const wrapper = document.createElement('div');
+    wrapper.className = 'product-card-wrapper';
+
+    const card = document.createElement('a');
+    card.className = 'product-card';
+    card.href = product.url;
+
+    const image = document.createElement('img');
+    image.className = 'product-image';
+    image.src = product.thumbnail_url || product.image_url || '';
+    if (product.image_srcset) {
+        image.srcset = product.image_srcset;
+        image.sizes = '(max-width: 600px) 50vw, 320px';
+    }
+    image.alt = product.name;
+    image.loading = 'lazy';
+    card.appendChild(image);
+
+    const info = document.createElement('div');
+    info.className = 'product-info';
+
+    const category = document.createElement('span');
+    category.className = 'product-category';
+    category.textContent = product.category_name || 'فئة أخرى';
+    info.appendChild(category);
+
+    const title = document.createElement('h3');
+    title.className = 'product-title';
+    title.textContent = product.name;
+    info.appendChild(title);
+
+    const description = document.createElement('p');
+    description.className = 'product-description';
+    description.textContent = product.description || '';
+    info.appendChild(description);
+
+    const footer = document.createElement('div');
+    footer.className = 'product-footer';
+    const price = document.createElement('span');
+    price.className = 'product-price';
+    price.textContent = product.price > 0
+        ? Math.round(product.price).toLocaleString('en-US') + ' جنيه'
+        : 'راتب حسب الاتفاق';
+    footer.appendChild(price);
+    info.appendChild(footer);
+
+    card.appendChild(info);
+    wrapper.appendChild(card);
+    return wrapper;
+}
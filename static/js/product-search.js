@@ -2,40 +2,71 @@
 document.addEventListener('DOMContentLoaded', function() {
     const searchInput = document.getElementById('product-search');
     const productsContainer = document.getElementById('products-container');
-    const productCards = document.querySelectorAll('.product-card');
+    const searchApi = searchInput ? searchInput.dataset.api : null;
+    let searchTimer = null;
+    let searchRequest = 0;
     
-    // Live Search Functionality
-    if (searchInput && productCards.length > 0) {
-        searchInput.addEventListener('input', function() {
-            const searchTerm = this.value.toLowerCase().trim();
-            
-            productCards.forEach(card => {
-                const title = card.querySelector('.product-title')?.textContent.toLowerCase() || '';
-                const description = card.querySelector('.product-description')?.textContent.toLowerCase() || '';
-                const category = card.querySelector('.product-category')?.textContent.toLowerCase() || '';
-                
-                const matches = title.includes(searchTerm) || 
-                              description.includes(searchTerm) || 
-                              category.includes(searchTerm);
-                
-                if (matches || searchTerm === '') {
-                    card.style.display = 'flex';
-                    card.style.animation = 'fadeIn 0.3s ease';
-                } else {
-                    card.style.display = 'none';
-                }
-            });
+    // Live Search Functionality - ranked results come from /api/search
+    if (searchInput && productsContainer && searchApi) {
+        const resultsContainer = document.createElement('div');
+        resultsContainer.className = 'products-grid';
+        resultsContainer.id = 'search-results';
+        resultsContainer.style.display = 'none';
+        productsContainer.parentNode.insertBefore(resultsContainer, productsContainer.nextSibling);
+        
+        const loadMore = document.querySelector('.load-more');
+        
+        function setSearching(active) {
+            productsContainer.style.display = active ? 'none' : '';
+            resultsContainer.style.display = active ? '' : 'none';
+            if (loadMore) {
+                loadMore.style.display = active ? 'none' : '';
+            }
+        }
+        
+        function runSearch(searchTerm) {
+            const requestId = ++searchRequest;
+            const params = new URLSearchParams({ q: searchTerm });
+            if (searchInput.dataset.category) {
+                params.set('category', searchInput.dataset.category);
+            }
             
-            // Show/hide empty state
-            const visibleCards = Array.from(productCards).filter(card => 
-                card.style.display !== 'none'
-            );
+            fetch(searchApi + '?' + params.toString())
+                .then(response => response.json())
+                .then(data => {
+                    // Ignore responses that arrive after a newer keystroke
+                    if (requestId !== searchRequest || !data.success) {
+                        return;
+                    }
+                    resultsContainer.innerHTML = '';
+                    data.products.forEach(product => {
+                        const card = buildProductCard(product);
+                        card.style.animation = 'fadeIn 0.3s ease';
+                        resultsContainer.appendChild(card);
+                    });
+                    setSearching(true);
+                    
+                    if (data.products.length === 0) {
+                        showEmptySearchState(searchTerm);
+                    } else {
+                        hideEmptySearchState();
+                    }
+                })
+                .catch(error => console.error('Search error:', error));
+        }
+        
+        searchInput.addEventListener('input', function() {
+            const searchTerm = this.value.trim();
+            clearTimeout(searchTimer);
             
-            if (visibleCards.length === 0 && searchTerm !== '') {
-                showEmptySearchState(searchTerm);
-            } else {
+            if (searchTerm === '') {
+                searchRequest++;
                 hideEmptySearchState();
+                setSearching(false);
+                return;
             }
+            
+            searchTimer = setTimeout(() => runSearch(searchTerm), 250);
         });
     }
     
@@ -93,11 +124,12 @@ document.addEventListener('DOMContentLoaded', function() {
             emptyState.innerHTML = `
                 <i class="fas fa-search" style="font-size: 64px; color: var(--muted); margin-bottom: 16px;"></i>
                 <h3>لم يتم العثور على نتائج</h3>
-                <p>لم نجد منتجات تطابق البحث عن "${searchTerm}"</p>
+                <p></p>
                 <button onclick="clearSearch()" class="btn btn-primary">مسح البحث</button>
             `;
-            productsContainer.appendChild(emptyState);
+            document.getElementById('search-results').appendChild(emptyState);
         }
+        emptyState.querySelector('p').textContent = `لم نجد منتجات تطابق البحث عن "${searchTerm}"`;
     }
     
     function hideEmptySearchState() {
@@ -0,0 +1,136 @@
+"""
+Admin dashboard statistics for Flohmarkt
+Counts are computed in one aggregate statement and kept in a single-row
+snapshot table; dashboards read the snapshot and never wait for a recount
+"""
+
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+
+import click
+from sqlalchemy import case, func, select, true
+from sqlalchemy.exc import IntegrityError
+
+import counters
+from app import db
+from models import AdminStatsSnapshot, Message, Product, User
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_ID = 1
+NEW_PRODUCTS_WINDOW = timedelta(days=7)
+STAT_FIELDS = (
+    'total_users', 'admin_users', 'total_products', 'pending_products',
+    'approved_products', 'new_products', 'total_messages', 'unread_messages'
+)
+
+
+def _count_if(condition):
+    return func.coalesce(func.sum(case((condition, 1), else_=0)), 0)
+
+
+def compute_stats():
+    """Every dashboard counter from one statement over three single-row aggregates"""
+    since = datetime.utcnow() - NEW_PRODUCTS_WINDOW
+    users = select(
+        func.count(User.id).label('total_users'),
+        _count_if(User.role == 'admin').label('admin_users')
+    ).subquery()
+    products = select(
+        func.count(Product.id).label('total_products'),
+        _count_if(Product.status == 'pending').label('pending_products'),
+        _count_if(Product.status == 'approved').label('approved_products'),
+        _count_if(Product.created_at >= since).label('new_products')
+    ).subquery()
+    messages = select(
+        func.count(Message.id).label('total_messages'),
+        _count_if(Message.is_read == False).label('unread_messages')  # noqa: E712
+    ).subquery()
+    joined = users.join(products, true()).join(messages, true())
+    row = db.session.execute(select(users, products, messages).select_from(joined)).mappings().one()
+    return {field: int(row[field]) for field in STAT_FIELDS}
+
+
+class AdminStats:
+    def __init__(self, app=None):
+        self.app = None
+        self.max_age = timedelta(seconds=300)
+        self._refreshing = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """ADMIN_STATS_MAX_AGE=0 leaves every refresh to `flask stats refresh`"""
+        self.app = app
+        self.max_age = timedelta(seconds=int(os.environ.get('ADMIN_STATS_MAX_AGE', 300)))
+        self.register_commands(app)
+
+    def refresh(self):
+        """Recompute the counters and store them in the snapshot row"""
+        values = compute_stats()
+        snapshot = db.session.get(AdminStatsSnapshot, SNAPSHOT_ID)
+        if snapshot is None:
+            snapshot = AdminStatsSnapshot(id=SNAPSHOT_ID)
+            db.session.add(snapshot)
+        for field, value in values.items():
+            setattr(snapshot, field, value)
+        snapshot.refreshed_at = datetime.utcnow()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Another worker created the row first; its snapshot is just as fresh
+            db.session.rollback()
+        return values
+
+    def _refresh_in_background(self):
+        # One recount per worker at a time; dashboards keep the old snapshot meanwhile
+        if not self._refreshing.acquire(blocking=False):
+            return
+
+        def run():
+            try:
+                with self.app.app_context():
+                    self.refresh()
+            except Exception as e:
+                logger.error(f"Admin stats refresh failed: {e}")
+            finally:
+                self._refreshing.release()
+
+        threading.Thread(target=run, name='admin-stats-refresh', daemon=True).start()
+
+    def get(self):
+        """
+        Dashboard counters from the snapshot row, a single primary-key read
+        Only a missing snapshot is computed inline; an old one is served as is
+        while a background refresh replaces it
+        """
+        snapshot = db.session.get(AdminStatsSnapshot, SNAPSHOT_ID)
+        if snapshot is None or snapshot.refreshed_at is None:
+            values = self.refresh()
+        else:
+            values = {field: getattr(snapshot, field) for field in STAT_FIELDS}
+            if self.max_age and snapshot.refreshed_at < datetime.utcnow() - self.max_age:
+                self._refresh_in_background()
+        # The unread counter is maintained on every write, so it is always current
+        values['unread_messages'] = counters.unread_count(counters.GLOBAL_OWNER_ID)
+        return values
+
+    def register_commands(self, app):
+        """Register the `stats` command group on the Flask CLI"""
+
+        @app.cli.group('stats')
+        def stats_cli():
+            """Admin dashboard statistics commands"""
+
+        @stats_cli.command('refresh')
+        def refresh_command():
+            """Recompute the dashboard snapshot (run periodically from cron)"""
+            values = self.refresh()
+            for field in STAT_FIELDS:
+                click.echo(f"{field:<18} {values[field]}")
+
+
+# Global instance
+admin_stats = AdminStats()
@@ -0,0 +1,223 @@
+"""
+Blob storage drivers for Flohmarkt uploads
+A local directory served by Flask's static handler, or an S3-compatible bucket
+served by redirecting clients to public or presigned object URLs
+"""
+
+import glob
+import logging
+import mimetypes
+import os
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+UPLOADS_PREFIX = '/static/uploads/'
+VARIANT_DIR = 'variants'
+# Half-written files; dot-prefixed paths under the uploads folder are never served
+TEMP_DIR = '.tmp'
+
+
+class LocalStorage:
+    """Files under the uploads folder of this node"""
+
+    def __init__(self, root):
+        self.root = os.path.realpath(root)
+        # Same filesystem as the destination so the final rename is atomic
+        self.temp_dir = os.path.join(self.root, TEMP_DIR)
+        os.makedirs(self.temp_dir, exist_ok=True)
+
+    def _path(self, key):
+        """Absolute path of `key`, refusing anything that resolves outside the uploads folder"""
+        path = os.path.realpath(os.path.join(self.root, key))
+        if path == self.root or os.path.commonpath([self.root, path]) != self.root:
+            raise ValueError(f"Upload key escapes the storage root: {key!r}")
+        return path
+
+    def put_file(self, key, local_path, cache_control=None):
+        """Move a finished local file to `key`"""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(local_path, path)
+
+    def rename(self, source_key, key, cache_control=None):
+        self.put_file(key, self._path(source_key))
+
+    def exists(self, key):
+        return os.path.exists(self._path(key))
+
+    def touch(self, key):
+        os.utime(self._path(key))
+
+    def stat(self, key):
+        """(size, mtime) or None when missing"""
+        try:
+            info = os.stat(self._path(key))
+        except FileNotFoundError:
+            return None
+        return info.st_size, info.st_mtime
+
+    def open(self, key):
+        return open(self._path(key), 'rb')
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def delete_prefix(self, prefix):
+        removed = 0
+        for path in glob.glob(glob.escape(self._path(prefix)) + '*'):
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError as e:
+                logger.warning(f"Failed to delete upload {path}: {e}")
+        return removed
+
+    def iter_files(self):
+        """Yield (key, size, mtime) for every file, one directory iterator at a time"""
+        stack = ['']
+        while stack:
+            relative_dir = stack.pop()
+            with os.scandir(os.path.join(self.root, relative_dir)) as entries:
+                for entry in entries:
+                    key = f"{relative_dir}/{entry.name}" if relative_dir else entry.name
+                    if key == TEMP_DIR:
+                        continue
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(key)
+                    elif entry.is_file(follow_symlinks=False):
+                        info = entry.stat(follow_symlinks=False)
+                        yield key, info.st_size, info.st_mtime
+
+    def url(self, key):
+        """None: Flask's static handler serves local files"""
+        return None
+
+
+class S3Storage:
+    """Objects in an S3-compatible bucket (AWS, MinIO, Ceph...), shared by every node"""
+
+    MULTIPART_CHUNK_SIZE = 8 * 1024 * 1024
+
+    def __init__(self, bucket, prefix='uploads/', endpoint_url=None, region=None,
+                 public_url=None, url_expires=3600):
+        import boto3
+        from boto3.s3.transfer import TransferConfig
+
+        self.client = boto3.client('s3', endpoint_url=endpoint_url, region_name=region)
+        self.bucket = bucket
+        self.prefix = prefix
+        self.public_url = public_url.rstrip('/') if public_url else None
+        self.url_expires = url_expires
+        self.transfer_config = TransferConfig(multipart_threshold=self.MULTIPART_CHUNK_SIZE,
+                                              multipart_chunksize=self.MULTIPART_CHUNK_SIZE)
+        self.temp_dir = tempfile.gettempdir()
+
+    def _extra_args(self, key, cache_control):
+        extra = {'ContentType': mimetypes.guess_type(key)[0] or 'application/octet-stream'}
+        if cache_control:
+            extra['CacheControl'] = cache_control
+        return extra
+
+    def put_file(self, key, local_path, cache_control=None):
+        """Upload a finished local file in multipart chunks, then remove the local copy"""
+        self.client.upload_file(local_path, self.bucket, self.prefix + key,
+                                ExtraArgs=self._extra_args(key, cache_control), Config=self.transfer_config)
+        os.remove(local_path)
+
+    def rename(self, source_key, key, cache_control=None):
+        self.client.copy_object(Bucket=self.bucket, Key=self.prefix + key, MetadataDirective='REPLACE',
+                                CopySource={'Bucket': self.bucket, 'Key': self.prefix + source_key},
+                                **self._extra_args(key, cache_control))
+        self.delete(source_key)
+
+    def _head(self, key):
+        from botocore.exceptions import ClientError
+
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self.prefix + key)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+
+    def exists(self, key):
+        return self._head(key) is not None
+
+    def touch(self, key):
+        # Copying an object onto itself refreshes LastModified, which the collector's grace period reads
+        head = self._head(key)
+        if head is None:
+            return
+        self.client.copy_object(Bucket=self.bucket, Key=self.prefix + key, MetadataDirective='REPLACE',
+                                CopySource={'Bucket': self.bucket, 'Key': self.prefix + key},
+                                ContentType=head.get('ContentType', 'application/octet-stream'),
+                                **({'CacheControl': head['CacheControl']} if head.get('CacheControl') else {}))
+
+    def stat(self, key):
+        head = self._head(key)
+        if head is None:
+            return None
+        return head['ContentLength'], head['LastModified'].timestamp()
+
+    def open(self, key):
+        """Streaming, non-seekable body"""
+        return self.client.get_object(Bucket=self.bucket, Key=self.prefix + key)['Body']
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self.prefix + key)
+        return True
+
+    def delete_prefix(self, prefix):
+        removed = 0
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix + prefix):
+            keys = [{'Key': item['Key']} for item in page.get('Contents', [])]
+            if keys:
+                self.client.delete_objects(Bucket=self.bucket, Delete={'Objects': keys, 'Quiet': True})
+                removed += len(keys)
+        return removed
+
+    def iter_files(self):
+        """Yield (key, size, mtime) page by page from the bucket listing"""
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for item in page.get('Contents', []):
+                yield item['Key'][len(self.prefix):], item['Size'], item['LastModified'].timestamp()
+
+    def url(self, key):
+        """Public object URL when the bucket is public, else a presigned GET"""
+        if self.public_url:
+            return f"{self.public_url}/{self.prefix}{key}"
+        return self.client.generate_presigned_url(
+            'get_object', Params={'Bucket': self.bucket, 'Key': self.prefix + key}, ExpiresIn=self.url_expires
+        )
+
+
+def default_storage_name():
+    """UPLOAD_STORAGE, falling back to local when the S3 client is not installed"""
+    name = os.environ.get('UPLOAD_STORAGE', 'local')
+    if name == 's3':
+        try:
+            import boto3  # noqa: F401
+        except ImportError:
+            logger.warning("UPLOAD_STORAGE=s3 but boto3 is not installed - using local storage")
+            name = 'local'
+    return name
+
+
+def create_storage(name, upload_folder):
+    if name == 's3':
+        return S3Storage(
+            os.environ['S3_BUCKET'],
+            prefix=os.environ.get('S3_PREFIX', 'uploads/'),
+            endpoint_url=os.environ.get('S3_ENDPOINT_URL'),
+            region=os.environ.get('S3_REGION'),
+            public_url=os.environ.get('S3_PUBLIC_URL'),
+            url_expires=int(os.environ.get('S3_URL_EXPIRES', 3600)),
+        )
+    return LocalStorage(upload_folder)
@@ -0,0 +1,300 @@
+"""
+Orphaned upload garbage collection for Flohmarkt
+Keeps an on-disk manifest of every file products reference, updated from the rows
+changed since the last run, diffs the upload storage listing against it as a stream
+and reclaims orphans in rate-limited batches
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import time
+from datetime import datetime, timedelta
+
+import click
+from sqlalchemy import or_, select
+
+from app import db
+from models import Product, UploadBlob
+from storage import UPLOADS_PREFIX, VARIANT_DIR
+from uploads import parse_content_url, upload_store
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_BATCH_SIZE = 1000
+LOOKUP_BATCH_SIZE = 500
+# Rows committed shortly after their updated_at was stamped are picked up by the next run
+WATERMARK_OVERLAP = timedelta(minutes=5)
+MANIFEST_SCHEMA = (
+    "CREATE TABLE referenced (path TEXT, product_id INTEGER, PRIMARY KEY (path, product_id)) WITHOUT ROWID",
+    "CREATE INDEX ix_referenced_product ON referenced (product_id)",
+    "CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT) WITHOUT ROWID",
+)
+
+
+def _product_paths(image_url, variants):
+    """Upload-relative paths of a product's original and variants"""
+    if not image_url or not image_url.startswith(UPLOADS_PREFIX):
+        return
+    yield image_url[len(UPLOADS_PREFIX):]
+    try:
+        urls = [variant['url'] for variant in json.loads(variants).values()] if variants else []
+    except (ValueError, AttributeError, KeyError, TypeError):
+        urls = []
+    for url in urls:
+        if url.startswith(UPLOADS_PREFIX):
+            yield url[len(UPLOADS_PREFIX):]
+
+
+def _variant_stem(path):
+    """Name of the original a variant was generated from, e.g. variants/<stem>-320.webp"""
+    if not path.startswith(VARIANT_DIR + '/'):
+        return None
+    return os.path.basename(path).rsplit('-', 1)[0]
+
+
+class UploadCollector:
+    def __init__(self, app=None):
+        self.manifest_path = None
+        self.grace = 3600
+        self.batch_size = 100
+        self.pause = 1.0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.manifest_path = os.environ.get(
+            'UPLOAD_MANIFEST', os.path.join(app.instance_path, 'upload_manifest.sqlite3')
+        )
+        # Files younger than this may belong to a request that has not committed yet
+        self.grace = int(os.environ.get('UPLOAD_GC_GRACE', 3600))
+        self.batch_size = int(os.environ.get('UPLOAD_GC_BATCH_SIZE', 100))
+        self.pause = float(os.environ.get('UPLOAD_GC_PAUSE', 1.0))
+        self.register_commands(app)
+
+    # ===== Manifest =====
+
+    def _insert_rows(self, conn, rows):
+        batch = []
+        for product_id, image_url, variants in rows:
+            batch.extend((path, product_id) for path in _product_paths(image_url, variants))
+            if len(batch) >= MANIFEST_BATCH_SIZE:
+                conn.executemany("INSERT OR IGNORE INTO referenced VALUES (?, ?)", batch)
+                batch = []
+        conn.executemany("INSERT OR IGNORE INTO referenced VALUES (?, ?)", batch)
+
+    def _product_rows(self, since=None):
+        stmt = select(Product.id, Product.image_url, Product.image_variants)
+        if since is None:
+            stmt = stmt.where(Product.image_url.like(UPLOADS_PREFIX + '%'))
+        else:
+            # Changed rows whose image moved away from uploads must still clear their old paths
+            stmt = stmt.where(Product.updated_at >= since)
+        return db.session.execute(stmt.execution_options(yield_per=MANIFEST_BATCH_SIZE))
+
+    def _watermark(self):
+        """Start of the last manifest update, or None when there is no usable manifest"""
+        if not os.path.exists(self.manifest_path):
+            return None
+        conn = sqlite3.connect(self.manifest_path)
+        try:
+            row = conn.execute("SELECT value FROM meta WHERE key = 'watermark'").fetchone()
+        except sqlite3.Error:
+            # Written by an older release without product ids
+            return None
+        finally:
+            conn.close()
+        return datetime.fromisoformat(row[0]) if row else None
+
+    def _rebuild_manifest(self, started):
+        """Write the whole referenced-path index to a new file and swap it in atomically"""
+        os.makedirs(os.path.dirname(self.manifest_path) or '.', exist_ok=True)
+        tmp_path = self.manifest_path + '.tmp'
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        conn = sqlite3.connect(tmp_path)
+        try:
+            for statement in MANIFEST_SCHEMA:
+                conn.execute(statement)
+            self._insert_rows(conn, self._product_rows())
+            conn.execute("INSERT INTO meta VALUES ('watermark', ?)", (started.isoformat(),))
+            conn.commit()
+        finally:
+            conn.close()
+        os.replace(tmp_path, self.manifest_path)
+
+    def _remove_deleted_products(self, conn):
+        """Drop manifest rows of products that no longer exist, checking ids in batches"""
+        removed = 0
+        last_id = -1
+        while True:
+            ids = [row[0] for row in conn.execute(
+                "SELECT DISTINCT product_id FROM referenced WHERE product_id > ? ORDER BY product_id LIMIT ?",
+                (last_id, LOOKUP_BATCH_SIZE)
+            )]
+            if not ids:
+                return removed
+            last_id = ids[-1]
+            existing = {pid for (pid,) in db.session.query(Product.id).filter(Product.id.in_(ids))}
+            gone = [(pid,) for pid in ids if pid not in existing]
+            conn.executemany("DELETE FROM referenced WHERE product_id = ?", gone)
+            removed += len(gone)
+
+    def _replace_products(self, conn, rows, stats):
+        conn.executemany("DELETE FROM referenced WHERE product_id = ?", [(row[0],) for row in rows])
+        self._insert_rows(conn, rows)
+        stats['changed_products'] += len(rows)
+
+    def _update_manifest(self, watermark, started, stats):
+        """Replace the rows of products changed since `watermark` and drop deleted products"""
+        conn = sqlite3.connect(self.manifest_path)
+        try:
+            changed = []
+            for row in self._product_rows(since=watermark - WATERMARK_OVERLAP):
+                changed.append(row)
+                if len(changed) >= MANIFEST_BATCH_SIZE:
+                    self._replace_products(conn, changed, stats)
+                    changed = []
+            self._replace_products(conn, changed, stats)
+            stats['deleted_products'] = self._remove_deleted_products(conn)
+            conn.execute("UPDATE meta SET value = ? WHERE key = 'watermark'", (started.isoformat(),))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def build_manifest(self, stats, full=False):
+        """
+        Bring the referenced-path index up to date; returns the number of referenced paths
+        Only products updated since the previous run are re-read, unless `full` or the
+        manifest is missing, in which case it is rebuilt from every product
+        """
+        started = datetime.utcnow()
+        watermark = None if full else self._watermark()
+        if watermark is None:
+            stats['manifest'] = 'full'
+            self._rebuild_manifest(started)
+        else:
+            stats['manifest'] = 'incremental'
+            self._update_manifest(watermark, started, stats)
+        conn = sqlite3.connect(self.manifest_path)
+        try:
+            return conn.execute("SELECT COUNT(DISTINCT path) FROM referenced").fetchone()[0]
+        finally:
+            conn.close()
+
+    # ===== Diff =====
+
+    def _unreferenced(self, manifest, candidates):
+        placeholders = ','.join('?' * len(candidates))
+        known = {row[0] for row in manifest.execute(
+            f"SELECT path FROM referenced WHERE path IN ({placeholders})", [path for path, _ in candidates]
+        )}
+        return [(path, size) for path, size in candidates if path not in known]
+
+    def find_orphans(self, stats):
+        """Yield (relative path, size) for files older than the grace period missing from the manifest"""
+        cutoff = time.time() - self.grace
+        manifest = sqlite3.connect(self.manifest_path)
+        try:
+            candidates = []
+            # Local directories are scanned one iterator at a time, buckets one listing page at a time
+            for relative, size, mtime in upload_store.storage.iter_files():
+                stats['scanned'] += 1
+                if mtime >= cutoff:
+                    continue
+                candidates.append((relative, size))
+                if len(candidates) >= LOOKUP_BATCH_SIZE:
+                    yield from self._unreferenced(manifest, candidates)
+                    candidates = []
+            if candidates:
+                yield from self._unreferenced(manifest, candidates)
+        finally:
+            manifest.close()
+
+    # ===== Reclaim =====
+
+    def _still_referenced(self, paths):
+        """
+        Paths a product references now, read from the database rather than the manifest
+        A variant counts as referenced while its original is, even before the product's
+        image_variants lists it
+        """
+        variants = [path for path in paths if _variant_stem(path)]
+        conditions = [Product.image_url.in_([UPLOADS_PREFIX + path for path in paths])]
+        conditions.extend(Product.image_variants.contains(UPLOADS_PREFIX + path) for path in variants)
+        conditions.extend(Product.image_url.like(f'{UPLOADS_PREFIX}%{stem}.%')
+                          for stem in {_variant_stem(path) for path in variants})
+        used = set()
+        for image_url, variants in db.session.query(Product.image_url, Product.image_variants).filter(or_(*conditions)):
+            used.update(_product_paths(image_url, variants))
+            if image_url and image_url.startswith(UPLOADS_PREFIX):
+                stem = os.path.splitext(os.path.basename(image_url))[0]
+                used.update(path for path in paths if _variant_stem(path) == stem)
+        return used
+
+    def _reclaim(self, batch, stats):
+        """Delete one batch, re-checking each file against the database and its mtime first"""
+        still_used = self._still_referenced([path for path, _ in batch])
+        cutoff = time.time() - self.grace
+        digests = []
+        storage = upload_store.storage
+        for path, size in batch:
+            try:
+                # A dedup hit refreshes the mtime, so a file reused since the scan is kept
+                stat = storage.stat(path)
+                if path in still_used or stat is None or stat[1] >= cutoff:
+                    continue
+                storage.delete(path)
+            except Exception as e:
+                logger.warning(f"Upload GC failed to delete {path}: {e}")
+                continue
+            stats['removed'] += 1
+            stats['bytes'] += size
+            parsed = parse_content_url(UPLOADS_PREFIX + path)
+            if parsed:
+                digests.append(parsed[0])
+        if digests:
+            UploadBlob.query.filter(UploadBlob.digest.in_(digests)).delete(synchronize_session=False)
+            db.session.commit()
+
+    def collect(self, dry_run=False, limit=None, full=False):
+        """Update the manifest and remove up to `limit` orphaned files; returns counters"""
+        stats = {'changed_products': 0, 'deleted_products': 0, 'scanned': 0, 'orphans': 0, 'removed': 0, 'bytes': 0}
+        stats['referenced'] = self.build_manifest(stats, full=full)
+        batch = []
+        for orphan in self.find_orphans(stats):
+            if limit is not None and stats['orphans'] >= limit:
+                break
+            stats['orphans'] += 1
+            if dry_run:
+                logger.info(f"Upload GC would remove {orphan[0]}")
+                continue
+            batch.append(orphan)
+            if len(batch) >= self.batch_size:
+                self._reclaim(batch, stats)
+                batch = []
+                time.sleep(self.pause)
+        if batch:
+            self._reclaim(batch, stats)
+        logger.info(f"Upload GC: {stats}")
+        return stats
+
+    def register_commands(self, app):
+        """Register `gc` in the `uploads` command group"""
+
+        @upload_store.cli.command('gc')
+        @click.option('--dry-run', is_flag=True, help='List orphans without deleting them')
+        @click.option('--limit', type=int, help='Stop after this many orphans')
+        @click.option('--full', is_flag=True, help='Rebuild the manifest from every product')
+        def gc_command(dry_run, limit, full):
+            """Delete uploaded files no product references (run periodically from cron)"""
+            stats = self.collect(dry_run=dry_run, limit=limit, full=full)
+            verb = 'Found' if dry_run else 'Removed'
+            count = stats['orphans'] if dry_run else stats['removed']
+            click.echo(f"Scanned {stats['scanned']} file(s) against {stats['referenced']} referenced; "
+                       f"{verb} {count} orphan(s)" + ('' if dry_run else f", {stats['bytes']} bytes freed"))
+
+
+# Global instance
+upload_collector = UploadCollector()
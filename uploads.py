@@ -0,0 +1,368 @@
+"""
+Content-addressed upload storage for Flohmarkt
+Hashes uploads while streaming them to the storage driver, stores each distinct
+file once under its SHA-256 digest and reference-counts it from products
+"""
+
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+import click
+from flask import abort, redirect, request
+from sqlalchemy import func, select
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from migrations import migration
+from models import Product, UploadBlob
+from storage import UPLOADS_PREFIX, VARIANT_DIR, LocalStorage, create_storage, default_storage_name
+
+logger = logging.getLogger(__name__)
+
+HASH_CHUNK_SIZE = 64 * 1024
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+CONTENT_URL_RE = re.compile(r'^/static/uploads/[0-9a-f]{2}/([0-9a-f]{64})\.([a-z0-9]+)$')
+# Files saved before content addressing: a timestamp prefix and a secure_filename() name
+LEGACY_URL_RE = re.compile(r'^/static/uploads/\d{8}_\d{6}_[A-Za-z0-9_.-]+$')
+# Originals and their variants are named by digest, so their contents never change
+IMMUTABLE_PATH_RE = re.compile(r'^/static/uploads/(?:[0-9a-f]{2}|variants)/[0-9a-f]{64}[-.]')
+IMMUTABLE_CACHE_CONTROL = f'public, max-age={IMMUTABLE_MAX_AGE}, immutable'
+
+
+def parse_content_url(url):
+    """(digest, extension) for a content-addressed upload URL, else None"""
+    match = CONTENT_URL_RE.match(url or '')
+    return match.groups() if match else None
+
+
+def is_legacy_url(url):
+    """Whether `url` names a single timestamp-named file directly in the uploads folder"""
+    return bool(LEGACY_URL_RE.match(url or '')) and '..' not in url
+
+
+def content_url(digest, extension):
+    return f"{UPLOADS_PREFIX}{digest[:2]}/{digest}.{extension}"
+
+
+def _extension(filename):
+    extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else 'bin'
+    return 'jpg' if extension == 'jpeg' else extension
+
+
+def _key(url):
+    return url[len(UPLOADS_PREFIX):]
+
+
+class UploadStore:
+    def __init__(self, app=None):
+        self.app = None
+        self.upload_folder = None
+        self.storage = None
+        self.cli = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Select the storage driver from UPLOAD_STORAGE (local or s3)"""
+        self.app = app
+        self.upload_folder = app.config['UPLOAD_FOLDER']
+        self.storage = create_storage(default_storage_name(), self.upload_folder)
+        logger.info(f"Upload storage: {type(self.storage).__name__}")
+        app.before_request(self._redirect_to_storage)
+        app.after_request(self._cache_headers)
+        self.register_commands(app)
+
+    def put(self, key, local_path):
+        """Hand a finished temporary file to the driver under `key`"""
+        immutable = IMMUTABLE_PATH_RE.match(UPLOADS_PREFIX + key)
+        self.storage.put_file(key, local_path, IMMUTABLE_CACHE_CONTROL if immutable else None)
+
+    # ===== Writing =====
+
+    def save(self, file):
+        """
+        Stream an uploaded FileStorage to storage and return its content URL
+        The file is hashed chunk by chunk while written to a temporary name; when
+        the digest is already stored the temporary copy is dropped instead
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=self.storage.temp_dir, prefix='.upload-')
+        hasher = hashlib.sha256()
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                while True:
+                    chunk = file.stream.read(HASH_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    hasher.update(chunk)
+                    out.write(chunk)
+            url = content_url(hasher.hexdigest(), _extension(file.filename or ''))
+            if self.storage.exists(_key(url)):
+                os.remove(tmp_path)
+                # Fresh mtime keeps the garbage collector's grace period away from reused files
+                self.storage.touch(_key(url))
+            else:
+                self.put(_key(url), tmp_path)
+            return url
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    # ===== Reference counting =====
+
+    def _adjust(self, url, delta):
+        digest, extension = parse_content_url(url)
+        updated = UploadBlob.query.filter_by(digest=digest).update(
+            {'ref_count': UploadBlob.ref_count + delta}, synchronize_session=False
+        )
+        if updated or delta < 0:
+            return
+        # First reference to this file; another request may create the row first
+        stat = self.storage.stat(_key(url))
+        size = stat[0] if stat else 0
+        try:
+            with db.session.begin_nested():
+                db.session.add(UploadBlob(digest=digest, extension=extension, size=size, ref_count=delta))
+        except IntegrityError:
+            UploadBlob.query.filter_by(digest=digest).update(
+                {'ref_count': UploadBlob.ref_count + delta}, synchronize_session=False
+            )
+
+    def retain(self, *urls):
+        """Count new product references to uploads; the caller commits"""
+        for url, count in Counter(url for url in urls if parse_content_url(url)).items():
+            self._adjust(url, count)
+
+    def release(self, *urls):
+        """Drop product references to uploads; the caller commits, then calls remove_unreferenced"""
+        for url, count in Counter(url for url in urls if parse_content_url(url)).items():
+            self._adjust(url, -count)
+
+    def remove_unreferenced(self, urls):
+        """
+        After a commit, delete stored files nothing points at any more
+        Content-addressed files go when their count reaches zero; older timestamped
+        files go when no product references them. Files are removed in the background
+        """
+        urls = {url for url in urls if parse_content_url(url) or is_legacy_url(url)}
+        if not urls:
+            return None
+        decided_at = time.time()
+        doomed = []
+        for url in urls:
+            parsed = parse_content_url(url)
+            if parsed:
+                deleted = UploadBlob.query.filter(
+                    UploadBlob.digest == parsed[0], UploadBlob.ref_count <= 0
+                ).delete(synchronize_session=False)
+                if deleted:
+                    doomed.append(url)
+        db.session.commit()
+
+        legacy = [url for url in urls if not parse_content_url(url)]
+        if legacy:
+            still_used = {url for (url,) in
+                          db.session.query(Product.image_url).filter(Product.image_url.in_(legacy))}
+            doomed.extend(url for url in legacy if url not in still_used)
+        if not doomed:
+            return None
+        thread = threading.Thread(target=self._remove_files_in_context, args=(doomed, decided_at),
+                                  name='upload-cleanup', daemon=True)
+        thread.start()
+        return thread
+
+    def _remove_files_in_context(self, urls, decided_at):
+        with self.app.app_context():
+            self._remove_files(urls, decided_at)
+
+    def _still_used(self, urls):
+        """URLs a product or a reference count has claimed again since they were doomed"""
+        used = {url for (url,) in db.session.query(Product.image_url).filter(Product.image_url.in_(urls))}
+        digests = {parse_content_url(url)[0]: url for url in urls if parse_content_url(url)}
+        if digests:
+            used.update(digests[digest] for (digest,) in db.session.query(UploadBlob.digest).filter(
+                UploadBlob.digest.in_(list(digests)), UploadBlob.ref_count > 0))
+        return used
+
+    def _remove_files(self, urls, decided_at):
+        """
+        Delete originals together with the variants named after them
+        Each file is checked again first: an upload of the same content may have
+        committed, or refreshed the file's mtime, since the decision to delete it
+        """
+        removed = 0
+        still_used = self._still_used(urls)
+        for url in urls:
+            stem = os.path.splitext(os.path.basename(url))[0]
+            try:
+                stat = self.storage.stat(_key(url))
+                if url in still_used or (stat is not None and stat[1] >= decided_at):
+                    continue
+                removed += int(self.storage.delete(_key(url)))
+                removed += self.storage.delete_prefix(f"{VARIANT_DIR}/{stem}-")
+            except Exception as e:
+                logger.warning(f"Failed to delete upload {url}: {e}")
+        logger.info(f"Upload cleanup removed {removed} file(s) for {len(urls)} image(s)")
+
+    # ===== HTTP =====
+
+    def _redirect_to_storage(self):
+        """Send clients straight to the bucket so workers never proxy image bytes"""
+        if not request.path.startswith(UPLOADS_PREFIX):
+            return None
+        if any(part.startswith('.') for part in _key(request.path).split('/')):
+            # Temporary and other hidden files are never public
+            abort(404)
+        target = self.storage.url(_key(request.path))
+        if target is None:
+            return None
+        response = redirect(target, code=302)
+        if getattr(self.storage, 'public_url', None):
+            response.headers['Cache-Control'] = (IMMUTABLE_CACHE_CONTROL if IMMUTABLE_PATH_RE.match(request.path)
+                                                 else 'public, max-age=300')
+        else:
+            # Presigned URLs expire; let clients reuse one for half its lifetime
+            response.headers['Cache-Control'] = f'private, max-age={self.storage.url_expires // 2}'
+        return response
+
+    def _cache_headers(self, response):
+        if response.status_code in (200, 304) and IMMUTABLE_PATH_RE.match(request.path):
+            # Replaces the no-cache Flask sends for static files without a max age
+            response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+        return response
+
+    # ===== CLI =====
+
+    def adopt_legacy(self):
+        """Move timestamp-named uploads into content-addressed storage; returns (moved, missing)"""
+        moved = missing = 0
+        legacy = [url for (url,) in db.session.query(Product.image_url).filter(
+            Product.image_url.like(UPLOADS_PREFIX + '%')).distinct() if is_legacy_url(url)]
+        for url in legacy:
+            if not self.storage.exists(_key(url)):
+                missing += 1
+                continue
+            source = self.storage.open(_key(url))
+            try:
+                hasher = hashlib.sha256()
+                for chunk in iter(lambda: source.read(HASH_CHUNK_SIZE), b''):
+                    hasher.update(chunk)
+            finally:
+                source.close()
+            new_url = content_url(hasher.hexdigest(), _extension(url))
+            if not self.storage.exists(_key(new_url)):
+                self.storage.rename(_key(url), _key(new_url), IMMUTABLE_CACHE_CONTROL)
+            Product.query.filter_by(image_url=url).update(
+                {'image_url': new_url, 'image_variants': None}, synchronize_session=False
+            )
+            db.session.commit()
+            # Drops the duplicate copy, if any, and variants named after the old file
+            self._remove_files([url], time.time())
+            moved += 1
+        return moved, missing
+
+    def register_commands(self, app):
+        """Register the `uploads` command group on the Flask CLI"""
+
+        @app.cli.group('uploads')
+        def uploads_cli():
+            """Upload storage commands"""
+
+        self.cli = uploads_cli
+
+        @uploads_cli.command('reconcile')
+        @click.option('--dry-run', is_flag=True, help='Report drift without fixing it')
+        def reconcile_command(dry_run):
+            """Recompute upload reference counts from products"""
+            with db.engine.begin() as conn:
+                corrections = reconcile(conn, dry_run=dry_run)
+            for digest, stored, actual in corrections:
+                click.echo(f"{digest[:16]}  stored {stored if stored is not None else '-':>5}  actual {actual:>5}")
+            verb = 'Found' if dry_run else 'Fixed'
+            click.echo(f"{verb} {len(corrections)} drifted count(s)")
+
+        @uploads_cli.command('push')
+        def push_command():
+            """Copy every file from the local uploads folder to the configured storage"""
+            if isinstance(self.storage, LocalStorage):
+                raise click.ClickException('UPLOAD_STORAGE is local; nothing to push to')
+            local = LocalStorage(self.upload_folder)
+            copied = skipped = 0
+            for key, _, _ in local.iter_files():
+                if key.startswith('.') or self.storage.exists(key):
+                    skipped += 1
+                    continue
+                fd, tmp_path = tempfile.mkstemp(dir=self.storage.temp_dir)
+                with os.fdopen(fd, 'wb') as out, local.open(key) as source:
+                    for chunk in iter(lambda: source.read(HASH_CHUNK_SIZE), b''):
+                        out.write(chunk)
+                self.put(key, tmp_path)
+                copied += 1
+            click.echo(f"Copied {copied} file(s), {skipped} already present or skipped")
+
+        @uploads_cli.command('adopt')
+        def adopt_command():
+            """Rename legacy uploads to their content digest and deduplicate them"""
+            moved, missing = self.adopt_legacy()
+            with db.engine.begin() as conn:
+                reconcile(conn)
+            click.echo(f"Moved {moved} upload(s), {missing} missing on disk; "
+                       f"run `flask images process` to rebuild their variants")
+
+
+def _actual_counts(conn):
+    counts = {}
+    rows = conn.execute(
+        select(Product.image_url, func.count(Product.id))
+        .where(Product.image_url.like(UPLOADS_PREFIX + '%'))
+        .group_by(Product.image_url)
+    )
+    for url, count in rows:
+        parsed = parse_content_url(url)
+        if parsed:
+            digest, extension = parsed
+            total, _ = counts.get(digest, (0, extension))
+            counts[digest] = (total + count, extension)
+    return counts
+
+
+def reconcile(conn, dry_run=False):
+    """
+    Rewrite reference counts that drifted from products.image_url
+    Returns [(digest, stored, actual)] for every corrected row
+    """
+    actual = _actual_counts(conn)
+    table = UploadBlob.__table__
+    stored = {digest: count for digest, count in conn.execute(select(table.c.digest, table.c.ref_count))}
+
+    corrections = []
+    for digest in sorted(set(actual) | set(stored)):
+        expected, extension = actual.get(digest, (0, None))
+        if stored.get(digest) == expected:
+            continue
+        corrections.append((digest, stored.get(digest), expected))
+        if dry_run:
+            continue
+        if digest in stored:
+            conn.execute(table.update().where(table.c.digest == digest).values(ref_count=expected))
+        else:
+            conn.execute(table.insert().values(digest=digest, extension=extension, size=0,
+                                               ref_count=expected, created_at=datetime.utcnow()))
+    return corrections
+
+
+@migration(6, 'Reference-counted content-addressed uploads')
+def _upload_blobs(conn):
+    UploadBlob.__table__.create(conn, checkfirst=True)
+    reconcile(conn)
+
+
+# Global instance
+upload_store = UploadStore()
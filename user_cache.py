@@ -0,0 +1,169 @@
+"""
+Cached user loading for Flohmarkt
+Serves Flask-Login's user_loader from a process-local TTL/LRU cache keyed by user id
+and session version, with per-user version tags so every worker drops stale entries
+"""
+
+import logging
+import os
+
+from sqlalchemy import event, inspect, text
+from sqlalchemy.orm import Session, make_transient_to_detached
+
+from app import db
+from cache import TTLCache
+from migrations import has_column, migration
+from models import User
+from response_cache import create_backend, default_backend_name
+
+logger = logging.getLogger(__name__)
+
+# Changing one of these ends every other session of the user
+SESSION_FIELDS = ('password',)
+PENDING_KEY = 'user_cache.changed'
+# Cached for users whose session id no longer matches, so stale cookies stay off the database too
+REJECTED = False
+
+
+def user_tag(user_id):
+    return f'user:{user_id}'
+
+
+def parse_session_id(value):
+    """(user id, session version) from a Flask-Login id; ids issued before versions carry only the id"""
+    user_id, _, version = str(value).partition(':')
+    try:
+        return int(user_id), int(version or 0)
+    except ValueError:
+        return None, None
+
+
+def _snapshot(user):
+    return {attr.key: getattr(user, attr.key) for attr in inspect(User).column_attrs}
+
+
+# ===== Write-time invalidation =====
+
+@event.listens_for(User, 'before_update')
+def _bump_session_version(mapper, connection, user):
+    state = inspect(user)
+    if any(state.attrs[name].history.has_changes() for name in SESSION_FIELDS):
+        user.session_version = (user.session_version or 0) + 1
+
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _remember_changed(mapper, connection, user):
+    # Tags are bumped after commit; bumping at flush would let another worker cache the old row again
+    session = Session.object_session(user)
+    if session is not None:
+        session.info.setdefault(PENDING_KEY, set()).add(user.id)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_committed(session):
+    user_ids = sorted(session.info.pop(PENDING_KEY, ()))
+    for user_id in user_ids:
+        user_cache.invalidate(user_id)
+    if user_ids and user_cache.on_changed:
+        try:
+            user_cache.on_changed(user_ids)
+        except Exception as e:
+            logger.warning(f"User change callback failed for {user_ids}: {e}")
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _forget_rolled_back(session, previous_transaction):
+    if not session.in_transaction():
+        session.info.pop(PENDING_KEY, None)
+
+
+class UserCache:
+    def __init__(self, app=None):
+        self.cache = TTLCache()
+        self.enabled = True
+        self.backend = None
+        self.rejected = 0
+        self.on_changed = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app, on_changed=None):
+        """
+        USER_CACHE_TTL=0 disables the cache; USER_CACHE_SIZE bounds it per worker
+        `on_changed(user_ids)` runs after a commit that updated or deleted users
+        """
+        self.on_changed = on_changed
+        ttl = int(os.environ.get('USER_CACHE_TTL', 60))
+        self.enabled = ttl > 0
+        self.cache = TTLCache(ttl=ttl, maxsize=int(os.environ.get('USER_CACHE_SIZE', 4096)))
+        try:
+            self.backend = create_backend(default_backend_name(), namespace='users')
+        except Exception as e:
+            # Entries then expire after the TTL at the latest on the other workers
+            logger.error(f"User cache invalidation limited to this worker: {e}")
+            self.backend = None
+
+    def _tag_version(self, user_id):
+        """Shared version of the user's tag, 0 without a backend, None when it cannot be read"""
+        if self.backend is None:
+            return 0
+        try:
+            return self.backend.get_versions([user_tag(user_id)])[0]
+        except Exception as e:
+            logger.warning(f"User cache version lookup failed for user {user_id}: {e}")
+            return None
+
+    def load(self, session_id):
+        """
+        The user for a Flask-Login session id, or None to log the session out
+        Cache hits are attached to the request's session without a query, so
+        relationships and writes behave as for a freshly loaded user
+        """
+        user_id, version = parse_session_id(session_id)
+        if user_id is None:
+            return None
+        tag_version = self._tag_version(user_id) if self.enabled else None
+        key = (user_id, version, tag_version)
+        columns = self.cache.get(key) if tag_version is not None else None
+        if columns is REJECTED:
+            self.rejected += 1
+            return None
+        if columns is not None:
+            user = User(**columns)
+            make_transient_to_detached(user)
+            return db.session.merge(user, load=False)
+
+        user = db.session.get(User, user_id)
+        valid = user is not None and (user.session_version or 0) == version
+        if tag_version is not None:
+            self.cache.set(key, _snapshot(user) if valid else REJECTED)
+        if not valid:
+            self.rejected += 1
+            return None
+        return user
+
+    def invalidate(self, user_id):
+        """Drop cached copies of a user in this worker and, through its tag, in every other one"""
+        if self.backend is None:
+            self.cache.clear()
+            return
+        try:
+            self.backend.bump(user_tag(user_id))
+        except Exception as e:
+            logger.warning(f"User cache invalidation failed for user {user_id}: {e}")
+            self.cache.clear()
+
+    def stats(self):
+        return dict(self.cache.stats(), enabled=self.enabled, ttl=self.cache.ttl, rejected=self.rejected,
+                    shared=self.backend is not None)
+
+
+@migration(7, 'Session versions for cached user loading')
+def _session_version_column(conn):
+    if not has_column(conn, 'users', 'session_version'):
+        conn.execute(text("ALTER TABLE users ADD COLUMN session_version INTEGER NOT NULL DEFAULT 0"))
+
+
+# Global instance
+user_cache = UserCache()